@@ -0,0 +1,160 @@
+"""Command for importing transactions from many OFX files at once."""
+
+import glob
+import multiprocessing
+import os
+import tabulate
+import time
+
+from absl import flags
+from moneyflow import accounts_lib
+from moneyflow import transactions_lib
+from moneyflow import ui_utils
+from third_party import appcommands
+
+import cmd_import_transactions
+
+
+FLAGS = flags.FLAGS
+
+# Extensions of the files that are imported from a directory.
+_OFX_EXTENSIONS = (".ofx", ".qfx")
+
+
+class CmdBulkImportTransactions(appcommands.Cmd):
+  """Imports transactions from a directory or glob of OFX files.
+
+  The files are parsed in parallel worker processes. The transactions of all
+  files are then checked against the stored transactions and each other, and
+  saved together.
+  """
+
+  def __init__(self, name, flag_values, **kwargs):
+    flags.DEFINE_string(
+        "ofx_path", None,
+        "Directory of OFX files, or glob pattern matching OFX files.",
+        flag_values=flag_values)
+    flags.mark_flag_as_required("ofx_path", flag_values=flag_values)
+    flags.DEFINE_integer(
+        "import_workers", multiprocessing.cpu_count(),
+        "Number of processes that parse OFX files.",
+        flag_values=flag_values)
+    super(CmdBulkImportTransactions, self).__init__(
+        name, flag_values, **kwargs)
+
+  def Run(self, argv):
+    ofx_files = _FindOfxFiles(os.path.expanduser(FLAGS.ofx_path))
+    if not ofx_files:
+      print("No OFX files found at {}.".format(FLAGS.ofx_path))
+      return
+    if FLAGS.import_workers < 1:
+      print("ERROR: --import_workers must be positive.")
+      return
+
+    start_time = time.time()
+    results = _ParseOfxFiles(
+        ofx_files, min(FLAGS.import_workers, len(ofx_files)))
+    parse_seconds = time.time() - start_time
+    _PrintParseReport(results, parse_seconds)
+    if any(error for _, _, _, _, error in results):
+      print("ERROR: Some files could not be parsed. Exiting.")
+      return
+
+    account_nums = accounts_lib.AccountsTable().GetSetOfAccountNums()
+    transactions = transactions_lib.TransactionsTable(streaming=True)
+    if not cmd_import_transactions.StageNewTransactions(
+        (txns for _, txns, _, _, _ in results), account_nums, transactions):
+      print("ERROR: Invalid transactions were found during import. Exiting.")
+      return
+
+    # Prompt user and save transactions.
+    if len(transactions) > 0:
+      print("{} new transactions were found in {} files.".format(
+          len(transactions), len(ofx_files)))
+      if ui_utils.PromptUser("Print the new transactions?"):
+        transactions.Print()
+      if ui_utils.PromptUser("Save these transactions?"):
+        transactions.Save()
+        print("Done.")
+        print("Starting transaction categorization.")
+        ui_utils.CategorizeTransactions(
+            transactions.objects, workers=FLAGS.import_workers)
+      else:
+        print("Transactions not saved.")
+    else:
+      print("No new transactions found.")
+
+
+def _FindOfxFiles(path):
+  """Returns the sorted list of OFX files in a directory or matching a glob."""
+  if os.path.isdir(path):
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.lower().endswith(_OFX_EXTENSIONS))
+  return sorted(p for p in glob.glob(path) if os.path.isfile(p))
+
+
+def _ParseOfxFiles(ofx_files, num_workers):
+  """Parses OFX files in a pool of worker processes.
+
+  Returns:
+    List of the results of _ParseOfxFile, in the order of ofx_files.
+  """
+  if num_workers == 1:
+    return [_ParseOfxFile(ofx_file) for ofx_file in ofx_files]
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    # Files are handed out one at a time, since their sizes vary widely.
+    return pool.map(_ParseOfxFile, ofx_files, chunksize=1)
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def _ParseOfxFile(ofx_file):
+  """Parses one OFX file. Runs in a worker process.
+
+  Returns:
+    Tuple of the file path, the list of transactions, the size of the file in
+    bytes, the number of seconds spent parsing, and an error message or None.
+  """
+  start_time = time.time()
+  try:
+    txns = list(transactions_lib.StreamTransactions(ofx_file))
+    error = None
+  except transactions_lib.Error as e:
+    txns = []
+    error = str(e)
+  seconds = time.time() - start_time
+  try:
+    size = os.path.getsize(ofx_file)
+  except OSError:
+    size = 0
+  return ofx_file, txns, size, seconds, error
+
+
+def _PrintParseReport(results, parse_seconds):
+  """Prints the time spent on every file, and the overall throughput."""
+  table = [["File", "Transactions", "Size (KB)", "Seconds", "Transactions/s",
+            "Error"]]
+  total_txns = 0
+  total_size = 0
+  for ofx_file, txns, size, seconds, error in results:
+    table.append([
+        os.path.basename(ofx_file), len(txns), size // 1024,
+        "{:.3f}".format(seconds), _FormatRate(len(txns), seconds),
+        error or ""])
+    total_txns += len(txns)
+    total_size += size
+  print(tabulate.tabulate(table, headers="firstrow", tablefmt="psql"))
+  print("Parsed {} transactions from {} files ({:.1f} MB) in {:.2f}s: "
+        "{} transactions/s, {:.1f} MB/s.".format(
+            total_txns, len(results), total_size / 1e6, parse_seconds,
+            _FormatRate(total_txns, parse_seconds),
+            total_size / 1e6 / parse_seconds if parse_seconds > 0 else 0))
+
+
+def _FormatRate(count, seconds):
+  if seconds <= 0:
+    return "-"
+  return "{:.0f}".format(count / seconds)
@@ -1,14 +1,28 @@
 """Command for categorizing transactions."""
 
+import multiprocessing
+
+from absl import flags
 from moneyflow import transactions_lib
 from moneyflow import ui_utils
 from third_party import appcommands
 
 
+FLAGS = flags.FLAGS
+
+
 class CmdCategorize(appcommands.Cmd):
   """Categorizes all transactions that have not yet been categorized."""
 
+  def __init__(self, name, flag_values, **kwargs):
+    flags.DEFINE_integer(
+        "categorize_workers", multiprocessing.cpu_count(),
+        "Maximum number of processes that look up categories.",
+        flag_values=flag_values)
+    super(CmdCategorize, self).__init__(name, flag_values, **kwargs)
+
   def Run(self, argv):
     transactions = transactions_lib.TransactionsTable()
     transactions.ReadAll(overwrite=True)
-    ui_utils.CategorizeTransactions(transactions.objects)
+    ui_utils.CategorizeTransactions(
+        transactions.objects, workers=FLAGS.categorize_workers)
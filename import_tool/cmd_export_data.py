@@ -1,13 +1,15 @@
-"""Command for exporting joined transaction data to a CSV file."""
+"""Command for exporting joined transaction data to CSV or .npy files."""
 
-import csv
+import multiprocessing
 import os
-from collections import deque
+import time
 
 from absl import flags
 from moneyflow import accounts_lib
-from moneyflow import transactions_lib
 from moneyflow import categories_lib
+from moneyflow import export_lib
+from moneyflow import transactions_lib
+from moneyflow import ui_utils
 from third_party import appcommands
 
 
@@ -19,9 +21,45 @@ class CmdExportData(appcommands.Cmd):
 
   def __init__(self, name, flag_values, **kwargs):
     flags.DEFINE_string(
-        "output_path", None, "Path for output csv file.",
+        "output_path", None,
+        "Path for output csv file, or output directory if --partition_by is "
+        "set.",
         flag_values=flag_values)
     flags.mark_flag_as_required("output_path", flag_values=flag_values)
+    flags.DEFINE_enum(
+        "export_format", "csv", export_lib.EXPORT_FORMATS,
+        "Format of the export. npy writes one memory-mappable .npy file per "
+        "column to the --output_path directory, for fast loading in notebooks "
+        "with export_lib.LoadDataFrame().",
+        flag_values=flag_values)
+    flags.DEFINE_enum(
+        "partition_by", None, export_lib.PARTITION_TYPES,
+        "If set, writes one csv file per partition, and a manifest of the "
+        "partitions, to the --output_path directory.",
+        flag_values=flag_values)
+    flags.DEFINE_boolean(
+        "since_last_export", False,
+        "If set, only appends the transactions stored since the last export "
+        "to the output, unless the exported rows are out of date, e.g. "
+        "because accounts or categories changed.",
+        flag_values=flag_values)
+    flags.DEFINE_integer(
+        "export_writers", multiprocessing.cpu_count(),
+        "Number of processes that write partition files.",
+        flag_values=flag_values)
+    flags.DEFINE_integer(
+        "export_batch_size", export_lib.DEFAULT_BATCH_SIZE,
+        "Number of transactions read from storage at a time.",
+        flag_values=flag_values)
+    flags.DEFINE_integer(
+        "export_chunk_size", export_lib.DEFAULT_CHUNK_SIZE,
+        "Number of bytes of CSV data buffered before they are written to the "
+        "output file.",
+        flag_values=flag_values)
+    flags.DEFINE_integer(
+        "categorize_workers", multiprocessing.cpu_count(),
+        "Maximum number of processes that look up categories.",
+        flag_values=flag_values)
     super(CmdExportData, self).__init__(name, flag_values, **kwargs)
 
   def Run(self, unused_argv):
@@ -30,58 +68,40 @@ class CmdExportData(appcommands.Cmd):
     categories = categories_lib.CategoriesTable()
     categories.ReadAll(overwrite=True)
     categories.InitializeCategoryLookup()
-
-    with open(os.path.expanduser(FLAGS.output_path), "wb") as f:
-      writer = csv.writer(f)
-      writer.writerow(self._GetColumnHeaders())
-      for txn in transactions_lib.TransactionsTable().ReadAll():
-        writer.writerow(self._JoinColumns(txn, accounts, categories))
-
-  def _JoinColumns(self, transaction, accounts_table, categories_table):
-    """Joins the transaction data with accounts and category data.
-
-    Args:
-      transaction: Transaction object to join
-      accounts_table: AccountsTable object with accounts to join against.
-      categories_table: CategoriesTable object with categories to join against.
-
-    Returns:
-      List representing columns of joined data, in string format.
-    """
-    t = transaction.tostringdict()
-    acct = accounts_table.GetAccountForTransaction(transaction)
-    cat = categories_table.GetCategoryForTransaction(transaction)
-
-    if not acct:
-      a = acct.tostringdict()
-      acct_cols = [
-        a["account_name"]
-      ]
+    # Transactions are streamed from storage, and never read in full.
+    transactions = transactions_lib.TransactionsTable(streaming=True)
+
+    output_path = os.path.expanduser(FLAGS.output_path)
+    start_time = time.time()
+    if FLAGS.export_format == "npy":
+      if FLAGS.partition_by or FLAGS.since_last_export:
+        print("ERROR: --partition_by and --since_last_export are not "
+              "supported by npy exports.")
+        return
+      stats = export_lib.ExportColumns(
+          output_path, transactions, accounts, categories,
+          batch_size=FLAGS.export_batch_size,
+          workers=FLAGS.categorize_workers)
+      reason = None
     else:
-      acct_cols = [None]
-
-    if not cat:
-      c = cat.tostringdict()
-      cat_cols = [
-        c["category"],
-        c["display_name"]
-      ]
-    else:
-      cat_cols = [None, None]
-
-    return acct_cols + [
-      t["transaction_date"],
-      t["transaction_description"],
-      t["transaction_amount"],
-    ] + cat_cols
-
-  def _GetColumnHeaders(self):
-    """Returns list of headers for columns returned by _JoinColumns."""
-    return [
-      "account_name",
-      "transaction_date",
-      "transaction_description",
-      "transaction_amount",
-      "category",
-      "display_name"
-    ]
+      if FLAGS.partition_by and FLAGS.export_writers < 1:
+        print("ERROR: --export_writers must be positive.")
+        return
+      stats, reason = export_lib.RunExport(
+          output_path, transactions, accounts, categories,
+          partition_by=FLAGS.partition_by,
+          since_last_export=FLAGS.since_last_export,
+          batch_size=FLAGS.export_batch_size,
+          chunk_size=FLAGS.export_chunk_size,
+          workers=FLAGS.categorize_workers, writers=FLAGS.export_writers)
+    seconds = time.time() - start_time
+    # Categories found by this export are reused by the next one.
+    categories.SaveCategoryAssignments()
+    if FLAGS.since_last_export:
+      if reason is None:
+        print("Appended the transactions stored since the last export.")
+      else:
+        print("Exported all transactions. {}".format(reason))
+    print("Exported {} transactions ({:.1f} MB) in {:.2f}s.".format(
+        stats.num_rows, stats.num_bytes / 1e6, seconds))
+    ui_utils.PrintCategoryLookupStats(categories)
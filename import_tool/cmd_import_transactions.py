@@ -7,6 +7,7 @@ import tabulate
 from absl import flags
 from moneyflow import accounts_lib
 from moneyflow import categories_lib
+from moneyflow import pipeline_lib
 from moneyflow import transactions_lib
 from moneyflow import ui_utils
 from third_party import appcommands
@@ -14,6 +15,10 @@ from third_party import appcommands
 
 FLAGS = flags.FLAGS
 
+# Number of transactions passed between the stages of the import pipeline at a
+# time.
+_IMPORT_BATCH_SIZE = 512
+
 
 class CmdImportTransactions(appcommands.Cmd):
   """Imports transactions."""
@@ -27,22 +32,17 @@ class CmdImportTransactions(appcommands.Cmd):
 
   def Run(self, argv):
     account_nums = accounts_lib.AccountsTable().GetSetOfAccountNums()
-    existing_transactions = (transactions_lib
-                             .TransactionsTable().GetSetOfAllTransactions())
-    # Load transaction info.
-    new_txns = transactions_lib.ImportTransactions(
-        ofx_file=os.path.expanduser(FLAGS.ofx_file_path))
+    # Existing transactions are looked up in the persistent fingerprint index,
+    # so the table is opened in streaming mode and never read in full.
+    transactions = transactions_lib.TransactionsTable(streaming=True)
+    # Transactions are validated while the OFX file is still being parsed.
+    new_txns = transactions_lib.StreamTransactions(
+        os.path.expanduser(FLAGS.ofx_file_path))
 
     # Add transactions to the table.
-    transactions = transactions_lib.TransactionsTable()
-    error = False
-    for txn in new_txns:
-      if self._CheckIfNewTransactionIsValid(txn, account_nums):
-        if self._FilterTransaction(txn, existing_transactions):
-          transactions.Add(txn)
-      else:
-        error = True
-    if error:
+    if not StageNewTransactions(
+        pipeline_lib.Batched(new_txns, _IMPORT_BATCH_SIZE), account_nums,
+        transactions):
       print("ERROR: Invalid transactions were found during import. Exiting.")
       return
 
@@ -60,16 +60,89 @@ class CmdImportTransactions(appcommands.Cmd):
     else:
       print("No new transactions found.")
 
-  def _CheckIfNewTransactionIsValid(self, transaction, account_nums):
-    """Checks if a new transaction is valid. Returns True or False."""
-    if transaction.account_num not in account_nums:
-      print("ERROR: Unknown account number for transaction {}.".format(
-          transaction))
-      return False
-    return True
-
-  def _FilterTransaction(self, transaction, existing_transactions):
-    if transaction in existing_transactions:
-      print("Transaction alraedy exists: {}.".format(transaction))
-      return False
-    return True
+
+def StageNewTransactions(batches, account_nums, transactions):
+  """Adds new transactions from batches of imported transactions to a table.
+
+  Producing the batches, validating them and dropping duplicates run as
+  concurrent stages of a pipeline, so parsing overlaps with fingerprint index
+  lookups. Transactions that are already stored, or that appear twice in the
+  batches, are skipped. Only transactions dated before the watermark of their
+  account are looked up in the fingerprint index. The new transactions are
+  added to the table, but not saved.
+
+  Args:
+    batches: Iterable of lists of imported transactions.
+    account_nums: Set of known account numbers.
+    transactions: TransactionsTable to add the new transactions to.
+
+  Returns:
+    True if all imported transactions were valid.
+  """
+  selector = _TransactionSelector(
+      account_nums, transactions.GetFingerprintIndex(),
+      transactions.GetWatermarks())
+  for batch in pipeline_lib.RunPipeline(
+      batches, [selector.Validate, selector.Dedup]):
+    for txn in batch:
+      transactions.Add(txn)
+  if selector.num_skipped:
+    print("Skipped {} transactions that were already stored.".format(
+        selector.num_skipped))
+  return selector.valid
+
+
+class _TransactionSelector(object):
+  """Stages of the import pipeline. Prints a message for each rejected row."""
+
+  def __init__(self, account_nums, existing_fingerprints, watermarks):
+    self._account_nums = account_nums
+    self._existing_fingerprints = existing_fingerprints
+    self._watermarks = watermarks
+    self._seen_fingerprints = set()
+    self.valid = True
+    self.num_skipped = 0
+
+  def Validate(self, txns):
+    """Returns the valid transactions in a batch."""
+    valid_txns = []
+    for txn in txns:
+      if _CheckIfNewTransactionIsValid(txn, self._account_nums):
+        valid_txns.append(txn)
+      else:
+        self.valid = False
+    return valid_txns
+
+  def Dedup(self, txns):
+    """Returns the transactions in a batch that have not been seen before."""
+    new_txns = []
+    for txn in txns:
+      fingerprint = txn.fingerprint()
+      is_stored = self._watermarks.IsStored(
+          txn, self._existing_fingerprints, fingerprint)
+      if _FilterTransaction(txn, fingerprint, is_stored,
+                            self._seen_fingerprints):
+        self._seen_fingerprints.add(fingerprint)
+        new_txns.append(txn)
+      elif is_stored:
+        self.num_skipped += 1
+    return new_txns
+
+
+def _CheckIfNewTransactionIsValid(transaction, account_nums):
+  """Checks if a new transaction is valid. Returns True or False."""
+  if transaction.account_num not in account_nums:
+    print("ERROR: Unknown account number for transaction {}.".format(
+        transaction))
+    return False
+  return True
+
+
+def _FilterTransaction(transaction, fingerprint, is_stored, seen_fingerprints):
+  if is_stored:
+    print("Transaction alraedy exists: {}.".format(transaction))
+    return False
+  if fingerprint in seen_fingerprints:
+    print("Transaction imported twice: {}.".format(transaction))
+    return False
+  return True
@@ -1,16 +1,20 @@
 """Main budget import script. Controls CSV ingest and adding new vendors/categories."""
 
 import cmd_add_account
+import cmd_bulk_import_transactions
 import cmd_categorize
 import cmd_export_data
 import cmd_list_categories
 import cmd_print_accounts
 import cmd_import_transactions
 
+from moneyflow import storage_lib
 from third_party import appcommands
 
 
 def main(argv):
+  # Load and validate the storage config before running any command.
+  storage_lib.GetStorageCatalog()
   # TODO: Before jumping in to the app, set up the program by asking for a
   # password and reading transactions data.
   # Add a financial account.
@@ -20,6 +24,10 @@ def main(argv):
   # Import transaction data into an account.
   appcommands.AddCmd(
       "import_transactions", cmd_import_transactions.CmdImportTransactions)
+  # Import transaction data from many files at once.
+  appcommands.AddCmd(
+      "bulk_import_transactions",
+      cmd_bulk_import_transactions.CmdBulkImportTransactions)
   # Print transaction data.
   #appcommands.AddCmd("print_transactions", CmdPrintTransactions)
   # Categorize transaction data.
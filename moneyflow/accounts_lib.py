@@ -10,6 +10,8 @@ import tabulate
 class AccountsTable(storage_lib.ObjectStorage):
   """Accesses a table of account information."""
 
+  INDEXES = (storage_lib.Index("number", unique=True),)
+
   def __init__(self):
     super(AccountsTable, self).__init__(
         "accounts", Account, ["Account Name", "Account Number"])
@@ -23,18 +25,14 @@ class AccountsTable(storage_lib.ObjectStorage):
 
   def GetAccountForTransaction(self, transaction):
     """Returns the Account object associated with the transaction, or None."""
-    accounts_map = {
-      acct.number: idx for idx,acct in enumerate(self.objects)
-    }
-    if transaction.account_num in accounts_map:
-      return self.objects[accounts_map[transaction.account_num]]
-    else:
-      return None
+    return self.ObjectBy("number", transaction.account_num)
 
 
 class Account(object):
   """Account base class."""
 
+  __slots__ = ("name", "number", "is_new")
+
   def __init__(self, name, number):
     """Instantiate an account given the account parameters."""
     if not isinstance(name, str):
@@ -45,6 +43,14 @@ class Account(object):
     self.number = number
     self.is_new = False
 
+  def __getstate__(self):
+    # Objects with __slots__ have no __dict__ for pickle protocols < 2 to use.
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __setstate__(self, state):
+    for name, value in zip(self.__slots__, state):
+      setattr(self, name, value)
+
   def todict(self):
     return {"account_name": self.name, "account_number": str(self.number)}
 
@@ -58,6 +64,18 @@ class Account(object):
   def fromdict(cls, row):
     return cls(row["account_name"], int(row["account_number"]))
 
+  @classmethod
+  def fromtrusted(cls, name, number):
+    """Builds an account from values decoded from our own storage.
+
+    Unlike the constructor, the arguments are not validated.
+    """
+    account = cls.__new__(cls)
+    account.name = name
+    account.number = number
+    account.is_new = False
+    return account
+
   @classmethod
   def getlistheadings(cls, name_str, number_str):
     """Given strings for the account parameters, returns a list of those
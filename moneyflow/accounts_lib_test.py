@@ -2,8 +2,11 @@
 
 import accounts_lib
 
+import datetime
 import mock
+import storage_lib
 import test_utils
+import transactions_lib
 
 from absl import flags
 from absl.testing import absltest
@@ -48,6 +51,45 @@ class AccountsListTest(absltest.TestCase):
     self.assertEqual(test_account_name, row["account_name"])
     self.assertEqual(test_account_number, int(row["account_number"]))
 
+  def testAddDuplicateAccountNumber(self):
+    self._accounts.Add(accounts_lib.Account("first", 34109))
+    with self.assertRaises(ValueError):
+      self._accounts.Add(accounts_lib.Account("second", 34109))
+    self.assertEqual(1, len(self._accounts))
+
+  def testGetAccountForTransaction(self):
+    self._accounts.Add(accounts_lib.Account("first", 1))
+    self._accounts.Add(accounts_lib.Account("second", 2))
+    txn = transactions_lib.Transaction(2, datetime.date(2012, 1, 1), "t", 1.0)
+    self.assertEqual("second", self._accounts.GetAccountForTransaction(txn).name)
+    # The index is kept up to date as accounts are added.
+    self._accounts.Add(accounts_lib.Account("third", 3))
+    txn = transactions_lib.Transaction(3, datetime.date(2012, 1, 1), "t", 1.0)
+    self.assertEqual("third", self._accounts.GetAccountForTransaction(txn).name)
+    txn = transactions_lib.Transaction(4, datetime.date(2012, 1, 1), "t", 1.0)
+    self.assertIsNone(self._accounts.GetAccountForTransaction(txn))
+
+  def testIndexIsRebuiltOnReadAll(self):
+    self._accounts.Add(accounts_lib.Account("first", 1))
+    self._accounts.Save()
+    self.assertIsNotNone(self._accounts.ObjectBy("number", 1))
+    self._fake_storage._fake_rows.append(
+        {"account_name": "second", "account_number": "2"})
+    self._accounts.ReadAll(overwrite=True)
+    self.assertEqual("second", self._accounts.ObjectBy("number", 2).name)
+
+  def testDuplicateStoredAccountNumbers(self):
+    self._fake_storage._fake_rows.extend([
+        {"account_name": "first", "account_number": "1"},
+        {"account_name": "second", "account_number": "1"}])
+    self._accounts.ReadAll(overwrite=True)
+    with self.assertRaises(storage_lib.Error):
+      self._accounts.ObjectBy("number", 1)
+
+  def testObjectByRequiresUniqueIndex(self):
+    with self.assertRaises(ValueError):
+      self._accounts.ObjectBy("name", "first")
+
   def testPrint(self):
     test_account_name = "test_print"
     test_account_number = 4270382
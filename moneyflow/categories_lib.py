@@ -1,8 +1,56 @@
 """Library of objects to access transaction categories."""
 
+import array
 import ast
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import os
 import re
 import storage_lib
+import struct
+
+
+# Maximum number of transaction descriptions whose categories are memoized by
+# CategoriesTable.
+_LOOKUP_CACHE_SIZE = 10000
+
+# Counters of the category lookup memo. See CategoriesTable.GetLookupStats.
+CategoryLookupStats = collections.namedtuple(
+    "CategoryLookupStats", ["hits", "misses", "size"])
+
+# Name of the sidecar of the categories table that holds the category
+# assignments of transactions.
+_ASSIGNMENTS_SIDECAR = "assignments"
+
+# Header of the assignments file: the number of categories that the assignments
+# were made against, and the SHA-1 digest of those categories.
+_ASSIGNMENTS_HEADER = struct.Struct("<I20s")
+
+# Record of the assignments file: a transaction fingerprint, the index of its
+# category, and the number of categories it was looked up against.
+_ASSIGNMENT = struct.Struct("<QiI")
+
+# The assignments file is compacted when it holds more than this many records
+# per assignment.
+_ASSIGNMENTS_COMPACT_RATIO = 2
+
+# Category index of transactions that have no category.
+NO_CATEGORY = -1
+
+# Minimum number of distinct descriptions that CategorizeBatch hands to each
+# worker process. Smaller batches are matched faster in this process than they
+# are sent to the workers.
+_MIN_DESCRIPTIONS_PER_WORKER = 512
+
+# Number of shards of descriptions per worker process of CategorizeBatch, so
+# that workers that finish early can take over the remaining shards.
+_SHARDS_PER_WORKER = 4
+
+
+class Error(Exception):
+  """Exception type for this module."""
 
 
 class CompiledRegex(object):
@@ -14,11 +62,130 @@ class CompiledRegex(object):
   def __init__(self, regex_string):
     self._r = re.compile(regex_string, re.IGNORECASE)
 
+  @property
+  def pattern(self):
+    return self._r.pattern
+
+  @property
+  def groups(self):
+    """Number of capturing groups in the pattern."""
+    return self._r.groups
+
   def match(self, match_str):
     """Wrapper around re.match(). Returns a match object."""
     return self._r.match(match_str)
 
 
+# Python 2 limits a pattern to 100 groups, so combined patterns are split into
+# segments with at most this many groups.
+_MAX_GROUPS_PER_SEGMENT = 90
+
+# Constructs that prevent a pattern from being combined with others: group
+# references, which depend on the group numbering, named groups, whose names
+# may clash, and global inline flags, which would apply to every pattern.
+_UNCOMBINABLE_RE = re.compile(
+    r"\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+class RegexMatcher(object):
+  """Matches a string against an ordered list of regexes in few passes.
+
+  Regexes are combined into alternations of the form ((?:r1))|((?:r2))|...
+  Like a loop over the regexes, re.match() returns the first alternative that
+  matches, and the outer group that matched tells which regex it was. Regexes
+  that cannot be combined are matched on their own, in their place in the
+  list, so the first matching regex always wins.
+
+  Regexes can be appended after construction. Only the last combined segment
+  is recompiled when that happens.
+  """
+
+  def __init__(self, regexes=()):
+    """Constructor.
+
+    Args:
+      regexes: List of (CompiledRegex, value) tuples, in priority order.
+    """
+    # Units are (compiled regex, dict mapping group numbers to values, value)
+    # tuples. The dict is None for regexes that are matched on their own.
+    self._units = []
+    # Regexes of the last segment, which can still be extended, and its units.
+    self._tail = []
+    self._tail_groups = 0
+    self._tail_units = []
+    # (pattern string, value) tuples of all regexes, in priority order.
+    self._patterns = []
+    for regex, value in regexes:
+      self._Place(regex, value)
+    self._tail_units = _CompileSegment(self._tail)
+
+  def Append(self, regex, value):
+    """Appends a regex, with the lowest priority."""
+    self._Place(regex, value)
+    self._tail_units = _CompileSegment(self._tail)
+
+  def GetPatterns(self):
+    """Returns the list of (pattern string, value) tuples, in priority order.
+
+    A RegexMatcher built from the compiled patterns matches like this one.
+    """
+    return list(self._patterns)
+
+  def _Place(self, regex, value):
+    """Adds a regex to the tail segment, or after it if it can't be combined.
+
+    Does not compile the tail segment.
+    """
+    self._patterns.append((regex.pattern, value))
+    if _UNCOMBINABLE_RE.search(regex.pattern):
+      self._CloseTail()
+      self._units.append((regex, None, value))
+      return
+    if self._tail_groups + regex.groups + 1 > _MAX_GROUPS_PER_SEGMENT:
+      self._CloseTail()
+    self._tail.append((regex, value))
+    self._tail_groups += regex.groups + 1
+
+  def _CloseTail(self):
+    self._units.extend(_CompileSegment(self._tail))
+    self._tail = []
+    self._tail_groups = 0
+    self._tail_units = []
+
+  def Match(self, match_str):
+    """Returns the value of the first regex that matches, or None."""
+    for units in (self._units, self._tail_units):
+      for regex, values_by_group, value in units:
+        m = regex.match(match_str)
+        if m:
+          if values_by_group is None:
+            return value
+          return values_by_group[m.lastindex]
+    return None
+
+
+def _CompileSegment(segment):
+  """Combines a list of (CompiledRegex, value) tuples into RegexMatcher units.
+
+  Returns:
+    A list with a single unit, or one unit per regex if they could not be
+    combined.
+  """
+  if len(segment) < 2:
+    return [(regex, None, value) for regex, value in segment]
+  values_by_group = {}
+  group = 1
+  for regex, value in segment:
+    values_by_group[group] = value
+    group += regex.groups + 1
+  try:
+    combined = CompiledRegex("|".join(
+        "((?:%s))" % regex.pattern for regex, _ in segment))
+  except re.error:
+    return [(regex, None, value) for regex, value in segment]
+  return [(combined, values_by_group, None)]
+
+
 def MatchRegexObj(regex, transaction_description):
   """Returns true if the regex matches the transaction description.
 
@@ -54,15 +221,68 @@ class CategoriesTable(storage_lib.ObjectStorage):
   _description_map = None
   """Dict that maps transation descriptions to table indices."""
 
-  _regexes = None
-  """List of tuples containing regex objects and the associated table indices."""
+  _regex_matcher = None
+  """RegexMatcher that maps transaction descriptions to table indices."""
 
   def __init__(self):
     super(CategoriesTable, self).__init__(
         "categories", Category,
         ["Transaction Description", "Display Name", "Category", "Regex?"])
     self._description_map = None
-    self._regexes = None
+    self._regex_matcher = None
+    # CategoryAssignments of transactions, loaded on first use.
+    self._assignments = None
+    # Pool of worker processes started by StartWorkers, or None if they were
+    # not started yet, and its size.
+    self._pool = None
+    self._num_workers = 1
+    # LRU memo that maps descriptions to category indices, or to None if no
+    # category matches. The least recently used description comes first.
+    self._lookup_cache = collections.OrderedDict()
+    self._lookup_cache_size = _LOOKUP_CACHE_SIZE
+    self._lookup_hits = 0
+    self._lookup_misses = 0
+
+  def Add(self, obj):
+    """Adds a category. This method overrides the base class method.
+
+    If the category lookup is initialized, it is updated to include the new
+    category, without being rebuilt.
+
+    Raises:
+      RuntimeError: if the category is an invalid regex.
+    """
+    if self._description_map is None or not isinstance(obj, Category):
+      super(CategoriesTable, self).Add(obj)
+      return
+    if not obj.is_regex:
+      super(CategoriesTable, self).Add(obj)
+      # Like InitializeCategoryLookup, the last exact match category wins.
+      self._description_map[obj.transaction_description] = len(self.objects) - 1
+      self._lookup_cache.pop(obj.transaction_description, None)
+      return
+    try:
+      regex = CompiledRegex(obj.transaction_description)
+    except re.error:
+      raise RuntimeError(
+          "Found invalid regular expression: %s" % obj.transaction_description)
+    super(CategoriesTable, self).Add(obj)
+    idx = len(self.objects) - 1
+    self._regex_matcher.Append(regex, idx)
+    # The new regex comes after every other category, so it can only change the
+    # memoized lookups that found no category.
+    for description, cached_idx in list(self._lookup_cache.items()):
+      if cached_idx is None and regex.match(description):
+        self._lookup_cache[description] = idx
+
+  def GetLookupStats(self):
+    """Returns the CategoryLookupStats of category lookups.
+
+    Hits are lookups answered by the memo of recent descriptions, and misses
+    are lookups that went through the exact and regex matches.
+    """
+    return CategoryLookupStats(
+        self._lookup_hits, self._lookup_misses, len(self._lookup_cache))
 
   def GetSortedCategoryNames(self):
     """Returns a sorted iterable of all categories that exist in the table."""
@@ -71,28 +291,32 @@ class CategoriesTable(storage_lib.ObjectStorage):
   def InitializeCategoryLookup(self):
     """Initializes the object to lookup categories.
 
-    Should be called after reading/adding categories to the table, but before
-    calling GetCategoryForTransaction. If the table's contents are changed,
-    this method must be called again before further lookups.
+    Should be called after reading categories into the table, but before
+    calling GetCategoryForTransaction. Categories that are added with Add()
+    afterwards are included in lookups. If the table's contents are changed
+    in other ways, this method must be called again before further lookups.
 
-    TOOD(murthykk): Do this on instantiation to make this class RAII. If
-    there's a method to add categories to an existing table instance,
-    add new map entries at the end of the method.
+    TOOD(murthykk): Do this on instantiation to make this class RAII.
 
     Raises:
       RuntimeError: if an invalid regex category was found.
     """
     self._description_map = {}
-    self._regexes = []
+    regexes = []
     for idx, cat in enumerate(self.objects):
       if not cat.is_regex:
         self._description_map[cat.transaction_description] = idx
       else:
         try:
-          self._regexes.append(
-              (CompiledRegex(cat.transaction_description), idx))
-        except re.error as e:
-          raise RuntimeError("Found invalid regular expression: %s" % e.pattern)
+          regexes.append((CompiledRegex(cat.transaction_description), idx))
+        except re.error:
+          raise RuntimeError(
+              "Found invalid regular expression: %s" %
+              cat.transaction_description)
+    self._regex_matcher = RegexMatcher(regexes)
+    self._lookup_cache.clear()
+    if self._assignments is not None:
+      self._assignments.Validate(self.objects)
 
   def _MatchRegexes(self, transaction_description):
     """Returns a Category that regex-matches the transaction_description.
@@ -102,10 +326,10 @@ class CategoriesTable(storage_lib.ObjectStorage):
     Args:
       transaction_description: the transaction description string.
     """
-    for r, idx in self._regexes:
-      if MatchRegexObj(r, transaction_description):
-        return self.objects[idx]
-    return None
+    idx = self._regex_matcher.Match(transaction_description)
+    if idx is None:
+      return None
+    return self.objects[idx]
 
   def GetCategoryForTransaction(self, transaction):
     """Returns the category for the given transaction object.
@@ -127,27 +351,445 @@ class CategoriesTable(storage_lib.ObjectStorage):
       raise RuntimeError(
           "GetCategoryFromTransaction was called before "
           "InitializeCategoryLookUp")
-    if transaction.description in self._description_map:
-      return self.objects[self._description_map[transaction.description]]
-    else:
-      return self._MatchRegexes(transaction.description)
+    idx = self._LookupCategoryIndex(transaction.description)
+    if idx is None:
+      return None
+    return self.objects[idx]
 
+  def GetCategoriesForTransactions(self, transactions):
+    """Returns the categories of transactions, reusing earlier lookups.
 
-class Category(object):
-  """Container for category data."""
+    The category of every transaction is remembered by its fingerprint, and
+    persisted by SaveCategoryAssignments. Remembered categories are returned
+    without a lookup, unless categories that were added since could change
+    them: transactions that had no category are looked up again, and so are
+    transactions for whose description an exact match category was added.
+    The other transactions are looked up with CategorizeBatch.
+
+    Args:
+      transactions: Iterable of Transaction objects.
+
+    Returns:
+      List with a Category object, or None if no category could be found, for
+      every transaction.
+
+    Raises:
+      RuntimeError: if this function was called before
+      InitializeCategoryLookup.
+    """
+    if self._description_map is None:
+      raise RuntimeError(
+          "GetCategoriesForTransactions was called before "
+          "InitializeCategoryLookup")
+    assignments = self._GetAssignments()
+    num_categories = len(self.objects)
+    indices = []
+    stale_positions = []
+    stale_txns = []
+    stale_fingerprints = []
+    for txn in transactions:
+      fingerprint = txn.fingerprint()
+      assignment = assignments.Get(fingerprint)
+      if assignment is not None and self._IsAssignmentCurrent(
+          txn.description, *assignment):
+        indices.append(assignment[0])
+      else:
+        stale_positions.append(len(indices))
+        stale_txns.append(txn)
+        stale_fingerprints.append(fingerprint)
+        indices.append(NO_CATEGORY)
+    stale_indices = self.CategorizeBatch(stale_txns)
+    for pos, fingerprint, idx in zip(
+        stale_positions, stale_fingerprints, stale_indices):
+      indices[pos] = idx
+      assignments.Set(fingerprint, idx, num_categories)
+    objects = self.objects
+    return [None if idx == NO_CATEGORY else objects[idx] for idx in indices]
+
+  def CategorizeBatch(self, transactions):
+    """Looks up the categories of many transactions at once.
+
+    Every distinct description is looked up once. Descriptions that are not in
+    the lookup memo and have no exact match category are matched against the
+    regex categories. Since regex matching is CPU bound, they are matched in
+    the worker processes started by StartWorkers, if there are enough of them
+    for each worker to get at least _MIN_DESCRIPTIONS_PER_WORKER.
+
+    Args:
+      transactions: Iterable of Transaction objects.
+
+    Returns:
+      array.array of the category index of every transaction, or NO_CATEGORY
+      if no category could be found. Use self.objects to get the categories.
+
+    Raises:
+      RuntimeError: if this function was called before
+      InitializeCategoryLookup.
+    """
+    if self._description_map is None:
+      raise RuntimeError(
+          "CategorizeBatch was called before InitializeCategoryLookup")
+    # Dictionary-encode the descriptions.
+    codes = array.array("i")
+    code_by_description = {}
+    descriptions = []
+    for txn in transactions:
+      code = code_by_description.get(txn.description)
+      if code is None:
+        code = code_by_description[txn.description] = len(descriptions)
+        descriptions.append(txn.description)
+      codes.append(code)
+
+    # Resolve descriptions from the memo and the exact match categories.
+    indices = array.array("i", [NO_CATEGORY]) * len(descriptions)
+    unmatched = []
+    for code, description in enumerate(descriptions):
+      if description in self._lookup_cache:
+        idx = self._lookup_cache[description]
+        self._lookup_hits += 1
+      else:
+        idx = self._description_map.get(description)
+        if idx is None:
+          unmatched.append(code)
+          continue
+        self._lookup_misses += 1
+      self._Memoize(description, idx)
+      if idx is not None:
+        indices[code] = idx
+
+    unmatched_descriptions = [descriptions[code] for code in unmatched]
+    for code, description, idx in zip(
+        unmatched, unmatched_descriptions,
+        self._MatchRegexesInParallel(unmatched_descriptions)):
+      self._lookup_misses += 1
+      self._Memoize(description, idx)
+      if idx is not None:
+        indices[code] = idx
+    return array.array("i", (indices[code] for code in codes))
+
+  def StartWorkers(self, workers, lazy=False):
+    """Starts the worker processes that CategorizeBatch matches regexes in.
+
+    The workers are reused by every call until StopWorkers is called. Start
+    them before starting any threads, since forking a process that runs
+    threads can deadlock. If no threads are started, they can instead be
+    started lazily, by the first CategorizeBatch call with enough descriptions
+    to use them.
+
+    Args:
+      workers: Number of worker processes. No workers are started if it is 1.
+      lazy: Whether to defer starting the workers until they are needed.
+
+    Returns:
+      True if this call started the workers, or False if they were started
+      already or not needed. Only the caller that started them should stop
+      them.
+    """
+    if workers < 2 or self._num_workers > 1:
+      return False
+    self._num_workers = workers
+    if not lazy:
+      self._pool = multiprocessing.Pool(workers)
+    return True
+
+  def StopWorkers(self):
+    """Stops the worker processes started by StartWorkers."""
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool.join()
+      self._pool = None
+    self._num_workers = 1
+
+  def _MatchRegexesInParallel(self, descriptions):
+    """Returns the regex match of every description, or None if none matches.
+    """
+    workers = min(
+        self._num_workers, len(descriptions) // _MIN_DESCRIPTIONS_PER_WORKER)
+    if workers < 2:
+      return [self._regex_matcher.Match(d) for d in descriptions]
+    num_shards = workers * _SHARDS_PER_WORKER
+    shard_size = -(-len(descriptions) // num_shards)
+    # Regex categories may have been added since the workers started, so the
+    # patterns are sent with every shard.
+    patterns = self._regex_matcher.GetPatterns()
+    shards = [(patterns, descriptions[i:i + shard_size])
+              for i in range(0, len(descriptions), shard_size)]
+    if self._pool is None:
+      self._pool = multiprocessing.Pool(self._num_workers)
+    results = self._pool.map(_MatchInWorker, shards, chunksize=1)
+    return list(itertools.chain.from_iterable(results))
+
+  def SaveCategoryAssignments(self):
+    """Persists the categories found by GetCategoriesForTransactions.
+
+    Raises:
+      Error: if the assignments could not be written.
+    """
+    if self._assignments is not None:
+      self._assignments.Save(self.objects)
+
+  def _GetAssignments(self):
+    if self._assignments is None:
+      self._assignments = CategoryAssignments(
+          self._storage.GetSidecarPath(_ASSIGNMENTS_SIDECAR))
+      self._assignments.Validate(self.objects)
+    return self._assignments
+
+  def _IsAssignmentCurrent(self, transaction_description, idx, num_categories):
+    """Returns True if categories added after an assignment can't change it.
+
+    Args:
+      transaction_description: Description of the assigned transaction.
+      idx: Index of the assigned category, or NO_CATEGORY.
+      num_categories: Number of categories the assignment was made against.
+    """
+    if idx == NO_CATEGORY and num_categories < len(self.objects):
+      # Any of the added categories may match.
+      return False
+    # Added regex categories have the lowest priority, but the last exact match
+    # category always wins.
+    exact_idx = self._description_map.get(transaction_description)
+    return exact_idx is None or exact_idx < num_categories
+
+  def _LookupCategoryIndex(self, transaction_description):
+    """Returns the index of the category of a description, or None."""
+    cache = self._lookup_cache
+    try:
+      # Re-inserted below, to mark the description as the most recently used.
+      idx = cache.pop(transaction_description)
+      self._lookup_hits += 1
+    except KeyError:
+      self._lookup_misses += 1
+      idx = self._description_map.get(transaction_description)
+      if idx is None:
+        idx = self._regex_matcher.Match(transaction_description)
+    self._Memoize(transaction_description, idx)
+    return idx
+
+  def _Memoize(self, transaction_description, idx):
+    """Stores the category index of a description as the most recently used.
+    """
+    cache = self._lookup_cache
+    cache.pop(transaction_description, None)
+    if len(cache) >= self._lookup_cache_size:
+      cache.popitem(last=False)
+    cache[transaction_description] = idx
+
+
+# RegexMatcher of a worker process of CategorizeBatch, and the patterns it was
+# built from.
+_worker_matcher = None
+_worker_patterns = None
+
+
+def _MatchInWorker(shard):
+  """Matches a shard of descriptions in a worker process.
+
+  Args:
+    shard: Tuple of the patterns and values of the regex categories, as
+      returned by RegexMatcher.GetPatterns, and a list of descriptions.
+  """
+  global _worker_matcher, _worker_patterns
+  patterns, descriptions = shard
+  if patterns != _worker_patterns:
+    _worker_matcher = RegexMatcher(
+        [(CompiledRegex(pattern), value) for pattern, value in patterns])
+    _worker_patterns = patterns
+  return [_worker_matcher.Match(d) for d in descriptions]
+
+
+class CategoryAssignments(object):
+  """Categories of transactions, keyed by transaction fingerprint.
+
+  Every assignment records how many categories there were when it was made, so
+  that CategoriesTable can tell which assignments the categories added since
+  could change. The assignments are stamped with a digest of the categories.
+  If those are no longer the first categories of the table, because categories
+  were edited or removed, all assignments are dropped.
+
+  When constructed with a path, the assignments are persisted in a binary file:
+  a header with the stamp, followed by a log of assignment records. Save only
+  appends the assignments set since the last save, and rewrites the header in
+  place. A later record of a fingerprint overrides the earlier ones. The log is
+  compacted once it holds more than _ASSIGNMENTS_COMPACT_RATIO records per
+  assignment. Otherwise the assignments are kept in memory only.
+  """
+
+  def __init__(self, path=None):
+    self._path = path
+    self._num_categories = 0
+    self._digest = _DigestCategories(())
+    # Maps fingerprints to (category index, number of categories) tuples.
+    self._assignments = {}
+    # Fingerprints of the assignments set since the last save.
+    self._unsaved = set()
+    # Number of complete records in the file, or None if the file must be
+    # rewritten.
+    self._num_records = None
+    self._modified = False
+    if path is not None and os.path.exists(path):
+      self._Load()
+
+  def __len__(self):
+    return len(self._assignments)
+
+  def Get(self, fingerprint):
+    """Returns the (category index, number of categories) tuple, or None."""
+    return self._assignments.get(fingerprint)
+
+  def Set(self, fingerprint, idx, num_categories):
+    """Assigns a category to a transaction.
+
+    Args:
+      fingerprint: Fingerprint of the transaction.
+      idx: Index of the category, or NO_CATEGORY.
+      num_categories: Number of categories the category was looked up against.
+    """
+    self._assignments[fingerprint] = (idx, num_categories)
+    self._unsaved.add(fingerprint)
+    self._modified = True
+
+  def Validate(self, categories):
+    """Drops all assignments unless they were made against a prefix of
+    categories.
+    """
+    if (self._num_categories > len(categories) or
+        self._digest != _DigestCategories(
+            itertools.islice(categories, self._num_categories))):
+      self.Clear()
+
+  def Clear(self):
+    """Removes all assignments."""
+    self._num_categories = 0
+    self._digest = _DigestCategories(())
+    self._assignments = {}
+    self._unsaved = set()
+    self._num_records = None
+    self._modified = True
+
+  def Save(self, categories):
+    """Stamps the assignments with the categories, and writes them to the file.
+
+    Args:
+      categories: Sequence of the categories that the assignments were made
+        against.
+
+    Raises:
+      Error: if the assignments could not be written.
+    """
+    digest = _DigestCategories(categories)
+    if (not self._modified and self._num_categories == len(categories) and
+        self._digest == digest):
+      return
+    self._num_categories = len(categories)
+    self._digest = digest
+    if self._path is not None:
+      if (self._num_records is None or
+          self._num_records + len(self._unsaved) >
+          _ASSIGNMENTS_COMPACT_RATIO * max(len(self._assignments), 1)):
+        self._Write()
+      else:
+        self._Append()
+    self._unsaved = set()
+    self._modified = False
 
-  transaction_description = ""
-  display_name = ""
-  category = ""
+  def _Load(self):
+    """Loads the assignments. They are dropped if the file is invalid.
 
-  is_regex = False
-  """True if the transaction_description is a regex instead of an exact match.
-  
-  The regex matching ignores case.
+    A partial record at the end of the file, left by an interrupted save, is
+    ignored. It is overwritten by the next save.
+    """
+    try:
+      with open(self._path, "rb") as f:
+        data = f.read()
+      num_categories, digest = _ASSIGNMENTS_HEADER.unpack_from(data)
+      num_records = (len(data) - _ASSIGNMENTS_HEADER.size) // _ASSIGNMENT.size
+      assignments = {}
+      for offset in range(
+          _ASSIGNMENTS_HEADER.size,
+          _ASSIGNMENTS_HEADER.size + num_records * _ASSIGNMENT.size,
+          _ASSIGNMENT.size):
+        fingerprint, idx, num = _ASSIGNMENT.unpack_from(data, offset)
+        assignments[fingerprint] = (idx, num)
+    except (IOError, ValueError, struct.error):
+      return
+    self._num_categories = num_categories
+    self._digest = digest
+    self._assignments = assignments
+    self._num_records = num_records
+
+  def _Append(self):
+    """Appends the unsaved assignments to the file, and updates its header.
+
+    The records are written before the header. If the header is not updated,
+    the records were made against more categories than the stamp covers, which
+    CategoriesTable treats like any other assignment made against a prefix of
+    its categories.
+    """
+    data = bytearray()
+    for fingerprint in self._unsaved:
+      idx, num = self._assignments[fingerprint]
+      data += _ASSIGNMENT.pack(fingerprint, idx, num)
+    try:
+      with open(self._path, "rb+") as f:
+        f.seek(_ASSIGNMENTS_HEADER.size + self._num_records * _ASSIGNMENT.size)
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(_ASSIGNMENTS_HEADER.pack(self._num_categories, self._digest))
+        f.flush()
+        os.fsync(f.fileno())
+    except (IOError, OSError) as e:
+      raise Error("Failed to write %s: %s" % (self._path, e))
+    self._num_records += len(self._unsaved)
+
+  def _Write(self):
+    """Rewrites the file with one record per assignment."""
+    data = bytearray(_ASSIGNMENTS_HEADER.pack(
+        self._num_categories, self._digest))
+    for fingerprint, (idx, num) in self._assignments.items():
+      data += _ASSIGNMENT.pack(fingerprint, idx, num)
+    tmp_path = "{}.tmp".format(self._path)
+    try:
+      with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+      os.rename(tmp_path, self._path)
+    except (IOError, OSError) as e:
+      raise Error("Failed to write %s: %s" % (self._path, e))
+    self._num_records = len(self._assignments)
+
+
+def _DigestCategories(categories):
+  """Returns the SHA-1 digest of the rules of an iterable of categories.
+
+  Only the fields that decide which transactions a category matches are
+  included.
+  """
+  sha = hashlib.sha1()
+  for cat in categories:
+    description = cat.transaction_description
+    if not isinstance(description, bytes):
+      description = description.encode("utf-8")
+    sha.update(b"%d|%d|" % (cat.is_regex, len(description)))
+    sha.update(description)
+  return sha.digest()
+
+
+class Category(object):
+  """Container for category data.
+
+  If is_regex is True, transaction_description is a regex instead of an exact
+  match. The regex matching ignores case.
   """
 
-  # Required for all storage objects. This should be in a superclass.
-  is_new = False
+  # is_new is required for all storage objects. This should be in a superclass.
+  __slots__ = (
+      "transaction_description", "display_name", "category", "is_regex",
+      "is_new")
 
   def __init__(self, transaction_description, display_name, category, is_regex=None):
     if not isinstance(transaction_description, basestring):
@@ -166,6 +808,15 @@ class Category(object):
     self.display_name = display_name
     self.category = category
     self.is_regex = is_regex
+    self.is_new = False
+
+  def __getstate__(self):
+    # Objects with __slots__ have no __dict__ for pickle protocols < 2 to use.
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __setstate__(self, state):
+    for name, value in zip(self.__slots__, state):
+      setattr(self, name, value)
 
   def todict(self):
     return {
@@ -184,6 +835,21 @@ class Category(object):
         row["transaction_description"], row["display_name"], row["category"],
         row["is_regex"].lower() == 'true')
 
+  @classmethod
+  def fromtrusted(
+      cls, transaction_description, display_name, category, is_regex):
+    """Builds a category from values decoded from our own storage.
+
+    Unlike the constructor, the arguments are not validated.
+    """
+    cat = cls.__new__(cls)
+    cat.transaction_description = transaction_description
+    cat.display_name = display_name
+    cat.category = category
+    cat.is_regex = is_regex
+    cat.is_new = False
+    return cat
+
   def tolist(self):
     return [self.transaction_description, self.display_name, self.category,
             self.is_regex]
@@ -4,6 +4,8 @@ import categories_lib
 
 import datetime
 import mock
+import multiprocessing
+import os
 import test_utils
 import transactions_lib
 
@@ -143,6 +145,369 @@ class CategoriesTableTest(absltest.TestCase):
             0, datetime.date(2008, 3, 4), test_description, 0.0))
     self.assertEqual(exact_category, cat.category)
 
+  def testGetCategoryForTransaction_FirstRegexWins(self):
+    self._categories.Add(categories_lib.Category(
+        "COFFEE (SHOP|BAR)", "Coffee", "Food", is_regex=True))
+    self._categories.Add(categories_lib.Category(
+        "COFFEE.*", "Other coffee", "Other", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    cat = self._categories.GetCategoryForTransaction(
+        transactions_lib.Transaction(
+            0, datetime.date(2008, 3, 4), "COFFEE SHOP 12", 0.0))
+    self.assertEqual("Food", cat.category)
+
+  def _Lookup(self, description):
+    return self._categories.GetCategoryForTransaction(
+        transactions_lib.Transaction(
+            0, datetime.date(2008, 3, 4), description, 0.0))
+
+  def testLookupMemo(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual("Food", self._Lookup("GROCER 1").category)
+    self.assertEqual("Food", self._Lookup("GROCER 1").category)
+    self.assertIsNone(self._Lookup("UNKNOWN"))
+    self.assertIsNone(self._Lookup("UNKNOWN"))
+    self.assertEqual(
+        categories_lib.CategoryLookupStats(hits=2, misses=2, size=2),
+        self._categories.GetLookupStats())
+
+  def testLookupMemoIsBounded(self):
+    with mock.patch.object(categories_lib, "_LOOKUP_CACHE_SIZE", 2):
+      categories = categories_lib.CategoriesTable()
+    categories.InitializeCategoryLookup()
+    for description in ("A", "B", "A", "C", "A", "B"):
+      categories.GetCategoryForTransaction(
+          transactions_lib.Transaction(
+              0, datetime.date(2008, 3, 4), description, 0.0))
+    # "B" was the least recently used description when "C" was added.
+    self.assertEqual(
+        categories_lib.CategoryLookupStats(hits=2, misses=4, size=2),
+        categories.GetLookupStats())
+
+  def testLookupMemoIsInvalidatedByRuleChanges(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER 1", "Grocer", "Food", is_regex=False))
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual("Food", self._Lookup("GROCER 1").category)
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual(0, self._categories.GetLookupStats().size)
+
+  def testAddExactCategoryAfterInitialization(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual("Food", self._Lookup("GROCER 1").category)
+    self._categories.Add(categories_lib.Category(
+        "GROCER 1", "Grocer", "Groceries", is_regex=False))
+    self.assertEqual("Groceries", self._Lookup("GROCER 1").category)
+    # Like InitializeCategoryLookup, the last exact match wins.
+    self._categories.Add(categories_lib.Category(
+        "GROCER 1", "Grocer", "Supplies", is_regex=False))
+    self.assertEqual("Supplies", self._Lookup("GROCER 1").category)
+    self.assertEqual("Food", self._Lookup("GROCER 2").category)
+
+  def testAddRegexCategoryAfterInitialization(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual("Food", self._Lookup("GROCER 1").category)
+    self.assertIsNone(self._Lookup("PHARMACY 1"))
+    self._categories.Add(categories_lib.Category(
+        "(GROCER|PHARMACY).*", "Store", "Health", is_regex=True))
+    # Memoized lookups are updated without being evaluated again.
+    self.assertEqual(2, self._categories.GetLookupStats().size)
+    self.assertEqual("Health", self._Lookup("PHARMACY 1").category)
+    self.assertEqual("Food", self._Lookup("GROCER 1").category)
+    self.assertEqual(
+        categories_lib.CategoryLookupStats(hits=2, misses=2, size=2),
+        self._categories.GetLookupStats())
+
+  def testAddInvalidRegexCategoryAfterInitialization(self):
+    self._categories.InitializeCategoryLookup()
+    with self.assertRaises(RuntimeError):
+      self._categories.Add(categories_lib.Category(
+          "GROCER(", "Grocer", "Food", is_regex=True))
+    self.assertEqual(0, len(self._categories))
+
+  def _GetCategories(self, descriptions):
+    txns = [transactions_lib.Transaction(0, datetime.date(2008, 3, 4), d, 0.0)
+            for d in descriptions]
+    return [cat and cat.category
+            for cat in self._categories.GetCategoriesForTransactions(txns)]
+
+  def testGetCategoriesForTransactions(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual(
+        ["Food", None, "Food"],
+        self._GetCategories(["GROCER 1", "UNKNOWN", "GROCER 2"]))
+    # Assigned categories are reused without a lookup.
+    self.assertEqual(
+        ["Food", None], self._GetCategories(["GROCER 1", "UNKNOWN"]))
+    self.assertEqual(
+        categories_lib.CategoryLookupStats(hits=0, misses=3, size=3),
+        self._categories.GetLookupStats())
+
+  def testGetCategoriesForTransactionsAfterAddingCategories(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    self._GetCategories(["GROCER 1", "GROCER 2", "PHARMACY 1"])
+    self._categories.Add(categories_lib.Category(
+        "(GROCER|PHARMACY).*", "Store", "Health", is_regex=True))
+    self._categories.Add(categories_lib.Category(
+        "GROCER 2", "Grocer", "Supplies", is_regex=False))
+    self.assertEqual(
+        ["Food", "Supplies", "Health"],
+        self._GetCategories(["GROCER 1", "GROCER 2", "PHARMACY 1"]))
+
+  def testGetCategoriesForTransactionsBeforeInitialization(self):
+    with self.assertRaises(RuntimeError):
+      self._GetCategories(["GROCER 1"])
+
+  def _AddCategoriesForBatch(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.Add(categories_lib.Category(
+        "RENT", "Rent", "Home", is_regex=False))
+    self._categories.Add(categories_lib.Category(
+        "PHARMACY.*", "Pharmacy", "Health", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    descriptions = ["GROCER %d" % (i % 7) for i in range(20)] + [
+        "RENT", "PHARMACY 1", "UNKNOWN", "RENT", "GROCER 1"]
+    return [transactions_lib.Transaction(0, datetime.date(2008, 3, 4), d, 0.0)
+            for d in descriptions]
+
+  def testCategorizeBatch(self):
+    txns = self._AddCategoriesForBatch()
+    indices = self._categories.CategorizeBatch(txns)
+    self.assertEqual(
+        [0] * 20 + [1, 2, categories_lib.NO_CATEGORY, 1, 0], list(indices))
+    # Every distinct description is looked up once.
+    self.assertEqual(
+        categories_lib.CategoryLookupStats(hits=0, misses=10, size=10),
+        self._categories.GetLookupStats())
+    self._categories.CategorizeBatch(txns[:3])
+    self.assertEqual(3, self._categories.GetLookupStats().hits)
+
+  def testCategorizeBatchWithWorkers(self):
+    txns = self._AddCategoriesForBatch()
+    self.assertTrue(self._categories.StartWorkers(2))
+    self.addCleanup(self._categories.StopWorkers)
+    self.assertFalse(self._categories.StartWorkers(2))
+    with mock.patch.object(categories_lib, "_MIN_DESCRIPTIONS_PER_WORKER", 2):
+      indices = self._categories.CategorizeBatch(txns)
+      self.assertEqual(
+          [0] * 20 + [1, 2, categories_lib.NO_CATEGORY, 1, 0], list(indices))
+      # Regex categories added after the workers started are matched too.
+      self._categories.Add(categories_lib.Category(
+          "OTHER.*", "Other", "Other", is_regex=True))
+      indices = self._categories.CategorizeBatch([
+          transactions_lib.Transaction(
+              0, datetime.date(2008, 3, 4), "OTHER %d" % i, 0.0)
+          for i in range(10)])
+    self.assertEqual([3] * 10, list(indices))
+
+  def testCategorizeBatchStartsLazyWorkersWhenNeeded(self):
+    txns = self._AddCategoriesForBatch()
+    self.assertTrue(self._categories.StartWorkers(2, lazy=True))
+    self.addCleanup(self._categories.StopWorkers)
+    self.assertFalse(self._categories.StartWorkers(2))
+    with mock.patch.object(
+        multiprocessing, "Pool", wraps=multiprocessing.Pool) as pool_mock:
+      # Too few descriptions to use the workers.
+      self._categories.CategorizeBatch(txns[:1])
+      pool_mock.assert_not_called()
+      with mock.patch.object(
+          categories_lib, "_MIN_DESCRIPTIONS_PER_WORKER", 2):
+        indices = self._categories.CategorizeBatch(txns)
+      pool_mock.assert_called_once_with(2)
+    self.assertEqual(
+        [0] * 20 + [1, 2, categories_lib.NO_CATEGORY, 1, 0], list(indices))
+
+  def testCategorizeBatchBeforeInitialization(self):
+    with self.assertRaises(RuntimeError):
+      self._categories.CategorizeBatch([])
+
+  def testCategoryAssignmentsAreDroppedWhenCategoriesChange(self):
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.InitializeCategoryLookup()
+    self._GetCategories(["GROCER 1"])
+    self._categories.objects[0] = categories_lib.Category(
+        "GROCER 1", "Grocer", "Supplies", is_regex=False)
+    self._categories.InitializeCategoryLookup()
+    self.assertEqual(["Supplies"], self._GetCategories(["GROCER 1"]))
+
+
+class CategoryAssignmentsTest(absltest.TestCase):
+
+  def setUp(self):
+    self._path = os.path.join(
+        absltest.get_default_test_tmpdir(), self.id() + ".assignments")
+    self._categories = [
+        categories_lib.Category("GROCER.*", "Grocer", "Food", is_regex=True),
+        categories_lib.Category("RENT", "Rent", "Home", is_regex=False),
+    ]
+
+  def tearDown(self):
+    if os.path.exists(self._path):
+      os.remove(self._path)
+
+  def testSaveAndLoad(self):
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Set(123, 1, 2)
+    assignments.Set(2 ** 64 - 1, categories_lib.NO_CATEGORY, 1)
+    assignments.Save(self._categories)
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    self.assertEqual(2, len(assignments))
+    self.assertEqual((1, 2), assignments.Get(123))
+    self.assertEqual(
+        (categories_lib.NO_CATEGORY, 1), assignments.Get(2 ** 64 - 1))
+    self.assertIsNone(assignments.Get(456))
+
+  def testValidateKeepsAssignmentsWhenCategoriesAreAppended(self):
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Set(123, 1, 2)
+    assignments.Save(self._categories)
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories + [
+        categories_lib.Category("PHARMACY", "Pharmacy", "Health")])
+    self.assertEqual((1, 2), assignments.Get(123))
+
+  def testValidateDropsAssignmentsWhenCategoriesChange(self):
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Set(123, 1, 2)
+    assignments.Save(self._categories)
+    for categories in (
+        self._categories[:1],
+        self._categories[1:],
+        [categories_lib.Category("GROCER.*", "Grocer", "Food"),
+         self._categories[1]]):
+      assignments = categories_lib.CategoryAssignments(self._path)
+      assignments.Validate(categories)
+      self.assertEqual(0, len(assignments))
+
+  def testSaveAppendsNewAssignments(self):
+    assignments = categories_lib.CategoryAssignments(self._path)
+    for fingerprint in range(10):
+      assignments.Set(fingerprint, 0, 2)
+    assignments.Save(self._categories)
+    size = os.path.getsize(self._path)
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    assignments.Set(10, 1, 2)
+    assignments.Set(3, 1, 2)
+    with mock.patch.object(categories_lib.CategoryAssignments, "_Write") as w:
+      assignments.Save(self._categories)
+      w.assert_not_called()
+    self.assertEqual(
+        size + 2 * categories_lib._ASSIGNMENT.size,
+        os.path.getsize(self._path))
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    self.assertEqual(11, len(assignments))
+    self.assertEqual((1, 2), assignments.Get(3))
+    self.assertEqual((1, 2), assignments.Get(10))
+
+  def testSaveCompactsLog(self):
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Set(123, 0, 2)
+    assignments.Save(self._categories)
+    for idx in range(5):
+      assignments.Set(123, idx % 2, 2)
+      assignments.Save(self._categories)
+    self.assertLessEqual(
+        os.path.getsize(self._path),
+        categories_lib._ASSIGNMENTS_HEADER.size +
+        categories_lib._ASSIGNMENTS_COMPACT_RATIO *
+        categories_lib._ASSIGNMENT.size)
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    self.assertEqual((0, 2), assignments.Get(123))
+
+  def testPartialRecordIsOverwritten(self):
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Set(123, 1, 2)
+    assignments.Set(456, 0, 2)
+    assignments.Save(self._categories)
+    with open(self._path, "ab") as f:
+      f.write(b"torn")
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    self.assertEqual(2, len(assignments))
+    assignments.Set(789, 0, 2)
+    assignments.Save(self._categories)
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    self.assertEqual(3, len(assignments))
+    self.assertEqual((0, 2), assignments.Get(789))
+
+  def testInvalidFileIsIgnored(self):
+    with open(self._path, "wb") as f:
+      f.write(b"not an assignments file")
+    assignments = categories_lib.CategoryAssignments(self._path)
+    assignments.Validate(self._categories)
+    self.assertEqual(0, len(assignments))
+
+
+class RegexMatcherTest(absltest.TestCase):
+
+  def _GetMatcher(self, patterns):
+    return categories_lib.RegexMatcher(
+        [(categories_lib.CompiledRegex(p), i) for i, p in enumerate(patterns)])
+
+  def testFirstMatchWins(self):
+    matcher = self._GetMatcher(["ab(c)?", "a.*", "(x)(y)z", "x"])
+    self.assertEqual(0, matcher.Match("abc"))
+    self.assertEqual(1, matcher.Match("axe"))
+    self.assertEqual(2, matcher.Match("XYZ"))
+    self.assertEqual(3, matcher.Match("xx"))
+    self.assertIsNone(matcher.Match("b"))
+
+  def testUncombinablePatternsKeepTheirPlace(self):
+    matcher = self._GetMatcher(
+        ["foo", r"(b)\1.*", "(?P<name>bb)", "(?i)bbq", "b.*"])
+    self.assertEqual(1, matcher.Match("bbq"))
+    self.assertEqual(4, matcher.Match("bq"))
+    matcher = self._GetMatcher(["foo", "(?P<name>bb)", r"(b)\1.*"])
+    self.assertEqual(1, matcher.Match("bbq"))
+
+  def testManyPatterns(self):
+    patterns = ["(p)(%d)$" % i for i in range(500)]
+    matcher = self._GetMatcher(patterns)
+    for i in (0, 29, 30, 31, 250, 499):
+      self.assertEqual(i, matcher.Match("p%d" % i))
+    self.assertIsNone(matcher.Match("p500"))
+
+  def testAppend(self):
+    matcher = self._GetMatcher(["a(b)", "x"])
+    matcher.Append(categories_lib.CompiledRegex("a.*"), 2)
+    matcher.Append(categories_lib.CompiledRegex(r"(y)\1"), 3)
+    matcher.Append(categories_lib.CompiledRegex("y.*"), 4)
+    self.assertEqual(0, matcher.Match("ab"))
+    self.assertEqual(2, matcher.Match("ac"))
+    self.assertEqual(3, matcher.Match("yy"))
+    self.assertEqual(4, matcher.Match("yz"))
+    for i in range(5, 200):
+      matcher.Append(categories_lib.CompiledRegex("(p)(%d)$" % i), i)
+    for i in (5, 100, 199):
+      self.assertEqual(i, matcher.Match("p%d" % i))
+
+  def testGetPatterns(self):
+    matcher = self._GetMatcher(["a(b)", r"(y)\1"])
+    matcher.Append(categories_lib.CompiledRegex("c"), 2)
+    self.assertEqual(
+        [("a(b)", 0), (r"(y)\1", 1), ("c", 2)], matcher.GetPatterns())
+
+  def testMatchesAreAnchoredAtTheStart(self):
+    matcher = self._GetMatcher(["b", "c"])
+    self.assertIsNone(matcher.Match("abc"))
+
 
 if __name__ == "__main__":
   absltest.main()
@@ -0,0 +1,1078 @@
+"""Exports transactions joined with their accounts and categories.
+
+Transactions are streamed from storage in batches, so an export holds a few
+batches in memory at a time, however many transactions there are. Reading the
+next batch from storage overlaps with joining and writing the current one.
+
+Exports can be written to a single CSV file, or partitioned by month or
+account into one CSV file per partition, with a JSON manifest that describes
+the partitions. Columnar exports write each column to a .npy file instead,
+which notebooks can memory-map with LoadColumns() or LoadDataFrame() rather
+than parse.
+
+Every export records an ExportState next to its output, so that the next
+export can append only the transactions stored since, unless accounts or
+categories changed in a way that affects the rows that were exported.
+"""
+
+import collections
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import struct
+
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+try:
+  import numpy as np
+except ImportError:
+  # numpy is only required by columnar exports.
+  np = None
+
+try:
+  import pandas as pd
+except ImportError:
+  # pandas is only required by LoadDataFrame().
+  pd = None
+
+try:
+  from queue import Empty, Full
+except ImportError:
+  from Queue import Empty, Full
+
+import categories_lib
+import pipeline_lib
+
+
+# Columns of the exported CSV file.
+EXPORT_COLUMNS = [
+    "account_name",
+    "transaction_date",
+    "transaction_description",
+    "transaction_amount",
+    "category",
+    "display_name",
+]
+
+# Default number of transactions that are read, joined and categorized at a
+# time.
+DEFAULT_BATCH_SIZE = 10000
+
+# Default number of bytes of CSV data that are buffered before being written to
+# the output file.
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Number of rows and bytes written by an export.
+ExportStats = collections.namedtuple("ExportStats", ["num_rows", "num_bytes"])
+
+# Functions that return the partition key of a transaction, by partition type.
+_PARTITION_KEYS = {
+    "month": lambda txn: txn.date.strftime("%Y-%m"),
+    "account": lambda txn: str(txn.account_num),
+}
+
+# Ways that exports can be partitioned.
+PARTITION_TYPES = sorted(_PARTITION_KEYS)
+
+# Name of the manifest file of a partitioned export.
+MANIFEST_FILE = "manifest.json"
+
+# Maximum number of row groups that wait in the queue of a partition writer
+# process.
+_WRITER_QUEUE_SIZE = 16
+
+# Seconds between checks that a partition writer process is alive, while the
+# queue to it is full.
+_WRITER_POLL_SECONDS = 0.5
+
+# Position of the transaction date in the rows of EXPORT_COLUMNS.
+_DATE_COLUMN = EXPORT_COLUMNS.index("transaction_date")
+
+# Name of the export state file of a partitioned export, and extension of the
+# export state file of a single file export.
+_STATE_FILE = "export_state.json"
+_STATE_EXTENSION = ".exportstate"
+
+# Formats that exports can be written in.
+EXPORT_FORMATS = ["csv", "npy"]
+
+# Numpy dtype of each column of a columnar export. str columns hold codes into
+# a pool of the column's distinct strings, or NO_STRING for missing values.
+_COLUMN_DTYPES = {
+    "account_name": "<i4",
+    "transaction_date": "<M8[D]",
+    "transaction_description": "<i4",
+    "transaction_amount": "<f8",
+    "category": "<i4",
+    "display_name": "<i4",
+}
+_STRING_COLUMNS = [
+    "account_name", "transaction_description", "category", "display_name"]
+NO_STRING = -1
+
+# Size of the header of the .npy files of a columnar export. The header is
+# written before the number of rows is known, so it is padded to leave room
+# for any number of rows. This also keeps the column data 64-byte aligned.
+_NPY_HEADER_SIZE = 128
+
+# Extension of the files with the string pools of a columnar export, which have
+# one JSON string per line.
+_POOL_EXTENSION = ".pool"
+
+
+class Error(Exception):
+  """Exception type for this module."""
+
+
+class ChunkedCsvWriter(object):
+  """Writes CSV rows to a file in large chunks.
+
+  Rows are formatted into an in-memory buffer, which is written to the file
+  whenever it holds at least chunk_size bytes, so that the file sees few large
+  writes instead of one small write per row.
+  """
+
+  def __init__(self, f, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Constructor.
+
+    Args:
+      f: File object opened for writing in text mode.
+      chunk_size: Minimum number of bytes written to f at a time, except by
+        Flush().
+
+    Raises:
+      ValueError: If chunk_size is not positive.
+    """
+    if chunk_size < 1:
+      raise ValueError("chunk_size must be positive.")
+    self._file = f
+    self._chunk_size = chunk_size
+    self._buffer = StringIO()
+    self._writer = csv.writer(self._buffer)
+    self.num_bytes = 0
+
+  def WriteRows(self, rows):
+    """Writes an iterable of rows, each a list of values."""
+    self._writer.writerows(rows)
+    if self._buffer.tell() >= self._chunk_size:
+      self.Flush()
+
+  def Flush(self):
+    """Writes the buffered rows to the file."""
+    data = self._buffer.getvalue()
+    if data:
+      self._file.write(data)
+      self.num_bytes += len(data)
+      self._buffer = StringIO()
+      self._writer = csv.writer(self._buffer)
+
+
+def JoinTransactions(transactions, account_names, cats):
+  """Joins a batch of transactions with their accounts and categories.
+
+  Args:
+    transactions: List of Transaction objects.
+    account_names: Dict that maps account numbers to account names.
+    cats: List of the Category object, or None, of every transaction.
+
+  Returns:
+    List of rows with the values of EXPORT_COLUMNS. Unknown accounts and
+    missing categories are left empty.
+  """
+  rows = []
+  for txn, cat in zip(transactions, cats):
+    t = txn.todict()
+    rows.append([
+        account_names.get(txn.account_num),
+        t["transaction_date"],
+        t["transaction_description"],
+        t["transaction_amount"],
+        cat.category if cat is not None else None,
+        cat.display_name if cat is not None else None,
+    ])
+  return rows
+
+
+def ExportTransactions(f, transactions_table, accounts_table, categories_table,
+                       batch_size=DEFAULT_BATCH_SIZE,
+                       chunk_size=DEFAULT_CHUNK_SIZE, workers=1, start=0,
+                       state=None):
+  """Writes all stored transactions, joined with accounts and categories.
+
+  The transactions are read from storage in batches. The accounts are joined
+  through a hash table of account names built once, and the categories of each
+  batch are looked up together. Category assignments are updated, but not
+  saved; call categories_table.SaveCategoryAssignments() afterwards.
+
+  Args:
+    f: File object opened for writing in text mode. A header row with
+      EXPORT_COLUMNS is written first, unless start is positive.
+    transactions_table: TransactionsTable to export. Its stored transactions
+      are exported, not the ones that were read into it.
+    accounts_table: AccountsTable with all accounts read.
+    categories_table: CategoriesTable whose category lookup is initialized.
+    batch_size: Number of transactions read and joined at a time.
+    chunk_size: Minimum number of bytes written to f at a time.
+    workers: Maximum number of processes that look up categories.
+    start: Position of the first stored transaction to export.
+    state: Optional ExportState, which is updated with the exported rows.
+
+  Returns:
+    ExportStats of the transactions that were written.
+  """
+  writer = ChunkedCsvWriter(f, chunk_size)
+  if not start:
+    writer.WriteRows([EXPORT_COLUMNS])
+  num_rows = 0
+  for batch, rows in _JoinBatches(
+      transactions_table, accounts_table, categories_table, batch_size,
+      workers, start, state):
+    writer.WriteRows(rows)
+    num_rows += len(batch)
+  writer.Flush()
+  return ExportStats(num_rows, writer.num_bytes)
+
+
+def _JoinBatches(transactions_table, accounts_table, categories_table,
+                 batch_size, workers, start, state):
+  """Generator of the batches of stored transactions and their joined rows."""
+  account_names = _GetAccountNames(accounts_table)
+  for batch, cats in _CategorizeBatches(
+      transactions_table, categories_table, account_names, batch_size,
+      workers, start, state):
+    yield batch, JoinTransactions(batch, account_names, cats)
+
+
+def _CategorizeBatches(transactions_table, categories_table, account_names,
+                       batch_size, workers, start, state):
+  """Generator of the batches of stored transactions and their categories."""
+  # The workers are forked before the pipeline starts its threads.
+  started = categories_table.StartWorkers(workers)
+  try:
+    for batch in pipeline_lib.RunPipeline(
+        _ReadBatches(transactions_table, start, batch_size), []):
+      cats = categories_table.GetCategoriesForTransactions(batch)
+      if state is not None:
+        state.Track(batch, cats, account_names)
+      yield batch, cats
+  finally:
+    if started:
+      categories_table.StopWorkers()
+
+
+def _GetAccountNames(accounts_table):
+  """Returns a dict that maps account numbers to account names."""
+  return dict((acct.number, acct.name) for acct in accounts_table.objects)
+
+
+def _ReadBatches(transactions_table, start, batch_size):
+  """Generator of the batches of stored transactions from position start."""
+  if not start:
+    for batch in transactions_table.ReadBatches(batch_size):
+      yield batch
+    return
+  while True:
+    batch = transactions_table.GetObjects(start, start + batch_size)
+    if not batch:
+      return
+    yield batch
+    start += len(batch)
+
+
+def ExportPartitions(output_dir, transactions_table, accounts_table,
+                     categories_table, partition_by,
+                     batch_size=DEFAULT_BATCH_SIZE,
+                     chunk_size=DEFAULT_CHUNK_SIZE, workers=1, writers=1,
+                     start=0, state=None):
+  """Writes all stored transactions to one CSV file per partition.
+
+  Transactions are read and joined like in ExportTransactions. The joined rows
+  are then handed to writer processes, each of which formats and writes the
+  files of some of the partitions. Partitions are assigned to the writers in
+  the order they are first seen.
+
+  The manifest file in output_dir lists every partition with its file name,
+  number of rows, and first and last transaction date.
+
+  Args:
+    output_dir: Directory of the partition files and the manifest. It is
+      created if needed. Existing files of the same partitions are replaced,
+      unless start is positive.
+    transactions_table: TransactionsTable to export.
+    accounts_table: AccountsTable with all accounts read.
+    categories_table: CategoriesTable whose category lookup is initialized.
+    partition_by: One of PARTITION_TYPES.
+    batch_size: Number of transactions read and joined at a time.
+    chunk_size: Minimum number of bytes written to a partition file at a time.
+    workers: Maximum number of processes that look up categories.
+    writers: Number of processes that write partition files. If it is 1, the
+      files are written by this process.
+    start: Position of the first stored transaction to export. If it is
+      positive, the transactions are appended to the partitions of the
+      manifest, which must exist.
+    state: Optional ExportState, which is updated with the exported rows.
+
+  Returns:
+    ExportStats of all partitions, including the rows that were exported
+    before start.
+
+  Raises:
+    ValueError: If partition_by or writers is invalid.
+    Error: If a partition file or the manifest could not be written.
+  """
+  if partition_by not in _PARTITION_KEYS:
+    raise ValueError("partition_by must be one of %s." % PARTITION_TYPES)
+  if writers < 1:
+    raise ValueError("writers must be positive.")
+  partition_key = _PARTITION_KEYS[partition_by]
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+  # Manifest entries of the partitions that are appended to, by key.
+  existing = {}
+  if start:
+    existing = dict(
+        (p["key"], p) for p in _ReadManifest(output_dir)["partitions"])
+
+  if writers == 1:
+    pool = _LocalPartitionWriter(output_dir, chunk_size, set(existing))
+  else:
+    pool = _PartitionWriterPool(output_dir, chunk_size, set(existing), writers)
+  try:
+    for batch, rows in _JoinBatches(
+        transactions_table, accounts_table, categories_table, batch_size,
+        workers, start, state):
+      rows_by_key = collections.OrderedDict()
+      for txn, row in zip(batch, rows):
+        rows_by_key.setdefault(partition_key(txn), []).append(row)
+      for key, key_rows in rows_by_key.items():
+        pool.Write(key, key_rows)
+    for entry in pool.Close():
+      old = existing.get(entry["key"])
+      if old is not None:
+        entry["num_rows"] += old["num_rows"]
+        entry["num_bytes"] += old["num_bytes"]
+        entry["min_date"] = min(entry["min_date"], old["min_date"])
+        entry["max_date"] = max(entry["max_date"], old["max_date"])
+      existing[entry["key"]] = entry
+  finally:
+    pool.Terminate()
+
+  partitions = sorted(existing.values(), key=lambda p: p["key"])
+  _WriteJson(os.path.join(output_dir, MANIFEST_FILE), {
+      "partition_by": partition_by,
+      "columns": EXPORT_COLUMNS,
+      "num_rows": sum(p["num_rows"] for p in partitions),
+      "partitions": partitions,
+  })
+  return ExportStats(
+      sum(p["num_rows"] for p in partitions),
+      sum(p["num_bytes"] for p in partitions))
+
+
+def ExportColumns(output_dir, transactions_table, accounts_table,
+                  categories_table, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+  """Writes all stored transactions as typed columns, to be memory-mapped.
+
+  Transactions are read and joined like in ExportTransactions, but the values
+  of EXPORT_COLUMNS are written to one .npy file per column instead of being
+  formatted as text. Dates are datetime64[D] values and amounts are float64
+  values. str columns are dictionary-encoded: the .npy file holds int32 codes
+  into the list of the column's distinct strings, which is written to a .pool
+  file. Missing values have the code NO_STRING.
+
+  The manifest file is written last, with the number of rows.
+
+  Args:
+    output_dir: Directory of the column files and the manifest. It is created
+      if needed. Existing files are replaced.
+    transactions_table: TransactionsTable to export.
+    accounts_table: AccountsTable with all accounts read.
+    categories_table: CategoriesTable whose category lookup is initialized.
+    batch_size: Number of transactions read and joined at a time.
+    workers: Maximum number of processes that look up categories.
+
+  Returns:
+    ExportStats of the export.
+
+  Raises:
+    Error: If numpy is not installed, or a file could not be written.
+  """
+  if np is None:
+    raise Error("Columnar exports require numpy.")
+  account_names = _GetAccountNames(accounts_table)
+  pools = dict((col, {}) for col in _STRING_COLUMNS)
+  writers = []
+  try:
+    if not os.path.isdir(output_dir):
+      os.makedirs(output_dir)
+    for col in EXPORT_COLUMNS:
+      writers.append(_NpyColumnWriter(
+          os.path.join(output_dir, col + ".npy"), _COLUMN_DTYPES[col]))
+    num_rows = 0
+    for batch, cats in _CategorizeBatches(
+        transactions_table, categories_table, account_names, batch_size,
+        workers, 0, None):
+      values = {
+          "account_name": [account_names.get(txn.account_num)
+                           for txn in batch],
+          "transaction_date": [txn.date for txn in batch],
+          "transaction_description": [txn.description for txn in batch],
+          "transaction_amount": [txn.amount for txn in batch],
+          "category": [cat.category if cat is not None else None
+                       for cat in cats],
+          "display_name": [cat.display_name if cat is not None else None
+                           for cat in cats],
+      }
+      for col, writer in zip(EXPORT_COLUMNS, writers):
+        if col in pools:
+          writer.Write(_EncodeStrings(values[col], pools[col]))
+        else:
+          writer.Write(values[col])
+      num_rows += len(batch)
+    num_bytes = 0
+    while writers:
+      num_bytes += writers.pop(0).Close()
+    for col, pool in pools.items():
+      num_bytes += _WritePool(
+          os.path.join(output_dir, col + _POOL_EXTENSION), pool)
+  except (IOError, OSError) as e:
+    for writer in writers:
+      writer.Abort()
+    raise Error("Failed to write %s: %s" % (output_dir, e))
+
+  _WriteJson(os.path.join(output_dir, MANIFEST_FILE), {
+      "format": "npy",
+      "columns": EXPORT_COLUMNS,
+      "string_columns": _STRING_COLUMNS,
+      "num_rows": num_rows,
+  })
+  return ExportStats(num_rows, num_bytes)
+
+
+def LoadColumns(output_dir, mmap=True):
+  """Loads the columns of a columnar export.
+
+  Args:
+    output_dir: Directory that ExportColumns() wrote to.
+    mmap: If True, the column files are memory-mapped read-only, so loading
+      takes about the same time however many rows there are. Otherwise, they
+      are read into memory.
+
+  Returns:
+    Tuple of a dict of 1-d numpy arrays keyed by column name, and a dict of
+    the string pools of the str columns. See ExportColumns() for the layout.
+
+  Raises:
+    Error: If numpy is not installed, or the export could not be read.
+  """
+  if np is None:
+    raise Error("Columnar exports require numpy.")
+  manifest = _ReadManifest(output_dir)
+  if manifest.get("format") != "npy":
+    raise Error("%s is not a columnar export." % output_dir)
+  num_rows = manifest["num_rows"]
+  arrays = {}
+  pools = {}
+  try:
+    for col in manifest["columns"]:
+      path = os.path.join(output_dir, col + ".npy")
+      # Empty arrays can't be memory-mapped.
+      arrays[col] = np.load(path, mmap_mode="r" if mmap and num_rows else None)
+      if arrays[col].shape != (num_rows,):
+        raise Error("%s does not have %d rows." % (path, num_rows))
+    for col in manifest["string_columns"]:
+      with open(os.path.join(output_dir, col + _POOL_EXTENSION), "r") as f:
+        pools[col] = [json.loads(line) for line in f]
+  except (IOError, ValueError) as e:
+    raise Error("Failed to read %s: %s" % (output_dir, e))
+  return arrays, pools
+
+
+def LoadDataFrame(output_dir):
+  """Loads a columnar export as a pandas DataFrame.
+
+  The date and amount columns are built from the memory-mapped column files,
+  and the str columns are Categorical columns built from their codes, so no
+  values are parsed.
+
+  Args:
+    output_dir: Directory that ExportColumns() wrote to.
+
+  Returns:
+    pandas.DataFrame with EXPORT_COLUMNS. Missing strings are NaN.
+
+  Raises:
+    Error: If pandas is not installed, or the export could not be read.
+  """
+  if pd is None:
+    raise Error("LoadDataFrame requires pandas.")
+  arrays, pools = LoadColumns(output_dir)
+  data = collections.OrderedDict()
+  for col in EXPORT_COLUMNS:
+    if col in pools:
+      data[col] = pd.Categorical.from_codes(arrays[col], pools[col])
+    else:
+      data[col] = arrays[col]
+  return pd.DataFrame(data)
+
+
+def RunExport(output_path, transactions_table, accounts_table,
+              categories_table, partition_by=None, since_last_export=False,
+              batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+              workers=1, writers=1):
+  """Exports transactions, and records the ExportState of the output.
+
+  Args:
+    output_path: Path of the output file, or of the output directory if
+      partition_by is set.
+    transactions_table: TransactionsTable to export.
+    accounts_table: AccountsTable with all accounts read.
+    categories_table: CategoriesTable whose category lookup is initialized.
+    partition_by: None to write a single file, or one of PARTITION_TYPES to
+      write partitions with ExportPartitions.
+    since_last_export: If True, and the ExportState of the output shows that
+      the rows it holds are up to date, only the transactions stored since the
+      last export are appended to it. Otherwise, all transactions are
+      exported.
+    batch_size: Number of transactions read and joined at a time.
+    chunk_size: Minimum number of bytes written to a file at a time.
+    workers: Maximum number of processes that look up categories.
+    writers: Number of processes that write partition files.
+
+  Returns:
+    Tuple of the ExportStats of the rows that were written, and None if only
+    new transactions were exported, or a message that says why all
+    transactions were exported.
+
+  Raises:
+    Error: If the output could not be written.
+  """
+  layout = partition_by or "file"
+  state_path = _GetStatePath(output_path, partition_by)
+  reason = "A full export was requested."
+  state = None
+  if since_last_export:
+    state = ExportState.Load(state_path)
+    if state is None:
+      reason = "No earlier export was found."
+    else:
+      reason = state.GetFullExportReason(
+          layout, output_path, transactions_table, accounts_table,
+          categories_table)
+  if reason is not None:
+    state = ExportState(layout)
+  start = state.num_rows
+  start_bytes = state.num_bytes
+
+  if partition_by:
+    stats = ExportPartitions(
+        output_path, transactions_table, accounts_table, categories_table,
+        partition_by, batch_size=batch_size, chunk_size=chunk_size,
+        workers=workers, writers=writers, start=start, state=state)
+    num_bytes = stats.num_bytes
+  else:
+    try:
+      with open(output_path, "a" if start else "w") as f:
+        ExportTransactions(
+            f, transactions_table, accounts_table, categories_table,
+            batch_size=batch_size, chunk_size=chunk_size, workers=workers,
+            start=start, state=state)
+      num_bytes = os.path.getsize(output_path)
+    except (IOError, OSError) as e:
+      raise Error("Failed to write %s: %s" % (output_path, e))
+  state.Stamp(accounts_table, categories_table, num_bytes)
+  state.Save(state_path)
+  return ExportStats(state.num_rows - start, num_bytes - start_bytes), reason
+
+
+class ExportState(object):
+  """Records what an export wrote, so that the next one can append to it.
+
+  Transactions are only ever appended to storage, so an export covers the
+  first num_rows stored transactions. The state also records what the rows it
+  wrote depend on: the accounts and categories at the time, the descriptions
+  that were exported, and the descriptions and account numbers that had no
+  category or account. Categories and accounts that are added later only
+  affect the exported rows if they match one of those.
+
+  Attributes:
+    layout: "file" for a single file export, or the partition type.
+    num_rows: Number of stored transactions that were exported.
+    num_bytes: Size of the output, in bytes.
+  """
+
+  def __init__(self, layout):
+    self.layout = layout
+    self.num_rows = 0
+    self.num_bytes = 0
+    self._last_fingerprint = None
+    # Maps account numbers to account names.
+    self._accounts = {}
+    self._unknown_accounts = set()
+    self._num_categories = 0
+    self._categories_digest = _DigestCategoryFields(())
+    self._description_hashes = set()
+    self._uncategorized_descriptions = set()
+
+  def Track(self, transactions, cats, account_names):
+    """Records a batch of exported transactions.
+
+    Args:
+      transactions: List of the exported transactions, in storage order.
+      cats: List of the Category object, or None, of every transaction.
+      account_names: Dict that maps account numbers to account names.
+    """
+    for txn, cat in zip(transactions, cats):
+      self._description_hashes.add(_DescriptionHash(txn.description))
+      if cat is None:
+        self._uncategorized_descriptions.add(txn.description)
+      if txn.account_num not in account_names:
+        self._unknown_accounts.add(txn.account_num)
+    if transactions:
+      self.num_rows += len(transactions)
+      self._last_fingerprint = transactions[-1].fingerprint()
+
+  def Stamp(self, accounts_table, categories_table, num_bytes):
+    """Records the accounts and categories that the export used."""
+    self._accounts = _GetAccountNames(accounts_table)
+    self._num_categories = len(categories_table.objects)
+    self._categories_digest = _DigestCategoryFields(categories_table.objects)
+    self.num_bytes = num_bytes
+
+  def GetFullExportReason(self, layout, output_path, transactions_table,
+                          accounts_table, categories_table):
+    """Returns why new transactions can't be appended to the output, or None.
+
+    Args:
+      layout: Layout of the next export. See the layout attribute.
+      output_path: Path of the output file or directory.
+      transactions_table: TransactionsTable to export.
+      accounts_table: AccountsTable with all accounts read.
+      categories_table: CategoriesTable with all categories read.
+    """
+    if layout != self.layout:
+      return "The output layout changed."
+    if self._GetOutputSize(output_path) != self.num_bytes:
+      return "The output was modified."
+    if self.num_rows:
+      txns = transactions_table.GetObjects(self.num_rows - 1, self.num_rows)
+      if not txns or txns[0].fingerprint() != self._last_fingerprint:
+        return "Exported transactions were removed or changed."
+
+    accounts = _GetAccountNames(accounts_table)
+    if any(accounts.get(number) != name
+           for number, name in self._accounts.items()):
+      return "Accounts were removed or changed."
+    if any(number in self._unknown_accounts
+           for number in set(accounts) - set(self._accounts)):
+      return "Accounts were added for exported transactions."
+
+    categories = categories_table.objects
+    if (len(categories) < self._num_categories or
+        self._categories_digest != _DigestCategoryFields(
+            itertools.islice(categories, self._num_categories))):
+      return "Categories were removed or changed."
+    for cat in itertools.islice(
+        categories, self._num_categories, len(categories)):
+      if not cat.is_regex:
+        if (_DescriptionHash(cat.transaction_description) in
+            self._description_hashes):
+          return "Categories were added for exported transactions."
+        continue
+      regex = categories_lib.CompiledRegex(cat.transaction_description)
+      if any(regex.match(description)
+             for description in self._uncategorized_descriptions):
+        return "Categories were added for exported transactions."
+    return None
+
+  def _GetOutputSize(self, output_path):
+    """Returns the size of the output, or None if it can't be appended to."""
+    if self.layout == "file":
+      try:
+        return os.path.getsize(output_path)
+      except OSError:
+        return None
+    try:
+      manifest = _ReadManifest(output_path)
+    except Error:
+      return None
+    if manifest.get("num_rows") != self.num_rows:
+      return None
+    num_bytes = 0
+    for partition in manifest["partitions"]:
+      path = os.path.join(output_path, partition["file"])
+      if not os.path.isfile(path):
+        return None
+      num_bytes += os.path.getsize(path)
+    return num_bytes
+
+  @classmethod
+  def Load(cls, path):
+    """Returns the ExportState in a file, or None if it is missing or invalid.
+    """
+    try:
+      with open(path, "r") as f:
+        data = json.load(f)
+      state = cls(data["layout"])
+      state.num_rows = data["num_rows"]
+      state.num_bytes = data["num_bytes"]
+      state._last_fingerprint = data["last_fingerprint"]
+      state._accounts = dict(
+          (int(number), name) for number, name in data["accounts"].items())
+      state._unknown_accounts = set(data["unknown_accounts"])
+      state._num_categories = data["num_categories"]
+      state._categories_digest = data["categories_digest"]
+      state._description_hashes = set(data["description_hashes"])
+      state._uncategorized_descriptions = set(
+          data["uncategorized_descriptions"])
+    except (IOError, ValueError, KeyError, TypeError, AttributeError):
+      return None
+    return state
+
+  def Save(self, path):
+    """Writes the state to a file.
+
+    Raises:
+      Error: If the file could not be written.
+    """
+    _WriteJson(path, {
+        "layout": self.layout,
+        "num_rows": self.num_rows,
+        "num_bytes": self.num_bytes,
+        "last_fingerprint": self._last_fingerprint,
+        "accounts": dict(
+            (str(number), name) for number, name in self._accounts.items()),
+        "unknown_accounts": sorted(self._unknown_accounts),
+        "num_categories": self._num_categories,
+        "categories_digest": self._categories_digest,
+        "description_hashes": sorted(self._description_hashes),
+        "uncategorized_descriptions": sorted(
+            self._uncategorized_descriptions),
+    })
+
+
+def _GetStatePath(output_path, partition_by):
+  """Returns the path of the ExportState file of an export."""
+  if partition_by:
+    return os.path.join(output_path, _STATE_FILE)
+  return output_path + _STATE_EXTENSION
+
+
+def _DescriptionHash(description):
+  """Returns a 64-bit hash of a transaction description."""
+  return struct.unpack(
+      "<Q", hashlib.sha1(_ToBytes(description)).digest()[:8])[0]
+
+
+def _DigestCategoryFields(categories):
+  """Returns the hex SHA-1 digest of all fields of an iterable of categories.
+
+  Unlike the digest that stamps category assignments in categories_lib, which
+  covers only the fields that decide which transactions a category matches,
+  this covers the display name and category too, since they are written to the
+  exported rows. Renaming a category thus keeps the assignments, but forces a
+  full export.
+  """
+  sha = hashlib.sha1()
+  for cat in categories:
+    for value in (cat.transaction_description, cat.display_name,
+                  cat.category, str(cat.is_regex)):
+      value = _ToBytes(value)
+      sha.update(struct.pack("<I", len(value)))
+      sha.update(value)
+  return sha.hexdigest()
+
+
+def _ToBytes(value):
+  return value if isinstance(value, bytes) else value.encode("utf-8")
+
+
+class _PartitionWriter(object):
+  """Writes rows to one CSV file per partition key."""
+
+  def __init__(self, output_dir, chunk_size, append_keys):
+    """Constructor.
+
+    Args:
+      output_dir: Directory of the partition files.
+      chunk_size: Minimum number of bytes written to a file at a time.
+      append_keys: Set of the keys of the partitions whose files are appended
+        to. The files of other partitions are replaced.
+    """
+    self._output_dir = output_dir
+    self._chunk_size = chunk_size
+    self._append_keys = append_keys
+    # Maps partition keys to (file, ChunkedCsvWriter, manifest entry) tuples.
+    self._partitions = {}
+
+  def Write(self, key, rows):
+    """Appends rows to the file of a partition, creating it if needed."""
+    partition = self._partitions.get(key)
+    if partition is None:
+      file_name = "{}.csv".format(key)
+      append = key in self._append_keys
+      f = open(os.path.join(self._output_dir, file_name),
+               "a" if append else "w")
+      writer = ChunkedCsvWriter(f, self._chunk_size)
+      if not append:
+        writer.WriteRows([EXPORT_COLUMNS])
+      entry = {"key": key, "file": file_name, "num_rows": 0,
+               "min_date": None, "max_date": None}
+      partition = self._partitions[key] = (f, writer, entry)
+    _, writer, entry = partition
+    writer.WriteRows(rows)
+    entry["num_rows"] += len(rows)
+    # Dates are formatted as YYYY-MM-DD, so they sort like strings.
+    dates = [row[_DATE_COLUMN] for row in rows]
+    if entry["min_date"] is not None:
+      dates.extend((entry["min_date"], entry["max_date"]))
+    entry["min_date"] = min(dates)
+    entry["max_date"] = max(dates)
+
+  def Close(self):
+    """Flushes and closes all files.
+
+    Returns:
+      List of the manifest entries of the partitions.
+    """
+    entries = []
+    for f, writer, entry in self._partitions.values():
+      writer.Flush()
+      f.close()
+      entry["num_bytes"] = writer.num_bytes
+      entries.append(entry)
+    self._partitions = {}
+    return entries
+
+  def Abort(self):
+    """Closes all files, without flushing them."""
+    for f, _, _ in self._partitions.values():
+      f.close()
+    self._partitions = {}
+
+
+class _LocalPartitionWriter(_PartitionWriter):
+  """_PartitionWriter with the interface of _PartitionWriterPool."""
+
+  def Terminate(self):
+    self.Abort()
+
+
+class _PartitionWriterPool(object):
+  """Distributes partitions over _PartitionWriters in worker processes."""
+
+  def __init__(self, output_dir, chunk_size, append_keys, num_writers):
+    self._queues = []
+    self._processes = []
+    self._results = multiprocessing.Queue()
+    # Maps partition keys to the number of the writer that writes them.
+    self._writer_by_key = {}
+    for _ in range(num_writers):
+      queue = multiprocessing.Queue(_WRITER_QUEUE_SIZE)
+      process = multiprocessing.Process(
+          target=_RunPartitionWriter,
+          args=(len(self._processes), output_dir, chunk_size, append_keys,
+                queue, self._results))
+      process.daemon = True
+      process.start()
+      self._queues.append(queue)
+      self._processes.append(process)
+
+  def Write(self, key, rows):
+    """Sends rows to the writer of a partition.
+
+    Raises:
+      Error: If the writer process exited.
+    """
+    writer = self._writer_by_key.get(key)
+    if writer is None:
+      writer = self._writer_by_key[key] = (
+          len(self._writer_by_key) % len(self._queues))
+    self._Put(writer, (key, rows))
+
+  def Close(self):
+    """Waits for the writers to close their files.
+
+    Returns:
+      List of the manifest entries of all partitions.
+
+    Raises:
+      Error: If a writer failed.
+    """
+    for writer in range(len(self._queues)):
+      try:
+        self._Put(writer, None)
+      except Error:
+        # The writer exited, which is reported below.
+        pass
+    entries = []
+    errors = []
+    # Maps the numbers of the writers that have not reported to their
+    # processes.
+    pending = dict(enumerate(self._processes))
+    while pending:
+      try:
+        writer, writer_entries, error = self._results.get(
+            timeout=_WRITER_POLL_SECONDS)
+      except Empty:
+        # Writers report before they exit, and their result is in the queue
+        # once they have exited. So writers that exited while the queue is
+        # empty failed without reporting, e.g. because they were killed.
+        exited = [w for w, p in pending.items() if not p.is_alive()]
+        if exited and self._results.empty():
+          for writer in exited:
+            errors.append("Partition writer process %d exited with code %s." % (
+                writer, pending.pop(writer).exitcode))
+        continue
+      del pending[writer]
+      if error is not None:
+        errors.append(error)
+      else:
+        entries.extend(writer_entries)
+    for process in self._processes:
+      process.join()
+    if errors:
+      raise Error("Failed to write partitions: %s" % "; ".join(errors))
+    return entries
+
+  def Terminate(self):
+    """Stops any writer processes that are still running."""
+    for process in self._processes:
+      if process.is_alive():
+        process.terminate()
+      process.join()
+
+  def _Put(self, writer, item):
+    process = self._processes[writer]
+    while True:
+      try:
+        self._queues[writer].put(item, timeout=_WRITER_POLL_SECONDS)
+        return
+      except Full:
+        if not process.is_alive():
+          raise Error("Partition writer process %d exited." % writer)
+
+
+def _RunPartitionWriter(writer_num, output_dir, chunk_size, append_keys,
+                        in_queue, out_queue):
+  """Runs a _PartitionWriter in a worker process of ExportPartitions.
+
+  Writes the row groups of in_queue until it gets None, and then puts a tuple
+  of writer_num, the manifest entries and None in out_queue. If writing
+  fails, the tuple has None and an error message instead, so that the parent
+  process is never left waiting.
+  """
+  writer = _PartitionWriter(output_dir, chunk_size, append_keys)
+  try:
+    while True:
+      item = in_queue.get()
+      if item is None:
+        break
+      writer.Write(*item)
+    out_queue.put((writer_num, writer.Close(), None))
+  except Exception as e:  # pylint: disable=broad-except
+    writer.Abort()
+    out_queue.put((writer_num, None, "%s: %s" % (type(e).__name__, e)))
+
+
+def _ReadManifest(output_dir):
+  """Returns the manifest of a partitioned export.
+
+  Raises:
+    Error: If the manifest could not be read.
+  """
+  path = os.path.join(output_dir, MANIFEST_FILE)
+  try:
+    with open(path, "r") as f:
+      return json.load(f)
+  except (IOError, ValueError) as e:
+    raise Error("Failed to read %s: %s" % (path, e))
+
+
+def _WriteJson(path, data):
+  """Writes a JSON file atomically.
+
+  Raises:
+    Error: If the file could not be written.
+  """
+  tmp_path = "{}.tmp".format(path)
+  try:
+    with open(tmp_path, "w") as f:
+      json.dump(data, f, indent=2, sort_keys=True)
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+  except (IOError, OSError) as e:
+    raise Error("Failed to write %s: %s" % (path, e))
+
+
+class _NpyColumnWriter(object):
+  """Writes a 1-d .npy file, whose length is only known when it is closed."""
+
+  def __init__(self, path, dtype):
+    self._dtype = np.dtype(dtype)
+    self._num_rows = 0
+    self._f = open(path, "wb")
+    self._f.write(_NpyHeader(self._dtype, 0))
+
+  def Write(self, values):
+    """Appends a list or array of values to the column."""
+    self._f.write(np.asarray(values, dtype=self._dtype).tobytes())
+    self._num_rows += len(values)
+
+  def Close(self):
+    """Writes the final header and closes the file. Returns its size."""
+    self._f.seek(0)
+    self._f.write(_NpyHeader(self._dtype, self._num_rows))
+    self._f.flush()
+    os.fsync(self._f.fileno())
+    self._f.close()
+    return _NPY_HEADER_SIZE + self._num_rows * self._dtype.itemsize
+
+  def Abort(self):
+    """Closes the file without finishing it."""
+    self._f.close()
+
+
+def _NpyHeader(dtype, num_rows):
+  """Returns a version 1.0 .npy header of _NPY_HEADER_SIZE bytes."""
+  header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+      np.lib.format.dtype_to_descr(dtype), num_rows)
+  preamble = np.lib.format.magic(1, 0)
+  # The preamble is followed by the 2-byte header length, and the header ends
+  # with a newline.
+  header = header.ljust(_NPY_HEADER_SIZE - len(preamble) - 3) + "\n"
+  return preamble + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _EncodeStrings(values, pool):
+  """Returns the codes of a list of strings, adding new strings to the pool.
+
+  Args:
+    values: List of strings, or None for missing values.
+    pool: Dict that maps strings to their codes.
+
+  Returns:
+    int32 numpy array of codes, with NO_STRING for missing values.
+  """
+  return np.array(
+      [NO_STRING if value is None else pool.setdefault(value, len(pool))
+       for value in values], dtype="<i4")
+
+
+def _WritePool(path, pool):
+  """Writes the strings of a pool in code order. Returns the file size."""
+  strings = sorted(pool, key=pool.get)
+  with open(path, "w") as f:
+    for string in strings:
+      f.write(json.dumps(string))
+      f.write("\n")
+    f.flush()
+    os.fsync(f.fileno())
+  return os.path.getsize(path)
@@ -0,0 +1,397 @@
+"""Tests for export_lib."""
+
+import export_lib
+
+import accounts_lib
+import categories_lib
+import csv
+import datetime
+import json
+import mock
+import numpy as np
+import os
+import shutil
+import test_utils
+import transactions_lib
+import unittest
+
+from absl.testing import absltest
+
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+
+class ChunkedCsvWriterTest(absltest.TestCase):
+
+  def testRowsAreWrittenInChunks(self):
+    f = mock.Mock()
+    writer = export_lib.ChunkedCsvWriter(f, chunk_size=10)
+    writer.WriteRows([["a", "b"]])
+    f.write.assert_not_called()
+    writer.WriteRows([["cdef", 1.5], ["g", None]])
+    f.write.assert_called_once_with("a,b\r\ncdef,1.5\r\ng,\r\n")
+    writer.WriteRows([["h"]])
+    writer.Flush()
+    f.write.assert_called_with("h\r\n")
+    self.assertEqual(22, writer.num_bytes)
+
+  def testInvalidChunkSize(self):
+    with self.assertRaises(ValueError):
+      export_lib.ChunkedCsvWriter(mock.Mock(), chunk_size=0)
+
+
+class ExportTestBase(absltest.TestCase):
+  """Stores accounts, categories and transactions to export."""
+
+  def setUp(self):
+    self._tables = {
+        "accounts": test_utils.FakeStorageTable(
+            "accounts", ["account_name", "account_number"]),
+        "categories": test_utils.FakeStorageTable(
+            "categories",
+            ["transaction_description", "display_name", "category",
+             "is_regex"]),
+        "transactions": test_utils.FakeStorageTable(
+            "transactions",
+            ["account_number", "transaction_date", "transaction_description",
+             "transaction_amount"]),
+    }
+    mock.patch.object(
+        accounts_lib.storage_lib, "GetStorageTable",
+        side_effect=lambda name, streaming=False: self._tables[name]).start()
+    self.addCleanup(mock.patch.stopall)
+
+    self._accounts = accounts_lib.AccountsTable()
+    self._accounts.Add(accounts_lib.Account("Checking", 1))
+    self._categories = categories_lib.CategoriesTable()
+    self._categories.Add(categories_lib.Category(
+        "GROCER.*", "Grocer", "Food", is_regex=True))
+    self._categories.Add(categories_lib.Category("RENT", "Landlord", "Home"))
+    self._categories.InitializeCategoryLookup()
+    transactions = transactions_lib.TransactionsTable()
+    for day, (account_num, description) in enumerate(
+        [(1, "GROCER 1"), (1, "RENT"), (2, "UNKNOWN"), (1, "GROCER 2")], 1):
+      transactions.Add(transactions_lib.Transaction(
+          account_num, datetime.date(2012, 3, day), description,
+          -10.5 * day))
+    transactions.Save()
+
+
+class ExportTransactionsTest(ExportTestBase):
+
+  def testExportTransactions(self):
+    f = StringIO()
+    stats = export_lib.ExportTransactions(
+        f, transactions_lib.TransactionsTable(streaming=True), self._accounts,
+        self._categories, batch_size=3, chunk_size=16)
+    self.assertEqual(
+        export_lib.ExportStats(num_rows=4, num_bytes=len(f.getvalue())), stats)
+    self.assertEqual([
+        export_lib.EXPORT_COLUMNS,
+        ["Checking", "2012-03-01", "GROCER 1", "-10.5", "Food", "Grocer"],
+        ["Checking", "2012-03-02", "RENT", "-21.0", "Home", "Landlord"],
+        ["", "2012-03-03", "UNKNOWN", "-31.5", "", ""],
+        ["Checking", "2012-03-04", "GROCER 2", "-42.0", "Food", "Grocer"],
+    ], list(csv.reader(StringIO(f.getvalue()))))
+
+  def testExportNoTransactions(self):
+    self._tables["transactions"]._fake_rows.clear()
+    f = StringIO()
+    stats = export_lib.ExportTransactions(
+        f, transactions_lib.TransactionsTable(streaming=True), self._accounts,
+        self._categories)
+    self.assertEqual(0, stats.num_rows)
+    self.assertEqual(
+        [export_lib.EXPORT_COLUMNS], list(csv.reader(StringIO(f.getvalue()))))
+
+
+class ExportPartitionsTest(ExportTestBase):
+
+  def setUp(self):
+    super(ExportPartitionsTest, self).setUp()
+    self._output_dir = os.path.join(
+        absltest.get_default_test_tmpdir(), self.id())
+    self.addCleanup(shutil.rmtree, self._output_dir, ignore_errors=True)
+
+  def _Export(self, partition_by, writers):
+    return export_lib.ExportPartitions(
+        self._output_dir, transactions_lib.TransactionsTable(streaming=True),
+        self._accounts, self._categories, partition_by, batch_size=3,
+        chunk_size=16, writers=writers)
+
+  def _ReadFile(self, file_name):
+    with open(os.path.join(self._output_dir, file_name), "r") as f:
+      return list(csv.reader(f))
+
+  def _ReadManifest(self):
+    with open(os.path.join(
+        self._output_dir, export_lib.MANIFEST_FILE), "r") as f:
+      return json.load(f)
+
+  def _CheckPartitionsByAccount(self, stats):
+    self.assertEqual(4, stats.num_rows)
+    self.assertEqual([
+        export_lib.EXPORT_COLUMNS,
+        ["Checking", "2012-03-01", "GROCER 1", "-10.5", "Food", "Grocer"],
+        ["Checking", "2012-03-02", "RENT", "-21.0", "Home", "Landlord"],
+        ["Checking", "2012-03-04", "GROCER 2", "-42.0", "Food", "Grocer"],
+    ], self._ReadFile("1.csv"))
+    self.assertEqual([
+        export_lib.EXPORT_COLUMNS,
+        ["", "2012-03-03", "UNKNOWN", "-31.5", "", ""],
+    ], self._ReadFile("2.csv"))
+    manifest = self._ReadManifest()
+    self.assertEqual("account", manifest["partition_by"])
+    self.assertEqual(4, manifest["num_rows"])
+    partitions = manifest["partitions"]
+    for partition in partitions:
+      self.assertEqual(
+          os.path.getsize(os.path.join(self._output_dir, partition["file"])),
+          partition.pop("num_bytes"))
+    self.assertEqual([
+        {"key": "1", "file": "1.csv", "num_rows": 3,
+         "min_date": "2012-03-01", "max_date": "2012-03-04"},
+        {"key": "2", "file": "2.csv", "num_rows": 1,
+         "min_date": "2012-03-03", "max_date": "2012-03-03"},
+    ], partitions)
+    self.assertEqual(
+        sum(os.path.getsize(os.path.join(self._output_dir, p["file"]))
+            for p in partitions), stats.num_bytes)
+
+  def testPartitionByAccount(self):
+    self._CheckPartitionsByAccount(self._Export("account", writers=1))
+
+  def testPartitionByAccountWithWriterProcesses(self):
+    self._CheckPartitionsByAccount(self._Export("account", writers=2))
+
+  def testPartitionByMonth(self):
+    self._Export("month", writers=2)
+    self.assertEqual(
+        ["2012-03"], [p["key"] for p in self._ReadManifest()["partitions"]])
+    self.assertEqual(5, len(self._ReadFile("2012-03.csv")))
+
+  def testWriterErrorIsReported(self):
+    with mock.patch.object(
+        export_lib._PartitionWriter, "Write",
+        side_effect=UnicodeError("bad row")):
+      with self.assertRaisesRegexp(export_lib.Error, "UnicodeError: bad row"):
+        self._Export("account", writers=2)
+
+  def testKilledWriterIsReported(self):
+    with mock.patch.object(
+        export_lib, "_RunPartitionWriter", side_effect=lambda *_: os._exit(3)):
+      with self.assertRaisesRegexp(export_lib.Error, "exited"):
+        self._Export("account", writers=2)
+
+  def testInvalidArguments(self):
+    with self.assertRaises(ValueError):
+      self._Export("year", writers=1)
+    with self.assertRaises(ValueError):
+      self._Export("month", writers=0)
+
+
+class ExportColumnsTest(ExportTestBase):
+
+  def setUp(self):
+    super(ExportColumnsTest, self).setUp()
+    self._output_dir = os.path.join(
+        absltest.get_default_test_tmpdir(), self.id())
+    self.addCleanup(shutil.rmtree, self._output_dir, ignore_errors=True)
+
+  def _Export(self):
+    return export_lib.ExportColumns(
+        self._output_dir, transactions_lib.TransactionsTable(streaming=True),
+        self._accounts, self._categories, batch_size=3)
+
+  def testExportColumns(self):
+    stats = self._Export()
+    self.assertEqual(4, stats.num_rows)
+    self.assertEqual(
+        sum(os.path.getsize(os.path.join(self._output_dir, name))
+            for name in os.listdir(self._output_dir)
+            if name != export_lib.MANIFEST_FILE), stats.num_bytes)
+
+    arrays, pools = export_lib.LoadColumns(self._output_dir)
+    self.assertEqual(set(export_lib.EXPORT_COLUMNS), set(arrays))
+    for array in arrays.values():
+      self.assertIsInstance(array, np.memmap)
+      self.assertFalse(array.flags.writeable)
+    self.assertEqual(
+        [datetime.date(2012, 3, day) for day in range(1, 5)],
+        arrays["transaction_date"].tolist())
+    self.assertEqual(
+        [-10.5, -21.0, -31.5, -42.0], arrays["transaction_amount"].tolist())
+    self.assertEqual(["Checking"], pools["account_name"])
+    self.assertEqual([0, 0, export_lib.NO_STRING, 0],
+                     arrays["account_name"].tolist())
+    self.assertEqual(["GROCER 1", "RENT", "UNKNOWN", "GROCER 2"],
+                     pools["transaction_description"])
+    self.assertEqual([0, 1, 2, 3],
+                     arrays["transaction_description"].tolist())
+    self.assertEqual(["Food", "Home"], pools["category"])
+    self.assertEqual([0, 1, export_lib.NO_STRING, 0],
+                     arrays["category"].tolist())
+    self.assertEqual(["Grocer", "Landlord"], pools["display_name"])
+
+  def testLoadWithoutMmap(self):
+    self._Export()
+    arrays, _ = export_lib.LoadColumns(self._output_dir, mmap=False)
+    self.assertNotIsInstance(arrays["transaction_amount"], np.memmap)
+    self.assertEqual(4, len(arrays["transaction_amount"]))
+
+  def testExportNoTransactions(self):
+    self._tables["transactions"]._fake_rows.clear()
+    self.assertEqual(0, self._Export().num_rows)
+    arrays, pools = export_lib.LoadColumns(self._output_dir)
+    self.assertEqual(0, len(arrays["transaction_date"]))
+    self.assertEqual([], pools["category"])
+
+  def testLoadIncompleteExport(self):
+    self._Export()
+    os.remove(os.path.join(self._output_dir, "category.npy"))
+    with self.assertRaises(export_lib.Error):
+      export_lib.LoadColumns(self._output_dir)
+    os.remove(os.path.join(self._output_dir, export_lib.MANIFEST_FILE))
+    with self.assertRaises(export_lib.Error):
+      export_lib.LoadColumns(self._output_dir)
+
+  @unittest.skipIf(export_lib.pd is None, "pandas is not installed.")
+  def testLoadDataFrame(self):
+    self._Export()
+    df = export_lib.LoadDataFrame(self._output_dir)
+    self.assertEqual(export_lib.EXPORT_COLUMNS, list(df.columns))
+    self.assertEqual(["Food", "Home", None, "Food"],
+                     [None if c != c else c for c in df["category"]])
+    self.assertEqual(-105.0, df["transaction_amount"].sum())
+
+
+class RunExportTest(ExportTestBase):
+
+  def setUp(self):
+    super(RunExportTest, self).setUp()
+    self._output_path = os.path.join(
+        absltest.get_default_test_tmpdir(), self.id())
+    self.addCleanup(shutil.rmtree, self._output_path, ignore_errors=True)
+    for path in (self._output_path, self._output_path + ".exportstate"):
+      self.addCleanup(
+          lambda path=path: os.path.isfile(path) and os.remove(path))
+
+  def _Export(self, partition_by=None, since_last_export=True):
+    return export_lib.RunExport(
+        self._output_path, transactions_lib.TransactionsTable(streaming=True),
+        self._accounts, self._categories, partition_by=partition_by,
+        since_last_export=since_last_export, batch_size=3, chunk_size=16)
+
+  def _AddTransaction(self, account_num, description):
+    transactions = transactions_lib.TransactionsTable()
+    transactions.Add(transactions_lib.Transaction(
+        account_num, datetime.date(2012, 4, 1), description, -1.0))
+    transactions.Save()
+
+  def _ReadRows(self, path=None):
+    with open(path or self._output_path, "r") as f:
+      return list(csv.reader(f))
+
+  def testAppendsNewTransactions(self):
+    stats, reason = self._Export()
+    self.assertEqual(4, stats.num_rows)
+    self.assertEqual("No earlier export was found.", reason)
+    self._AddTransaction(1, "RENT")
+    stats, reason = self._Export()
+    self.assertIsNone(reason)
+    self.assertEqual(1, stats.num_rows)
+    rows = self._ReadRows()
+    self.assertEqual(6, len(rows))
+    self.assertEqual(
+        ["Checking", "2012-04-01", "RENT", "-1.0", "Home", "Landlord"],
+        rows[-1])
+    self.assertEqual((0, 0), self._Export()[0])
+
+  def testFullExportIfNotRequested(self):
+    self._Export()
+    stats, reason = self._Export(since_last_export=False)
+    self.assertEqual(4, stats.num_rows)
+    self.assertEqual("A full export was requested.", reason)
+    self.assertEqual(5, len(self._ReadRows()))
+
+  def testFullExportIfOutputWasModified(self):
+    self._Export()
+    with open(self._output_path, "a") as f:
+      f.write("x\n")
+    stats, reason = self._Export()
+    self.assertEqual("The output was modified.", reason)
+    self.assertEqual(5, len(self._ReadRows()))
+
+  def testFullExportIfCategoryMatchesExportedTransaction(self):
+    self._Export()
+    self._categories.Add(categories_lib.Category("UNKN.*", "?", "Misc", True))
+    _, reason = self._Export()
+    self.assertEqual(
+        "Categories were added for exported transactions.", reason)
+    self.assertEqual(["Misc", "?"], self._ReadRows()[3][-2:])
+
+  def testFullExportIfExactCategoryMatchesExportedTransaction(self):
+    self._Export()
+    self._categories.Add(categories_lib.Category("GROCER 1", "G", "Food"))
+    _, reason = self._Export()
+    self.assertEqual(
+        "Categories were added for exported transactions.", reason)
+    self.assertEqual(["Food", "G"], self._ReadRows()[1][-2:])
+
+  def testAppendsIfNewCategoriesDoNotMatch(self):
+    self._Export()
+    self._categories.Add(categories_lib.Category("OTHER.*", "O", "Misc", True))
+    self._categories.Add(categories_lib.Category("BANK", "B", "Fees"))
+    self._AddTransaction(1, "BANK")
+    stats, reason = self._Export()
+    self.assertIsNone(reason)
+    self.assertEqual(1, stats.num_rows)
+    self.assertEqual(["Fees", "B"], self._ReadRows()[-1][-2:])
+
+  def testFullExportIfCategoryChanged(self):
+    self._Export()
+    self._categories.objects[1].category = "Housing"
+    _, reason = self._Export()
+    self.assertEqual("Categories were removed or changed.", reason)
+
+  def testFullExportIfDisplayNameChanged(self):
+    self._Export()
+    self._categories.objects[1].display_name = "Home"
+    _, reason = self._Export()
+    self.assertEqual("Categories were removed or changed.", reason)
+
+  def testFullExportIfAccountMatchesExportedTransaction(self):
+    self._Export()
+    self._accounts.Add(accounts_lib.Account("Savings", 3))
+    self.assertIsNone(self._Export()[1])
+    self._accounts.Add(accounts_lib.Account("Credit", 2))
+    _, reason = self._Export()
+    self.assertEqual("Accounts were added for exported transactions.", reason)
+    self.assertEqual("Credit", self._ReadRows()[3][0])
+
+  def testAppendsToPartitions(self):
+    self._Export(partition_by="account")
+    self._AddTransaction(2, "UNKNOWN")
+    self._AddTransaction(3, "UNKNOWN")
+    stats, reason = self._Export(partition_by="account")
+    self.assertIsNone(reason)
+    self.assertEqual(2, stats.num_rows)
+    self.assertEqual(3, len(self._ReadRows(
+        os.path.join(self._output_path, "2.csv"))))
+    self.assertEqual(2, len(self._ReadRows(
+        os.path.join(self._output_path, "3.csv"))))
+    with open(os.path.join(
+        self._output_path, export_lib.MANIFEST_FILE), "r") as f:
+      manifest = json.load(f)
+    self.assertEqual(6, manifest["num_rows"])
+    self.assertEqual(
+        {"1": 3, "2": 2, "3": 1},
+        dict((p["key"], p["num_rows"]) for p in manifest["partitions"]))
+    _, reason = self._Export(partition_by="month")
+    self.assertEqual("The output layout changed.", reason)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,285 @@
+"""Persistent set of 64-bit fingerprints, used to detect duplicate rows.
+
+Note: none of the classes below are thread-safe.
+"""
+
+import json
+import os
+import struct
+
+
+# Fingerprints are stored on disk as little-endian unsigned 64-bit integers.
+_FINGERPRINT = struct.Struct("<Q")
+
+# Bloom filter parameters. About 10 bits per entry and 7 hash functions give a
+# false positive rate of roughly 1%.
+_BLOOM_BITS_PER_ENTRY = 10
+_BLOOM_NUM_HASHES = 7
+_MIN_BLOOM_BITS = 1 << 20
+
+# Number of fingerprints that can be added to the unsorted log before it is
+# merged into the sorted fingerprint file.
+_MAX_LOG_SIZE = 1 << 16
+
+
+class Error(Exception):
+  """Exception type for this module."""
+
+
+class BloomFilter(object):
+  """Bloom filter over 64-bit fingerprints.
+
+  Fingerprints are assumed to be uniformly distributed, so the bit positions
+  are derived from the fingerprint itself by double hashing.
+  """
+
+  def __init__(self, num_bits, num_hashes, bits=None):
+    """Constructor.
+
+    Args:
+      num_bits: Number of bits in the filter. Must be a multiple of 8.
+      num_hashes: Number of bits set for every fingerprint.
+      bits: Optional bytearray with the filter's contents. Defaults to an empty
+        filter.
+    """
+    if num_bits <= 0 or num_bits % 8:
+      raise ValueError("num_bits must be a positive multiple of 8.")
+    if bits is None:
+      bits = bytearray(num_bits // 8)
+    elif len(bits) * 8 != num_bits:
+      raise ValueError("bits does not hold num_bits bits.")
+    self.num_bits = num_bits
+    self.num_hashes = num_hashes
+    self.bits = bits
+
+  @classmethod
+  def forcapacity(cls, capacity):
+    """Returns an empty filter sized for the given number of fingerprints."""
+    num_bits = max(_MIN_BLOOM_BITS, capacity * _BLOOM_BITS_PER_ENTRY)
+    return cls(num_bits + (-num_bits % 8), _BLOOM_NUM_HASHES)
+
+  def capacity(self):
+    """Returns the number of fingerprints the filter was sized for."""
+    return self.num_bits // _BLOOM_BITS_PER_ENTRY
+
+  def _Positions(self, fingerprint):
+    h1 = fingerprint & 0xffffffff
+    h2 = (fingerprint >> 32) | 1
+    return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+  def Add(self, fingerprint):
+    """Adds a fingerprint. Returns the indices of the bytes that changed."""
+    changed = []
+    for pos in self._Positions(fingerprint):
+      byte, mask = pos >> 3, 1 << (pos & 7)
+      if not self.bits[byte] & mask:
+        self.bits[byte] |= mask
+        changed.append(byte)
+    return changed
+
+  def __contains__(self, fingerprint):
+    for pos in self._Positions(fingerprint):
+      if not self.bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+
+class FingerprintIndex(object):
+  """Set of 64-bit fingerprints of the rows of a table.
+
+  The index remembers how many rows of the table it covers, so that callers
+  can add the fingerprints of rows that were written since it was last
+  updated.
+
+  When constructed with a path, the index is persisted in the following files:
+    <path>.fp: All fingerprints up to the last merge, sorted.
+    <path>.fplog: Fingerprints added since the last merge, in insertion order.
+    <path>.bloom: Bloom filter over all fingerprints.
+    <path>.fpmeta: JSON object with the number of rows covered and the Bloom
+      filter parameters.
+
+  Lookups go through the Bloom filter first, so that fingerprints that are not
+  in the index are usually rejected without any disk access. Otherwise, the
+  log is checked in memory and the sorted file is binary searched on disk.
+  Opening and adding fingerprints to the index does not read the sorted file,
+  except when the log grows large enough to be merged into it.
+
+  Without a path, the index is kept in memory only.
+  """
+
+  def __init__(self, path=None):
+    self._path = path
+    self._num_rows = 0
+    self._num_sorted = 0
+    self._log = set()
+    self._bloom = BloomFilter.forcapacity(0)
+    if path is not None and not self._Load():
+      self.Clear()
+
+  @property
+  def num_rows(self):
+    """Number of table rows whose fingerprints are in the index."""
+    return self._num_rows
+
+  def __len__(self):
+    return self._num_sorted + len(self._log)
+
+  def __contains__(self, fingerprint):
+    if fingerprint not in self._bloom:
+      return False
+    if fingerprint in self._log:
+      return True
+    return self._SearchSorted(fingerprint)
+
+  def Add(self, fingerprints, num_rows):
+    """Adds fingerprints to the index.
+
+    Args:
+      fingerprints: Iterable of fingerprints. Fingerprints that are already in
+        the index are ignored.
+      num_rows: Number of table rows covered by the index after this call.
+
+    Raises:
+      Error: If the index could not be written.
+    """
+    new_fingerprints = []
+    changed_bytes = set()
+    for fp in fingerprints:
+      if fp not in self:
+        self._log.add(fp)
+        new_fingerprints.append(fp)
+        changed_bytes.update(self._bloom.Add(fp))
+    self._num_rows = num_rows
+    if self._path is None:
+      return
+    try:
+      if len(self._log) > _MAX_LOG_SIZE or len(self) > self._bloom.capacity():
+        self._Merge()
+      else:
+        self._AppendToLog(new_fingerprints)
+        self._WriteBloomBytes(changed_bytes)
+      self._WriteMeta()
+    except (IOError, OSError) as e:
+      raise Error("Failed to update fingerprint index %s: %s" % (
+          self._path, e))
+
+  def Clear(self):
+    """Removes all fingerprints from the index, and its files from disk."""
+    self._num_rows = 0
+    self._num_sorted = 0
+    self._log = set()
+    self._bloom = BloomFilter.forcapacity(0)
+    if self._path is None:
+      return
+    for suffix in (".fp", ".fplog", ".bloom", ".fpmeta"):
+      if os.path.exists(self._path + suffix):
+        os.remove(self._path + suffix)
+
+  def _Load(self):
+    """Loads the index from disk. Returns False if it is missing or invalid."""
+    try:
+      with open(self._path + ".fpmeta", "r") as f:
+        meta = json.load(f)
+      num_rows = meta["num_rows"]
+      num_bits = meta["bloom_bits"]
+      num_hashes = meta["bloom_hashes"]
+      with open(self._path + ".bloom", "rb") as f:
+        bits = bytearray(f.read())
+      bloom = BloomFilter(num_bits, num_hashes, bits)
+      sorted_size = (os.path.getsize(self._path + ".fp")
+                     if os.path.exists(self._path + ".fp") else 0)
+      log = set()
+      if os.path.exists(self._path + ".fplog"):
+        with open(self._path + ".fplog", "rb") as f:
+          data = f.read()
+        # Ignore a torn final entry.
+        data = data[:len(data) - len(data) % _FINGERPRINT.size]
+        log.update(struct.unpack(
+            "<%dQ" % (len(data) // _FINGERPRINT.size), data))
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+      return False
+    if sorted_size % _FINGERPRINT.size:
+      return False
+    self._num_rows = num_rows
+    self._num_sorted = sorted_size // _FINGERPRINT.size
+    self._log = log
+    self._bloom = bloom
+    return True
+
+  def _SearchSorted(self, fingerprint):
+    """Binary searches the sorted fingerprint file."""
+    if not self._num_sorted:
+      return False
+    lo, hi = 0, self._num_sorted
+    with open(self._path + ".fp", "rb") as f:
+      while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid * _FINGERPRINT.size)
+        value = _FINGERPRINT.unpack(f.read(_FINGERPRINT.size))[0]
+        if value == fingerprint:
+          return True
+        if value < fingerprint:
+          lo = mid + 1
+        else:
+          hi = mid
+    return False
+
+  def _AppendToLog(self, fingerprints):
+    if not fingerprints:
+      return
+    with open(self._path + ".fplog", "ab") as f:
+      f.write(b"".join(_FINGERPRINT.pack(fp) for fp in fingerprints))
+      f.flush()
+      os.fsync(f.fileno())
+
+  def _WriteBloomBytes(self, changed_bytes):
+    """Writes the bytes of the Bloom filter that changed in place."""
+    bloom_path = self._path + ".bloom"
+    if not os.path.exists(bloom_path):
+      self._WriteFile(bloom_path, bytes(self._bloom.bits))
+      return
+    if not changed_bytes:
+      return
+    with open(bloom_path, "rb+") as f:
+      for byte in sorted(changed_bytes):
+        f.seek(byte)
+        f.write(bytes(self._bloom.bits[byte:byte + 1]))
+      f.flush()
+      os.fsync(f.fileno())
+
+  def _Merge(self):
+    """Merges the log into the sorted file, and resizes the Bloom filter."""
+    fingerprints = set(self._log)
+    if self._num_sorted:
+      with open(self._path + ".fp", "rb") as f:
+        data = f.read()
+      fingerprints.update(struct.unpack("<%dQ" % self._num_sorted, data))
+    fingerprints = sorted(fingerprints)
+    bloom = BloomFilter.forcapacity(2 * len(fingerprints))
+    for fp in fingerprints:
+      bloom.Add(fp)
+    self._WriteFile(
+        self._path + ".fp",
+        struct.pack("<%dQ" % len(fingerprints), *fingerprints))
+    self._WriteFile(self._path + ".bloom", bytes(bloom.bits))
+    if os.path.exists(self._path + ".fplog"):
+      os.remove(self._path + ".fplog")
+    self._num_sorted = len(fingerprints)
+    self._log = set()
+    self._bloom = bloom
+
+  def _WriteMeta(self):
+    self._WriteFile(self._path + ".fpmeta", json.dumps({
+        "num_rows": self._num_rows,
+        "bloom_bits": self._bloom.num_bits,
+        "bloom_hashes": self._bloom.num_hashes,
+    }).encode("utf-8"))
+
+  def _WriteFile(self, path, data):
+    """Atomically replaces the contents of a file."""
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as f:
+      f.write(data)
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(tmp_path, path)
@@ -0,0 +1,121 @@
+"""Tests for fingerprint_lib."""
+
+import fingerprint_lib
+
+import os
+import mock
+import uuid
+
+from absl import flags
+from absl.testing import absltest
+
+
+FLAGS = flags.FLAGS
+
+
+class BloomFilterTest(absltest.TestCase):
+
+  def testAddAndContains(self):
+    bloom = fingerprint_lib.BloomFilter.forcapacity(100)
+    fingerprints = [(i * 0x9e3779b97f4a7c15) % (1 << 64) for i in range(100)]
+    for fp in fingerprints:
+      bloom.Add(fp)
+    for fp in fingerprints:
+      self.assertIn(fp, bloom)
+
+  def testAddReturnsChangedBytes(self):
+    bloom = fingerprint_lib.BloomFilter(64, 3)
+    changed = bloom.Add(12345)
+    self.assertNotEqual([], changed)
+    self.assertEqual([], bloom.Add(12345))
+
+  def testInvalidSize(self):
+    with self.assertRaises(ValueError):
+      fingerprint_lib.BloomFilter(12, 3)
+    with self.assertRaises(ValueError):
+      fingerprint_lib.BloomFilter(16, 3, bytearray(1))
+
+
+class FingerprintIndexTest(absltest.TestCase):
+
+  def setUp(self):
+    self._path = os.path.join(
+        FLAGS.test_tmpdir, "index_{}".format(uuid.uuid1().hex))
+
+  def testInMemory(self):
+    index = fingerprint_lib.FingerprintIndex()
+    index.Add([1, 2, 2, 3], 4)
+    self.assertEqual(4, index.num_rows)
+    self.assertEqual(3, len(index))
+    self.assertIn(2, index)
+    self.assertNotIn(4, index)
+
+  def testPersisted(self):
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    index.Add([10, 20], 2)
+    index.Add([30], 3)
+
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    self.assertEqual(3, index.num_rows)
+    self.assertEqual(3, len(index))
+    for fp in (10, 20, 30):
+      self.assertIn(fp, index)
+    self.assertNotIn(40, index)
+
+  def testMergeIntoSortedFile(self):
+    with mock.patch.object(fingerprint_lib, "_MAX_LOG_SIZE", 2):
+      index = fingerprint_lib.FingerprintIndex(self._path)
+      index.Add([5, 3], 2)
+      self.assertTrue(os.path.exists(self._path + ".fplog"))
+      index.Add([9], 3)
+      self.assertFalse(os.path.exists(self._path + ".fplog"))
+      index.Add([1], 4)
+
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    self.assertEqual(4, len(index))
+    for fp in (1, 3, 5, 9):
+      self.assertIn(fp, index)
+    for fp in (0, 4, 10):
+      self.assertNotIn(fp, index)
+
+  def testBloomFilterGrows(self):
+    with mock.patch.object(fingerprint_lib, "_MIN_BLOOM_BITS", 80):
+      index = fingerprint_lib.FingerprintIndex(self._path)
+      index.Add(range(20), 20)
+
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    self.assertEqual(20, len(index))
+    for fp in range(20):
+      self.assertIn(fp, index)
+
+  def testTornLogEntryIsIgnored(self):
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    index.Add([7], 1)
+    with open(self._path + ".fplog", "ab") as f:
+      f.write(b"\x01\x02\x03")
+
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    self.assertEqual(1, len(index))
+    self.assertIn(7, index)
+
+  def testMissingMetadataClearsIndex(self):
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    index.Add([7], 1)
+    os.remove(self._path + ".fpmeta")
+
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    self.assertEqual(0, index.num_rows)
+    self.assertNotIn(7, index)
+    self.assertFalse(os.path.exists(self._path + ".fplog"))
+
+  def testClear(self):
+    index = fingerprint_lib.FingerprintIndex(self._path)
+    index.Add([7], 1)
+    index.Clear()
+    self.assertEqual(0, index.num_rows)
+    self.assertNotIn(7, index)
+    self.assertFalse(os.path.exists(self._path + ".fpmeta"))
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,146 @@
+"""Runs batches of items through a pipeline of concurrent stages.
+
+Each stage runs in its own thread and is connected to the next one by a bounded
+queue, so a slow stage applies backpressure to the stages before it instead of
+letting batches pile up in memory. Stages that block on I/O overlap with each
+other, so the wall time of a pipeline approaches that of its slowest stage.
+"""
+
+import threading
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+
+# Default number of batches that can wait between two stages.
+DEFAULT_QUEUE_SIZE = 4
+
+# Seconds between checks for cancellation while a stage is blocked on a queue.
+_POLL_SECONDS = 0.1
+
+# Marks the end of the batches in a queue.
+_DONE = object()
+
+
+class Error(Exception):
+  """Exception class for this module."""
+
+
+def Batched(items, batch_size):
+  """Generator that groups an iterable into lists of at most batch_size items.
+
+  Raises:
+    ValueError: If batch_size is not positive.
+  """
+  if batch_size < 1:
+    raise ValueError("batch_size must be positive.")
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def RunPipeline(batches, stages, queue_size=DEFAULT_QUEUE_SIZE):
+  """Generator that passes batches through a sequence of stages.
+
+  The batches are iterated over in their own thread, so producing them, for
+  example by parsing a file, is also a stage of the pipeline. Batches come out
+  of the pipeline in the order they went in.
+
+  If the source or a stage raises an exception, the pipeline is stopped and the
+  exception is raised by this generator. Closing the generator early also stops
+  the pipeline.
+
+  Args:
+    batches: Iterable of batches.
+    stages: List of functions. Each takes a batch and returns the batch to pass
+      to the next stage. Batches that a stage returns as empty or None are not
+      passed on.
+    queue_size: Maximum number of batches waiting between two stages.
+
+  Returns:
+    The next batch returned by the last stage.
+
+  Raises:
+    ValueError: If queue_size is not positive.
+  """
+  if queue_size < 1:
+    raise ValueError("queue_size must be positive.")
+  stop = threading.Event()
+  errors = []
+  queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+  threads = [threading.Thread(
+      target=_RunSource, args=(batches, queues[0], stop, errors))]
+  for stage, in_queue, out_queue in zip(stages, queues, queues[1:]):
+    threads.append(threading.Thread(
+        target=_RunStage, args=(stage, in_queue, out_queue, stop, errors)))
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  try:
+    while True:
+      batch = _Get(queues[-1], stop)
+      if batch is _DONE:
+        break
+      yield batch
+  finally:
+    stop.set()
+    for thread in threads:
+      thread.join()
+  if errors:
+    raise errors[0]
+
+
+def _RunSource(batches, out_queue, stop, errors):
+  try:
+    for batch in batches:
+      if not _Put(out_queue, batch, stop):
+        return
+  except Exception as e:  # pylint: disable=broad-except
+    errors.append(e)
+    stop.set()
+    return
+  _Put(out_queue, _DONE, stop)
+
+
+def _RunStage(stage, in_queue, out_queue, stop, errors):
+  try:
+    while True:
+      batch = _Get(in_queue, stop)
+      if batch is _DONE:
+        break
+      batch = stage(batch)
+      if batch and not _Put(out_queue, batch, stop):
+        return
+  except Exception as e:  # pylint: disable=broad-except
+    errors.append(e)
+    stop.set()
+    return
+  _Put(out_queue, _DONE, stop)
+
+
+def _Get(in_queue, stop):
+  """Returns the next batch from a queue, or _DONE if the pipeline stopped."""
+  while not stop.is_set():
+    try:
+      return in_queue.get(timeout=_POLL_SECONDS)
+    except queue.Empty:
+      pass
+  return _DONE
+
+
+def _Put(out_queue, batch, stop):
+  """Puts a batch in a queue. Returns False if the pipeline stopped."""
+  while not stop.is_set():
+    try:
+      out_queue.put(batch, timeout=_POLL_SECONDS)
+      return True
+    except queue.Full:
+      pass
+  return False
@@ -0,0 +1,85 @@
+"""Tests for pipeline_lib."""
+
+import pipeline_lib
+
+import threading
+
+from absl.testing import absltest
+
+
+class BatchedTest(absltest.TestCase):
+
+  def testBatched(self):
+    self.assertEqual(
+        [[0, 1], [2, 3], [4]], list(pipeline_lib.Batched(range(5), 2)))
+    self.assertEqual([], list(pipeline_lib.Batched([], 2)))
+
+  def testInvalidBatchSize(self):
+    with self.assertRaises(ValueError):
+      list(pipeline_lib.Batched(range(5), 0))
+
+
+class RunPipelineTest(absltest.TestCase):
+
+  def testStagesRunInOrder(self):
+    batches = [[1, 2], [3], [4, 5, 6]]
+    results = list(pipeline_lib.RunPipeline(batches, [
+        lambda batch: [x * 10 for x in batch],
+        lambda batch: [x + 1 for x in batch],
+    ]))
+    self.assertEqual([[11, 21], [31], [41, 51, 61]], results)
+
+  def testNoStages(self):
+    self.assertEqual(
+        [[1], [2]], list(pipeline_lib.RunPipeline([[1], [2]], [])))
+
+  def testEmptyBatchesAreDropped(self):
+    results = list(pipeline_lib.RunPipeline(
+        [[1, 2], [3], [4]],
+        [lambda batch: [x for x in batch if x % 2 == 0]]))
+    self.assertEqual([[2], [4]], results)
+
+  def testSourceErrorIsRaised(self):
+    def Source():
+      yield [1]
+      raise ValueError("bad source")
+    with self.assertRaisesRegexp(ValueError, "bad source"):
+      list(pipeline_lib.RunPipeline(Source(), [lambda batch: batch]))
+
+  def testStageErrorIsRaised(self):
+    def Stage(batch):
+      raise KeyError("bad stage")
+    with self.assertRaises(KeyError):
+      list(pipeline_lib.RunPipeline(
+          ([i] for i in range(100)), [Stage, lambda batch: batch]))
+
+  def testBackpressure(self):
+    produced = []
+    def Source():
+      for i in range(20):
+        produced.append(i)
+        yield [i]
+    pipeline = pipeline_lib.RunPipeline(
+        Source(), [lambda batch: batch], queue_size=1)
+    self.assertEqual([0], next(pipeline))
+    # The source can only be a few batches ahead of the consumer: one in each
+    # queue, one in the stage, and one being put.
+    threading.Event().wait(0.3)
+    self.assertLessEqual(len(produced), 5)
+    pipeline.close()
+
+  def testCloseStopsThreads(self):
+    num_threads = threading.active_count()
+    pipeline = pipeline_lib.RunPipeline(
+        ([i] for i in range(1000)), [lambda batch: batch], queue_size=1)
+    next(pipeline)
+    pipeline.close()
+    self.assertEqual(num_threads, threading.active_count())
+
+  def testInvalidQueueSize(self):
+    with self.assertRaises(ValueError):
+      list(pipeline_lib.RunPipeline([[1]], [], queue_size=0))
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -5,16 +5,85 @@ Note: none of the classes below are thread-safe.
 
 import os
 import csv
+import datetime
+import hashlib
+import io
+import itertools
 import json
+import locale
 import shutil
+import sqlite3
+import struct
 import tabulate
 
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+try:
+  _STRING_TYPES = basestring
+except NameError:
+  _STRING_TYPES = str
+
+try:
+  import numpy as np
+except ImportError:
+  # numpy is only required by the columnar storage type.
+  np = None
+
 #import gflags as flags
 from absl import flags
 from collections import deque
 
 
-STORAGE_TYPES = ["csv"]
+STORAGE_TYPES = ["csv", "sqlite", "columnar"]
+
+# Format of serialized date values.
+DATE_FORMAT = "%Y-%m-%d"
+
+# Column types that can be declared in the storage config. Columns without a
+# declared type are str columns.
+COLUMN_TYPES = ["int", "float", "date", "bool", "str"]
+
+# Numpy dtype that the columnar storage type uses for each column type. str
+# columns are stored as codes into a pool of distinct strings.
+_COLUMNAR_DTYPES = {
+    "int": "<i8",
+    "float": "<f8",
+    "date": "<i4",
+    "bool": "|b1",
+    "str": "<i4",
+}
+
+# Dates are stored by the columnar storage type as days since this date.
+DATE_EPOCH = datetime.date(1970, 1, 1)
+
+# Number of rows decoded at a time when reading rows from a columnar table.
+_COLUMNAR_READ_CHUNK_SIZE = 4096
+
+# Number of rows that ObjectStorage.ReadAll decodes at a time.
+_DECODE_BATCH_SIZE = 4096
+
+# Name of the SQL table that holds the rows in each SQLite database.
+_SQLITE_TABLE_NAME = "rows"
+
+# Number of bytes read at a time while searching backwards for the end of the
+# last complete row in a CSV file.
+_RECOVERY_CHUNK_SIZE = 4096
+
+# Suffix of the sidecar file that holds the byte offsets of rows in a CSV file.
+_ROW_INDEX_SUFFIX = ".idx"
+
+# Header of a row index file: the inode number of the CSV file, and the SHA-1
+# digest of the header and last indexed row of the CSV file.
+_ROW_INDEX_HEADER = struct.Struct("<Q20s")
+
+# Every offset in a row index file is a little-endian unsigned 64-bit integer.
+_ROW_INDEX_ENTRY = struct.Struct("<Q")
+
+# Encoding that open() uses for CSV files in text mode under Python 3.
+_CSV_ENCODING = locale.getpreferredencoding(False)
 
 
 flags.DEFINE_enum(
@@ -25,6 +94,12 @@ flags.DEFINE_string(
 flags.DEFINE_string(
     "csv_base_path", "csvdata",
     "Path to base directory where all CSVs will be stored.")
+flags.DEFINE_string(
+    "sqlite_base_path", "sqlitedata",
+    "Path to base directory where all SQLite databases will be stored.")
+flags.DEFINE_string(
+    "columnar_base_path", "columnardata",
+    "Path to base directory where all columnar tables will be stored.")
 
 
 FLAGS = flags.FLAGS
@@ -34,18 +109,198 @@ class Error(Exception):
   """Exception type for this module."""
 
 
-def GetStorageTable(table_name):
-  """Returns a storage interface object, given a storage config object."""
-  config = StorageConfig.fromconfigfile(FLAGS.storage_config_file, table_name)
-  if FLAGS.storage_type == "csv":
-    return CsvTable(config)
+def EvictCachedTable(file_path):
+  """Drops the cached rows of the table stored at file_path, if any."""
+  _TABLE_CACHE.Evict(file_path)
+
+
+def ClearTableCache():
+  """Drops the cached rows of all tables."""
+  _TABLE_CACHE.Clear()
+
+
+def GetStorageCatalog(config_file=None):
+  """Returns the storage catalog loaded from a config file.
+
+  Each config file is only read and validated the first time its catalog is
+  requested. Use ReloadStorageCatalog() to pick up changes to the file.
+
+  Args:
+    config_file: Path of the storage config file. Defaults to
+      --storage_config_file.
+
+  Raises:
+    Error: If the config file cannot be read or is invalid.
+  """
+  key = _GetCatalogKey(config_file)
+  catalog = _CATALOGS.get(key)
+  if catalog is None:
+    catalog = StorageCatalog.fromconfigfile(key)
+    _CATALOGS[key] = catalog
+  return catalog
+
+
+def ReloadStorageCatalog(config_file=None):
+  """Rereads a storage config file and returns the new catalog.
+
+  Tables that are already open keep the config they were opened with.
+
+  Args:
+    config_file: Path of the storage config file. Defaults to
+      --storage_config_file.
+
+  Raises:
+    Error: If the config file cannot be read or is invalid. The previously
+      loaded catalog is kept in that case.
+  """
+  key = _GetCatalogKey(config_file)
+  _CATALOGS[key] = StorageCatalog.fromconfigfile(key)
+  return _CATALOGS[key]
+
+
+def _GetCatalogKey(config_file):
+  if config_file is None:
+    config_file = FLAGS.storage_config_file
+  return os.path.realpath(os.path.expanduser(config_file))
+
+
+# Storage catalogs that were loaded in this process, keyed by the resolved
+# path of their config file.
+_CATALOGS = {}
+
+
+def GetRowDecoder(columns, column_types):
+  """Returns the RowDecoder for a schema, compiling it on first use.
+
+  Args:
+    columns: Sequence of column names.
+    column_types: Dict mapping column names to one of COLUMN_TYPES.
+  """
+  key = tuple((col, column_types.get(col, "str")) for col in columns)
+  decoder = _DECODERS.get(key)
+  if decoder is None:
+    decoder = RowDecoder(columns, column_types)
+    _DECODERS[key] = decoder
+  return decoder
+
+
+class RowDecoder(object):
+  """Converts batches of serialized rows to native Python values.
+
+  The conversion function of every column is chosen once, when the decoder is
+  created. Dates are parsed through a memo, since the same dates repeat across
+  many rows.
+  """
+
+  def __init__(self, columns, column_types):
+    """Constructor.
+
+    Args:
+      columns: Sequence of column names.
+      column_types: Dict mapping column names to one of COLUMN_TYPES. Columns
+        that are not listed are str columns.
+
+    Raises:
+      Error: If a column type is not supported.
+    """
+    self._columns = tuple(columns)
+    self._converters = []
+    for col in self._columns:
+      col_type = column_types.get(col, "str")
+      if col_type not in COLUMN_TYPES:
+        raise Error("Unsupported type for column %s: %r" % (col, col_type))
+      self._converters.append(self._GetConverter(col_type))
+
+  def _GetConverter(self, col_type):
+    """Returns the function that decodes a value, or None for str values."""
+    if col_type == "int":
+      return int
+    if col_type == "float":
+      return float
+    if col_type == "bool":
+      return _DecodeBool
+    if col_type == "date":
+      return _DateParser()
+    return None
+
+  def DecodeBatch(self, rows):
+    """Decodes a batch of rows.
+
+    Args:
+      rows: List of dicts keyed by column names, with serialized values.
+
+    Returns:
+      List with a tuple of decoded values for every row, in column order.
+    """
+    columns = []
+    for col, converter in zip(self._columns, self._converters):
+      values = [row[col] for row in rows]
+      if converter is not None:
+        values = list(map(converter, values))
+      columns.append(values)
+    return list(zip(*columns))
+
+
+def _DecodeBool(value):
+  return value.lower() == "true"
+
+
+class _DateParser(object):
+  """Callable that parses serialized dates, memoizing the results."""
+
+  def __init__(self):
+    self._dates = {}
+
+  def __call__(self, value):
+    try:
+      return self._dates[value]
+    except KeyError:
+      date = datetime.datetime.strptime(value, DATE_FORMAT).date()
+      self._dates[value] = date
+      return date
+
+
+# RowDecoders that were compiled in this process, keyed by schema.
+_DECODERS = {}
+
+
+def GetStorageTable(table_name, streaming=False):
+  """Returns a storage interface object, given a storage config object.
+
+  Args:
+    table_name: Name of the table in the storage config file.
+    streaming: If True, rows are read from storage on demand instead of being
+      loaded into memory when the table is opened.
+  """
+  config = GetStorageCatalog().GetTableConfig(table_name)
+  storage_type = config.storage_type or FLAGS.storage_type
+  if storage_type == "csv":
+    return CsvTable(config, streaming=streaming)
+  if storage_type == "sqlite":
+    # SQLite always reads rows on demand, so streaming needs no special mode.
+    return SqliteTable(config)
+  if storage_type == "columnar":
+    # Columnar tables are memory-mapped, so nothing is loaded up front.
+    return ColumnarTable(config)
+  raise Error("Unknown storage type for table %s: %r" % (
+      table_name, storage_type))
+
+
+class Index(object):
+  """Declares a secondary index of an ObjectStorage on an object attribute.
+
+  Subclasses of ObjectStorage list their indexes in their INDEXES class
+  attribute. A unique index allows at most one object per value.
+  """
+
+  def __init__(self, attribute, unique=False):
+    self.attribute = attribute
+    self.unique = unique
 
 
 # TODO: Unit test this class and remove subclass unit tests.
 # TODO: Make an object base class and make it clear what subclasses need to
 # implement.
-# TODO: Avoid having to load the underlying CSV data every time a new
-# ObjectStorage subclass is instantiated.
 class ObjectStorage(object):
   """Accesses deserialized objects from a storage backend.
 
@@ -55,26 +310,112 @@ class ObjectStorage(object):
     tolist
     getlistheadings
 
+  The object class may also implement fromtrusted, a classmethod that takes
+  decoded column values as positional arguments in column order, and builds an
+  object without validating them. If it does, and the storage table declares
+  column types, rows are decoded in batches by a RowDecoder and passed to
+  fromtrusted instead of fromdict.
+
   The construction of this object is backed by a StorageTable containing
   the ability to access serialized objects. Use ObjectStorage.ReadAll() to
   deserialize the data in the storage table. Use the Add() and Save() methods
   to add new objects to the storage table and serialize/save the new objects to
   disk.
+
+  When constructed with streaming=True, rows are pulled from storage only as
+  they are read. Use ObjectStorage.ReadBatches() to process large tables in
+  bounded memory.
+
+  Subclasses can declare secondary indexes over the objects in this object, in
+  the INDEXES class attribute. Use ObjectsBy() and ObjectBy() to query them.
+  An index is built on its first query after the objects are read with
+  ReadAll(overwrite=True), and kept up to date by Add().
   """
 
+  INDEXES = ()
+  """Tuple of the declared Index objects."""
+
   _objects = deque()
 
-  def __init__(self, table_name, obj_cls, table_headings):
-    self._storage = GetStorageTable(table_name)
+  def __init__(self, table_name, obj_cls, table_headings, streaming=False):
+    self._storage = GetStorageTable(table_name, streaming=streaming)
     self._objects = deque()
     self._obj_cls = obj_cls
     self._table_headings = table_headings
+    # Maps the attributes of the indexes that have been built to dicts, which
+    # map values to the list of their objects, in the order of self._objects.
+    # Objects are referenced directly, since random access to a deque is slow.
+    self._indexes = {}
 
   def Add(self, obj):
+    """Adds an object.
+
+    Raises:
+      ValueError: If the object is of the wrong type, or has the same value as
+        another object for an attribute with a unique index.
+    """
     if not isinstance(obj, self._obj_cls):
       raise ValueError("Must add a %s object." % self._obj_cls.__name__)
+    for index in self.INDEXES:
+      value = getattr(obj, index.attribute)
+      if index.unique and value in self.GetIndex(index.attribute):
+        raise ValueError("An object with %s %r exists already." % (
+            index.attribute, value))
     obj.is_new = True
     self._objects.append(obj)
+    for attribute, objects_by_value in self._indexes.items():
+      objects_by_value.setdefault(getattr(obj, attribute), []).append(obj)
+
+  def GetIndex(self, attribute):
+    """Returns a declared index, building it if needed.
+
+    Args:
+      attribute: Attribute of a declared index.
+
+    Returns:
+      Dict that maps every value of the attribute to the list of its objects,
+      in the order of self.objects. It must not be modified.
+
+    Raises:
+      ValueError: If no index is declared on the attribute.
+      Error: If a unique index has a value more than once.
+    """
+    objects_by_value = self._indexes.get(attribute)
+    if objects_by_value is None:
+      index = self._GetDeclaredIndex(attribute)
+      objects_by_value = {}
+      for obj in self._objects:
+        objects_by_value.setdefault(getattr(obj, attribute), []).append(obj)
+      if index.unique and len(objects_by_value) < len(self._objects):
+        raise Error("%s values of %s objects are not unique." % (
+            attribute, self._obj_cls.__name__))
+      self._indexes[attribute] = objects_by_value
+    return objects_by_value
+
+  def ObjectsBy(self, attribute, value):
+    """Returns the list of objects whose attribute is equal to value.
+
+    Raises:
+      ValueError: If no index is declared on the attribute.
+    """
+    return list(self.GetIndex(attribute).get(value, ()))
+
+  def ObjectBy(self, attribute, value):
+    """Returns the object whose attribute is equal to value, or None.
+
+    Raises:
+      ValueError: If no unique index is declared on the attribute.
+    """
+    if not self._GetDeclaredIndex(attribute).unique:
+      raise ValueError("The index on %r is not unique." % attribute)
+    objects = self.GetIndex(attribute).get(value)
+    return objects[0] if objects else None
+
+  def _GetDeclaredIndex(self, attribute):
+    for index in self.INDEXES:
+      if index.attribute == attribute:
+        return index
+    raise ValueError("No index is declared on %r." % attribute)
 
   def Save(self):
     """Saves object information to storage."""
@@ -93,12 +434,65 @@ class ObjectStorage(object):
     Returns:
         Deque of objects that were read.
     """
-    objs = deque(
-        self._obj_cls.fromdict(row) for row in self._storage.GetAllRows())
+    decoder = self._GetRowDecoder()
+    if decoder is None:
+      objs = deque(self._obj_cls.fromdict(row) for row in self._storage)
+    else:
+      objs = deque()
+      for rows in self._storage.ReadBatches(_DECODE_BATCH_SIZE):
+        objs.extend(itertools.starmap(
+            self._obj_cls.fromtrusted, decoder.DecodeBatch(rows)))
     if overwrite:
       self._objects = objs
+      self._indexes = {}
     return objs
 
+  def ReadBatches(self, batch_size):
+    """Generator that deserializes objects from storage in batches.
+
+    Only one batch of rows and objects is held in memory at a time. The
+    objects are not added to this object.
+
+    Args:
+      batch_size: Maximum number of objects in each batch.
+
+    Returns:
+      The next batch of objects, as a list.
+    """
+    decoder = self._GetRowDecoder()
+    for rows in self._storage.ReadBatches(batch_size):
+      yield self._ObjectsFromRows(rows, decoder)
+
+  def GetObjects(self, start, stop=None):
+    """Deserializes the objects in storage positions [start, stop).
+
+    Like list slicing, the range is clipped to the rows that exist. The objects
+    are not added to this object.
+
+    Args:
+      start: Position of the first object. Must not be negative.
+      stop: Position after the last object, or None to read to the end.
+
+    Returns:
+      List of objects that were read.
+    """
+    return self._ObjectsFromRows(
+        self._storage.GetRows(start, stop), self._GetRowDecoder())
+
+  def _ObjectsFromRows(self, rows, decoder):
+    """Deserializes a list of rows, using the decoder if it is not None."""
+    if decoder is None:
+      return [self._obj_cls.fromdict(row) for row in rows]
+    return list(itertools.starmap(
+        self._obj_cls.fromtrusted, decoder.DecodeBatch(rows)))
+
+  def _GetRowDecoder(self):
+    """Returns the RowDecoder for trusted deserialization, or None."""
+    column_types = self._storage.column_types
+    if column_types is None or not hasattr(self._obj_cls, "fromtrusted"):
+      return None
+    return GetRowDecoder(self._storage.columns, column_types)
+
   def Print(self):
     """Print information about objects."""
     table = [a.tolist() for a in self._objects]
@@ -118,17 +512,157 @@ class ObjectStorage(object):
     return self._objects
 
 
+class StorageCatalog(object):
+  """Immutable set of validated table configs, loaded from a config file.
+
+  The config file is a JSON object that maps table names to table configs. See
+  StorageConfig for the keys of a table config.
+  """
+
+  def __init__(self, config_json):
+    """Validates every table config.
+
+    Args:
+      config_json: Dict mapping table names to table config dicts.
+
+    Raises:
+      Error: If any table config is invalid.
+    """
+    if not isinstance(config_json, dict):
+      raise Error("Storage config must map table names to table configs.")
+    self._configs = {}
+    for table_name, config_dict in config_json.items():
+      try:
+        self._configs[table_name] = StorageConfig(config_dict)
+      except Error as e:
+        raise Error("Invalid config for table %s: %s" % (table_name, e))
+
+  @classmethod
+  def fromconfigfile(cls, config_file):
+    try:
+      with open(config_file, "r") as f:
+        config_json = json.load(f)
+    except (IOError, ValueError) as e:
+      raise Error("Failed to read storage config %s: %s" % (config_file, e))
+    return cls(config_json)
+
+  def GetTableConfig(self, table_name):
+    """Returns the StorageConfig of a table.
+
+    Raises:
+      Error: If the table is not in the catalog.
+    """
+    if table_name not in self._configs:
+      raise Error("Unknown table: %r" % table_name)
+    return self._configs[table_name]
+
+  def GetTableNames(self):
+    """Returns a sorted list of the names of all tables in the catalog."""
+    return sorted(self._configs)
+
+
 class StorageConfig(object):
+  """Immutable, validated config of a single table.
+
+  A table config is a dict with the following keys:
+    rel_path: Path of the table, relative to the base path of the backend.
+    columns: List of unique column names.
+    column_types: Optional dict mapping column names to one of COLUMN_TYPES.
+      Columns that are not listed are str columns. If the types are not
+      declared, objects are deserialized without the trusted fast path.
+    indexed_columns: Optional list of columns that backends with native index
+      support should index.
+    storage_type: Optional storage type that overrides --storage_type for this
+      table.
+  """
+
+  _KEYS = frozenset(
+      ["rel_path", "columns", "column_types", "indexed_columns",
+       "storage_type"])
+
   def __init__(self, config_dict):
-    """Initialize config object with parameters."""
-    self.rel_path = config_dict["rel_path"]
-    self.columns = config_dict["columns"]
+    """Initialize config object with parameters.
+
+    Raises:
+      Error: If the config is invalid.
+    """
+    if not isinstance(config_dict, dict):
+      raise Error("Table config must be a dict.")
+    unknown_keys = set(config_dict) - self._KEYS
+    if unknown_keys:
+      raise Error("Unknown keys: %r" % sorted(unknown_keys))
+    if "rel_path" not in config_dict or "columns" not in config_dict:
+      raise Error("Both rel_path and columns are required.")
+
+    rel_path = config_dict["rel_path"]
+    if not isinstance(rel_path, _STRING_TYPES) or not rel_path:
+      raise Error("rel_path must be a non-empty string.")
+    columns = config_dict["columns"]
+    if (not isinstance(columns, list) or not columns
+        or not all(isinstance(col, _STRING_TYPES) for col in columns)):
+      raise Error("columns must be a non-empty list of strings.")
+    if len(set(columns)) != len(columns):
+      raise Error("Column names not unique: %r" % columns)
+
+    column_types = config_dict.get("column_types")
+    if column_types is not None and not isinstance(column_types, dict):
+      raise Error("column_types must be a dict.")
+    for col, col_type in (column_types or {}).items():
+      if col not in columns:
+        raise Error("Type declared for unknown column: %r" % col)
+      if col_type not in COLUMN_TYPES:
+        raise Error("Unsupported type for column %s: %r" % (col, col_type))
+
+    indexed_columns = config_dict.get("indexed_columns", [])
+    if not isinstance(indexed_columns, list):
+      raise Error("indexed_columns must be a list.")
+    for col in indexed_columns:
+      if col not in columns:
+        raise Error("Index declared for unknown column: %r" % col)
+
+    storage_type = config_dict.get("storage_type")
+    if storage_type is not None and storage_type not in STORAGE_TYPES:
+      raise Error("Unknown storage type: %r" % storage_type)
+
+    self._rel_path = rel_path
+    self._columns = tuple(columns)
+    if column_types is None:
+      self._column_types = None
+    else:
+      self._column_types = tuple(
+          column_types.get(col, "str") for col in columns)
+    self._indexed_columns = tuple(indexed_columns)
+    self._storage_type = storage_type
+
+  @property
+  def rel_path(self):
+    return self._rel_path
+
+  @property
+  def columns(self):
+    """Tuple of column names."""
+    return self._columns
+
+  @property
+  def column_types(self):
+    """Dict mapping every column name to its type, or None if not declared."""
+    if self._column_types is None:
+      return None
+    return dict(zip(self._columns, self._column_types))
+
+  @property
+  def indexed_columns(self):
+    return self._indexed_columns
+
+  @property
+  def storage_type(self):
+    """Storage type of this table, or None to use --storage_type."""
+    return self._storage_type
 
   @classmethod
   def fromconfigfile(cls, config_file, storage_name):
-    with open(config_file, "r") as f:
-      config_json = json.load(f)
-    return cls(config_json[storage_name])
+    """Returns the config of a table, from the catalog of config_file."""
+    return GetStorageCatalog(config_file).GetTableConfig(storage_name)
 
 
 class StorageTable(object):
@@ -142,12 +676,14 @@ class StorageTable(object):
     _WriteBuffer
   """
 
-  def __init__(self, table_name, columns):
+  def __init__(self, table_name, columns, column_types=None):
     """Constructor.
 
     Args:
       table_name: Name of the table.
       columns: List of unique column names in the table.
+      column_types: Optional dict mapping column names to one of COLUMN_TYPES.
+        None if the types of the columns are unknown.
 
     Raises:
       ValueError: If column names are not unique.
@@ -157,8 +693,18 @@ class StorageTable(object):
     if len(set(columns)) != len(columns):
       raise ValueError("Column names not unique.")
     self._columns = columns
+    self._column_types = column_types
     self._buffer = deque()
 
+  @property
+  def columns(self):
+    return self._columns
+
+  @property
+  def column_types(self):
+    """Dict mapping column names to their types, or None if unknown."""
+    return self._column_types
+
   def WriteRow(self, *args, **kwargs):
     """Writes row to storage.
 
@@ -189,6 +735,108 @@ class StorageTable(object):
     """
     return list(self._ReadRows())
 
+  def ReadBatches(self, batch_size):
+    """Generator that reads rows in batches.
+
+    Args:
+      batch_size: Maximum number of rows in each batch.
+
+    Returns:
+      The next batch of rows, as a list of dicts keyed by the column names.
+
+    Raises:
+      ValueError: If batch_size is not positive.
+    """
+    if batch_size < 1:
+      raise ValueError("batch_size must be positive.")
+    batch = []
+    for row in self._ReadRows():
+      batch.append(row)
+      if len(batch) == batch_size:
+        yield batch
+        batch = []
+    if batch:
+      yield batch
+
+  def NumRows(self):
+    """Returns the number of rows in storage.
+
+    This implementation reads the whole table. Subclasses that can count rows
+    more cheaply should override it.
+    """
+    return sum(1 for _ in self._ReadRows())
+
+  def GetRow(self, index):
+    """Returns the row at the given position, as a dict.
+
+    Raises:
+      IndexError: If there is no row at that position.
+    """
+    if index < 0:
+      raise IndexError("Row index out of range: %d" % index)
+    rows = self.GetRows(index, index + 1)
+    if not rows:
+      raise IndexError("Row index out of range: %d" % index)
+    return rows[0]
+
+  def GetRows(self, start, stop=None):
+    """Returns the rows in positions [start, stop), as a list of dicts.
+
+    Like list slicing, the range is clipped to the rows that exist.
+
+    This implementation reads every row before stop. Subclasses with random
+    access to rows should override it.
+
+    Args:
+      start: Position of the first row. Must not be negative.
+      stop: Position after the last row, or None to read to the end.
+
+    Raises:
+      ValueError: If start or stop is negative.
+    """
+    if start < 0 or (stop is not None and stop < 0):
+      raise ValueError("Row positions must not be negative.")
+    return list(itertools.islice(self._ReadRows(), start, stop))
+
+  def Tail(self, num_rows):
+    """Returns the last num_rows rows, as a list of dicts."""
+    if num_rows <= 0:
+      return []
+    return self.GetRows(max(0, self.NumRows() - num_rows))
+
+  def LookupRows(self, column, value):
+    """Returns all rows whose column is equal to value.
+
+    This implementation scans the whole table. Subclasses that can use an index
+    should override it.
+
+    Args:
+      column: Name of the column to match.
+      value: Serialized value to look for.
+
+    Returns:
+      A list of dicts, with each row's data keyed by the column names.
+
+    Raises:
+      ValueError: If column is not a column of this table.
+    """
+    if column not in self._columns:
+      raise ValueError("Unknown column: %r" % column)
+    return [row for row in self._ReadRows() if row[column] == value]
+
+  def GetSidecarPath(self, name):
+    """Returns the path of a file that holds data derived from this table.
+
+    Sidecar files, such as indexes, are stored next to the table's own files.
+
+    Args:
+      name: Name of the sidecar, used as the file's extension.
+
+    Returns:
+      The path of the sidecar file, or None if the table is not stored on disk.
+    """
+    return None
+
   def BufferRowForWrite(self, *args, **kwargs):
     """Buffers rows in memory that should be written.
 
@@ -297,31 +945,287 @@ class StorageTable(object):
     raise NotImplementedError("_WriteBuffer must be overridden by subclasses.")
 
 
-class StorageTableIterator(StorageTable):
+class StorageTableIterator(object):
   """Class that enables callers to iterate through rows in StorageTable."""
 
   def __init__(self, table):
     self._rowgenerator = table._ReadRows()
 
-  # TODO(py2to3): Change this to __next__.
-  def next(self):
+  def __iter__(self):
+    return self
+
+  def __next__(self):
     next_row = next(self._rowgenerator)
     if not next_row:
       raise StopIteration
     return next_row
 
+  # Python 2 iterator protocol.
+  next = __next__
+
+
+class _TableCache(object):
+  """Process-wide cache of parsed table rows, keyed by resolved file path.
+
+  Each entry remembers the modification time, size and inode of the file when
+  it was parsed, and is discarded as soon as the file on disk no longer
+  matches. All tables opened on the same file share the cached list of rows.
+  """
+
+  def __init__(self):
+    self._entries = {}
+
+  def Get(self, file_path, loader):
+    """Returns the rows of the file, calling loader() only on a cache miss."""
+    key = os.path.realpath(file_path)
+    stat = _GetFileStat(key)
+    entry = self._entries.get(key)
+    if entry is not None and entry[0] == stat:
+      return entry[1]
+    rows = loader()
+    self._entries[key] = (stat, rows)
+    return rows
+
+  def Refresh(self, file_path, rows, stat_before_write):
+    """Revalidates an entry after rows were written through this process.
+
+    The entry is kept only if it holds the same list of rows that was written
+    to, and the file was unchanged between the time it was cached and the
+    write. Otherwise the entry is evicted.
+
+    Args:
+      file_path: Path of the file that was written.
+      rows: List of rows held by the writer, already updated with the write.
+      stat_before_write: Result of _GetFileStat() taken just before the write.
+    """
+    key = os.path.realpath(file_path)
+    entry = self._entries.get(key)
+    if entry is None:
+      return
+    if entry[1] is rows and entry[0] == stat_before_write:
+      self._entries[key] = (_GetFileStat(key), rows)
+    else:
+      del self._entries[key]
+
+  def Evict(self, file_path):
+    self._entries.pop(os.path.realpath(file_path), None)
+
+  def Clear(self):
+    self._entries.clear()
+
+
+def _GetFileStat(file_path):
+  """Returns a tuple that changes whenever the file is modified, or None."""
+  try:
+    st = os.stat(file_path)
+  except OSError:
+    return None
+  return (st.st_mtime, st.st_size, st.st_ino)
+
+
+_TABLE_CACHE = _TableCache()
+
+
+def _ReadRowIndexFile(index_path, file_path, file_stat):
+  """Reads the offsets in a row index file.
+
+  Args:
+    index_path: Path of the row index file.
+    file_path: Path of the CSV file.
+    file_stat: os.stat result of the CSV file.
+
+  Returns:
+    The list of offsets, or None if the index file does not exist, is
+    corrupted, or no longer describes the CSV file: its inode number differs,
+    the offsets run past the end of the file, or the header or last indexed
+    row were changed.
+  """
+  try:
+    with open(index_path, "rb") as f:
+      data = f.read()
+  except (IOError, OSError):
+    return None
+  size = _ROW_INDEX_ENTRY.size
+  header_size = _ROW_INDEX_HEADER.size
+  if len(data) < header_size or (len(data) - header_size) % size:
+    return None
+  file_ino, digest = _ROW_INDEX_HEADER.unpack_from(data, 0)
+  if file_ino != file_stat.st_ino:
+    return None
+  offsets = list(struct.unpack(
+      "<%dQ" % ((len(data) - header_size) // size), data[header_size:]))
+  if offsets and offsets[-1] > file_stat.st_size:
+    return None
+  try:
+    if _DigestIndexedRows(file_path, offsets) != digest:
+      return None
+  except (IOError, OSError):
+    return None
+  return offsets
+
+
+def _WriteRowIndexFile(index_path, file_path, file_ino, offsets, num_stored):
+  """Stores the offsets of a CSV file in its row index file.
+
+  The new offsets are appended before the header is updated, so an interrupted
+  write leaves an index whose digest no longer matches, which is rebuilt. The
+  index only saves rescanning the CSV file, so it is left as it is if it can't
+  be written.
+
+  Args:
+    index_path: Path of the row index file.
+    file_path: Path of the CSV file.
+    file_ino: Inode number of the CSV file.
+    offsets: List of the offsets of the CSV file.
+    num_stored: Number of the offsets that the index file already holds, or
+      None if it must be rewritten.
+  """
+  try:
+    header = _ROW_INDEX_HEADER.pack(
+        file_ino, _DigestIndexedRows(file_path, offsets))
+    if num_stored is None:
+      with open(index_path, "wb") as f:
+        f.write(header)
+        f.write(b"".join(_ROW_INDEX_ENTRY.pack(o) for o in offsets))
+    else:
+      with open(index_path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        f.write(b"".join(
+            _ROW_INDEX_ENTRY.pack(o) for o in offsets[num_stored:]))
+        f.seek(0)
+        f.write(header)
+  except (IOError, OSError):
+    pass
+
+
+def _DigestIndexedRows(file_path, offsets):
+  """Returns the SHA-1 digest of the header and last indexed row of a CSV file.
+
+  Rows are only ever appended to CSV files, so the digest detects a file that
+  was edited in place: an edit that moves the rows shifts other bytes between
+  the last two offsets.
+
+  Args:
+    file_path: Path of the CSV file.
+    offsets: List of the offsets of the CSV file.
+  """
+  sha = hashlib.sha1()
+  if offsets:
+    with open(file_path, "rb") as f:
+      sha.update(f.read(offsets[0]))
+      if len(offsets) > 1:
+        f.seek(offsets[-2])
+        sha.update(f.read(offsets[-1] - offsets[-2]))
+  return sha.digest()
+
+
+def _ScanRowEnds(f, start, end):
+  """Finds the offsets at which complete CSV rows end.
+
+  A newline ends a row unless it is inside a quoted field, which is the case
+  when an odd number of quote characters precede it in the row.
+
+  Args:
+    f: CSV file opened in binary mode.
+    start: Offset of the start of a row.
+    end: Offset at which to stop scanning.
+
+  Returns:
+    List of the offsets that follow each complete row in [start, end).
+  """
+  f.seek(start)
+  offsets = []
+  pos = start
+  in_quotes = False
+  while pos < end:
+    line = f.readline(end - pos)
+    if not line:
+      break
+    pos += len(line)
+    if line.count(b'"') % 2:
+      in_quotes = not in_quotes
+    if line.endswith(b"\n") and not in_quotes:
+      offsets.append(pos)
+  return offsets
+
+
+def _IsCompleteCsvRecord(data, num_columns):
+  """Returns True if data holds one complete CSV record without its newline.
+
+  The last row of a CSV file that was edited by hand may lack its newline. It
+  is only considered torn by an interrupted append if its quotes are unbalanced
+  or it does not have a field for every column.
+
+  Args:
+    data: Bytes that follow the last newline-terminated row of a CSV file.
+    num_columns: Number of columns of the table.
+  """
+  if data.count(b'"') % 2:
+    return False
+  if not isinstance(data, str):
+    data = data.decode(_CSV_ENCODING)
+  records = list(csv.reader(StringIO(data)))
+  return len(records) == 1 and len(records[0]) == num_columns
+
+
+def _TruncateTornLine(file_path):
+  """Truncates a partially written line from the end of a file.
+
+  Every complete line ends with a newline, so any bytes following the last
+  newline in the file belong to a write that did not finish. Only use it for
+  files whose lines never contain newlines, unlike quoted CSV fields.
+
+  Args:
+    file_path: Path of the file. Nothing is done if it does not exist.
+  """
+  if not os.path.isfile(file_path):
+    return
+  with open(file_path, "rb+") as f:
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size == 0:
+      return
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+      return
+    pos = size
+    new_size = 0
+    while pos > 0:
+      step = min(_RECOVERY_CHUNK_SIZE, pos)
+      pos -= step
+      f.seek(pos)
+      idx = f.read(step).rfind(b"\n")
+      if idx != -1:
+        new_size = pos + idx + 1
+        break
+    f.truncate(new_size)
+    f.flush()
+    os.fsync(f.fileno())
+
 
 class CsvTable(StorageTable):
-  """Subclass that stores rows in a CSV file."""
+  """Subclass that stores rows in a CSV file.
+
+  Parsed rows are shared through a process-wide cache, so opening the same
+  table several times only parses the file once. In streaming mode, nothing is
+  cached: rows are parsed from the file each time they are iterated over.
+
+  In streaming mode, random access to rows goes through a sidecar index file
+  with the byte offset of every row, which is extended as rows are appended.
+  Reads only extend the offsets in memory.
+  """
 
   file_path = ""
 
-  def __init__(self, csv_config):
+  def __init__(self, csv_config, streaming=False):
     self.file_path = os.path.join(
         os.path.expanduser(FLAGS.csv_base_path), csv_config.rel_path)
     super(CsvTable, self).__init__(
-        csv_config.rel_path, csv_config.columns)
-    self._rows = self._ReadCsvFile()
+        csv_config.rel_path, csv_config.columns, csv_config.column_types)
+    if streaming:
+      self._rows = None
+    else:
+      self._rows = _TABLE_CACHE.Get(self.file_path, self._ReadCsvFile)
 
   def _ReadRows(self):
     """Generator that returns one row at a time.
@@ -331,13 +1235,54 @@ class CsvTable(StorageTable):
     Returns:
       The next row, as a dict keyed by the column names.
     """
-    for row in self._rows:
-      yield row
+    if self._rows is None:
+      for row in self._StreamCsvFile():
+        yield row
+    else:
+      for row in self._rows:
+        yield row
+
+  def GetSidecarPath(self, name):
+    """Returns the path of a sidecar file. Overrides the base class method."""
+    return "{}.{}".format(self.file_path, name)
+
+  def NumRows(self):
+    """Returns the number of rows. This method overrides the base class method.
+    """
+    if self._rows is not None:
+      return len(self._rows)
+    return max(0, len(self._GetRowIndex()) - 1)
+
+  def GetRows(self, start, stop=None):
+    """Returns the rows in positions [start, stop), as a list of dicts.
+
+    This method overrides the base class method. In streaming mode, only the
+    requested rows are read from the file.
+    """
+    if start < 0 or (stop is not None and stop < 0):
+      raise ValueError("Row positions must not be negative.")
+    if self._rows is not None:
+      return self._rows[start:stop]
+    offsets = self._GetRowIndex()
+    num_rows = max(0, len(offsets) - 1)
+    stop = num_rows if stop is None else min(stop, num_rows)
+    if start >= stop:
+      return []
+    with open(self.file_path, "rb") as f:
+      f.seek(offsets[start])
+      data = f.read(offsets[stop] - offsets[start])
+    if not isinstance(data, str):
+      data = data.decode(_CSV_ENCODING)
+    # Unlike str.splitlines, file objects only end lines at newlines, which
+    # the csv module expects.
+    return list(csv.DictReader(StringIO(data), fieldnames=self._columns))
 
   def _WriteBuffer(self):
-    """Writes the row buffer to storage, and clears the buffer.
+    """Appends the row buffer to the end of the CSV file.
 
-    This method overrides the base class method.
+    This method overrides the base class method. Only the buffered rows are
+    written, so the cost of a write scales with the size of the buffer rather
+    than the size of the table. Use Compact() to rewrite the whole file.
 
     Raises:
       Error: If the write failed.
@@ -345,14 +1290,152 @@ class CsvTable(StorageTable):
     if len(self._buffer) == 0:
       return
     self._ValidateBuffer()
-    self._rows += self._buffer
+    stat_before_write = _GetFileStat(self.file_path)
+    try:
+      self._AppendRows(self._buffer)
+    except (IOError, OSError) as e:
+      _TABLE_CACHE.Evict(self.file_path)
+      raise Error("Failed to append rows to %s: %s" % (self.file_path, e))
+    if self._rows is None:
+      _TABLE_CACHE.Evict(self.file_path)
+      self._GetRowIndex(persist=True)
+    else:
+      self._rows += self._buffer
+      _TABLE_CACHE.Refresh(self.file_path, self._rows, stat_before_write)
+
+  def Compact(self):
+    """Rewrites the entire CSV file.
+
+    The new file is written to a temporary path, synced to disk and then
+    atomically renamed over the old file, so readers never observe a partially
+    written table.
+
+    Raises:
+      Error: If the rewrite failed.
+    """
     tmp_path = "{}.tmp".format(self.file_path)
-    with open(tmp_path, "w") as f:
-      writer = csv.DictWriter(f, fieldnames=self._columns)
+    stat_before_write = _GetFileStat(self.file_path)
+    try:
+      with open(tmp_path, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=self._columns)
+        writer.writeheader()
+        for row in self._ReadRows():
+          writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+      os.rename(tmp_path, self.file_path)
+    except (IOError, OSError) as e:
+      _TABLE_CACHE.Evict(self.file_path)
+      raise Error("Failed to compact %s: %s" % (self.file_path, e))
+    # The row index is tied to the inode of the old file. It is removed rather
+    # than left to be rebuilt, since a later file could reuse the inode.
+    try:
+      os.remove(self.file_path + _ROW_INDEX_SUFFIX)
+    except OSError:
+      pass
+    _TABLE_CACHE.Refresh(self.file_path, self._rows, stat_before_write)
+
+  def _AppendRows(self, rows):
+    """Durably appends rows to the end of the CSV file.
+
+    The rows are serialized in memory and written with a single write call
+    before the file is synced to disk. A crash in the middle of the write
+    leaves at most one torn row at the end of the file. Readers skip it, and
+    _RecoverTornRow drops it when the table is next written. A complete last
+    row that lacks only its newline is kept, and the newline is added.
+
+    Args:
+      rows: Iterable of validated row dicts.
+    """
+    self._RecoverTornRow()
+    write_header = (
+        not os.path.isfile(self.file_path)
+        or os.path.getsize(self.file_path) == 0)
+    out = StringIO()
+    writer = csv.DictWriter(out, fieldnames=self._columns)
+    if write_header:
       writer.writeheader()
-      for row in self._rows:
-        writer.writerow(row)
-    os.rename(tmp_path, self.file_path)
+    for row in rows:
+      writer.writerow(row)
+    with open(self.file_path, "a") as f:
+      f.write(out.getvalue())
+      f.flush()
+      os.fsync(f.fileno())
+
+  def _RecoverTornRow(self):
+    """Prepares the end of the CSV file for appending rows.
+
+    A partially written row is truncated, and a newline is added after a
+    complete last row that lacks one. The end of the last complete row comes
+    from the row index, which does not count newlines inside quoted fields as
+    row ends.
+    """
+    if not os.path.isfile(self.file_path):
+      return
+    offsets = self._GetRowIndex()
+    end = offsets[-1] if offsets else 0
+    with open(self.file_path, "rb+") as f:
+      f.seek(0, os.SEEK_END)
+      size = f.tell()
+      if end < size:
+        f.truncate(end)
+      elif size > 0:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+          return
+        f.seek(size)
+        f.write(b"\r\n")
+      else:
+        return
+      f.flush()
+      os.fsync(f.fileno())
+
+  def _GetRowIndex(self, persist=False):
+    """Returns the offsets of the rows of the CSV file.
+
+    The row index file starts with the inode number of the CSV file it
+    describes and a digest of its header and last indexed row, followed by the
+    offset of the end of the header and the offset of the end of every complete
+    row. The offsets of the rows in positions
+    [i, j) are therefore the entries i to j of the list that is returned.
+
+    The stored offsets are used if they still describe the file, and extended by scanning only the bytes that follow them. Reads
+    keep the result in memory, so they work on read-only files. Only writes
+    persist it.
+
+    A complete last row that lacks its newline is never stored, since adding
+    the newline moves its end. The end of the file is returned as its end.
+
+    Args:
+      persist: Whether to bring the row index file up to date.
+
+    Returns:
+      List of offsets of the header end followed by every row end. Empty if
+      the file does not exist or is empty.
+    """
+    index_path = self.file_path + _ROW_INDEX_SUFFIX
+    try:
+      st = os.stat(self.file_path)
+    except OSError:
+      return []
+    offsets = _ReadRowIndexFile(index_path, self.file_path, st)
+    num_stored = None if offsets is None else len(offsets)
+    offsets = offsets or []
+    scan_from = offsets[-1] if offsets else 0
+    if scan_from < st.st_size:
+      with open(self.file_path, "rb") as f:
+        offsets.extend(_ScanRowEnds(f, scan_from, st.st_size))
+    if persist and len(offsets) != num_stored:
+      _WriteRowIndexFile(
+          index_path, self.file_path, st.st_ino, offsets, num_stored)
+    end = offsets[-1] if offsets else 0
+    if end < st.st_size:
+      with open(self.file_path, "rb") as f:
+        f.seek(end)
+        tail = f.read(st.st_size - end)
+      if _IsCompleteCsvRecord(tail, len(self._columns)):
+        offsets = offsets + [st.st_size]
+    return offsets
 
   def _ReadCsvFile(self):
     """Reads CSV file into memory.
@@ -361,10 +1444,478 @@ class CsvTable(StorageTable):
       A list of CSV file rows, keyed by column titles. If the file does not
         exist, an empty list is returned.
     """
+    return list(self._StreamCsvFile())
+
+  def _StreamCsvFile(self):
+    """Generator that parses the CSV file one row at a time.
+
+    Returns:
+      The next CSV file row, keyed by column titles. Nothing is returned if the
+        file does not exist.
+    """
     if not os.path.isfile(self.file_path):
-      return []
+      return
     with open(self.file_path, "r") as f:
-      reader = csv.DictReader(f, fieldnames=self._columns)
+      lines = _RowEndTracker(f)
+      reader = csv.DictReader(lines, fieldnames=self._columns)
       # Skip header
-      next(reader)
-      return list(reader)
+      if next(reader, None) is None:
+        return
+      for row in reader:
+        if not lines.at_row_end and (
+            lines.in_quotes or None in row or None in row.values()):
+          # A torn row left at the end of the file by an interrupted append.
+          # DictReader keys extra fields by None, and fills missing ones with
+          # None.
+          return
+        yield row
+
+
+class _RowEndTracker(object):
+  """Iterates over the lines of a CSV file, tracking where rows end.
+
+  Like _ScanRowEnds, a line ends a row if it ends with a newline that is not
+  inside a quoted field. The csv module reads no lines past the row that it
+  returns, so at_row_end tells whether that row ended with a newline, and
+  in_quotes whether it ended inside a quoted field.
+  """
+
+  def __init__(self, f):
+    self._f = f
+    self.in_quotes = False
+    self.at_row_end = True
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    line = next(self._f)
+    if line.count('"') % 2:
+      self.in_quotes = not self.in_quotes
+    self.at_row_end = line.endswith("\n") and not self.in_quotes
+    return line
+
+  # Python 2 iterator protocol.
+  next = __next__
+
+
+class SqliteTable(StorageTable):
+  """Subclass that stores rows in a SQLite database.
+
+  Each table lives in its own database file, named after the table's rel_path
+  with a .sqlite3 extension, which holds a single SQL table. All columns are
+  stored as text, in the same serialized form as the CSV backend. The database
+  is opened in WAL mode so that readers are not blocked while rows are being
+  written.
+  """
+
+  db_path = ""
+
+  def __init__(self, sqlite_config):
+    rel_path = os.path.splitext(sqlite_config.rel_path)[0]
+    self.db_path = os.path.join(
+        os.path.expanduser(FLAGS.sqlite_base_path), rel_path + ".sqlite3")
+    super(SqliteTable, self).__init__(
+        sqlite_config.rel_path, sqlite_config.columns,
+        sqlite_config.column_types)
+    self._sql_table = _QuoteSqlIdentifier(_SQLITE_TABLE_NAME)
+    self._sql_columns = ", ".join(
+        _QuoteSqlIdentifier(col) for col in self._columns)
+    try:
+      self._conn = sqlite3.connect(self.db_path)
+      # Return text as the native str type, in Python 2 and 3.
+      self._conn.text_factory = str
+      self._conn.execute("PRAGMA journal_mode=WAL")
+      with self._conn:
+        self._conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (
+            self._sql_table,
+            ", ".join("%s TEXT" % _QuoteSqlIdentifier(col)
+                      for col in self._columns)))
+        for col in sqlite_config.indexed_columns:
+          self._conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (
+              _QuoteSqlIdentifier("%s_%s" % (_SQLITE_TABLE_NAME, col)),
+              self._sql_table, _QuoteSqlIdentifier(col)))
+    except sqlite3.Error as e:
+      raise Error("Failed to open %s: %s" % (self.db_path, e))
+
+  def GetSidecarPath(self, name):
+    """Returns the path of a sidecar file. Overrides the base class method."""
+    return "{}.{}".format(self.db_path, name)
+
+  def LookupRows(self, column, value):
+    """Returns all rows whose column is equal to value.
+
+    This method overrides the base class method, so that the lookup can use an
+    index on the column if one exists.
+    """
+    if column not in self._columns:
+      raise ValueError("Unknown column: %r" % column)
+    cursor = self._conn.execute(
+        "SELECT %s FROM %s WHERE %s = ? ORDER BY rowid" % (
+            self._sql_columns, self._sql_table, _QuoteSqlIdentifier(column)),
+        (value,))
+    return [dict(zip(self._columns, values)) for values in cursor]
+
+  def NumRows(self):
+    """Returns the number of rows. This method overrides the base class method.
+
+    Rows are only ever inserted, so their rowids run from 1 to the number of
+    rows.
+    """
+    cursor = self._conn.execute(
+        "SELECT COALESCE(MAX(rowid), 0) FROM %s" % self._sql_table)
+    return cursor.fetchone()[0]
+
+  def GetRows(self, start, stop=None):
+    """Returns the rows in positions [start, stop), as a list of dicts.
+
+    This method overrides the base class method. The row in position i has
+    rowid i + 1, so only the requested rows are read.
+    """
+    if start < 0 or (stop is not None and stop < 0):
+      raise ValueError("Row positions must not be negative.")
+    query = "SELECT %s FROM %s WHERE rowid > ?" % (
+        self._sql_columns, self._sql_table)
+    params = [start]
+    if stop is not None:
+      if start >= stop:
+        return []
+      query += " AND rowid <= ?"
+      params.append(stop)
+    cursor = self._conn.execute(query + " ORDER BY rowid", params)
+    return [dict(zip(self._columns, values)) for values in cursor]
+
+  def _ReadRows(self):
+    """Generator that returns one row at a time, in insertion order.
+
+    This method overrides the base class method.
+
+    Returns:
+      The next row, as a dict keyed by the column names.
+    """
+    cursor = self._conn.execute("SELECT %s FROM %s ORDER BY rowid" % (
+        self._sql_columns, self._sql_table))
+    for values in cursor:
+      yield dict(zip(self._columns, values))
+
+  def _WriteBuffer(self):
+    """Inserts the row buffer into the database in a single transaction.
+
+    This method overrides the base class method.
+
+    Raises:
+      Error: If the write failed.
+    """
+    if len(self._buffer) == 0:
+      return
+    self._ValidateBuffer()
+    insert = "INSERT INTO %s (%s) VALUES (%s)" % (
+        self._sql_table, self._sql_columns,
+        ", ".join("?" for _ in self._columns))
+    try:
+      with self._conn:
+        self._conn.executemany(
+            insert,
+            ([row[col] for col in self._columns] for row in self._buffer))
+    except sqlite3.Error as e:
+      raise Error("Failed to write rows to %s: %s" % (self.db_path, e))
+
+
+def _QuoteSqlIdentifier(name):
+  """Quotes a table or column name for use in a SQL statement."""
+  return '"%s"' % name.replace('"', '""')
+
+
+class ColumnarTable(StorageTable):
+  """Subclass that stores each column in its own memory-mapped .npy file.
+
+  Column types come from the column_types entry of the storage config. int,
+  float, date and bool columns are stored as fixed-width arrays, with dates
+  stored as days since 1970-01-01. str columns are dictionary-encoded: the .npy file
+  holds int32 codes into a pool of distinct strings, which is kept in a .pool
+  file with one JSON string per line.
+
+  Opening a table only maps the column files into memory. Rows are decoded to
+  their serialized form when they are read, and GetColumnArrays() gives direct
+  access to the mapped arrays.
+  """
+
+  dir_path = ""
+
+  def __init__(self, columnar_config):
+    if np is None:
+      raise Error("The columnar storage type requires numpy.")
+    self.dir_path = os.path.join(
+        os.path.expanduser(FLAGS.columnar_base_path),
+        os.path.splitext(columnar_config.rel_path)[0])
+    column_types = columnar_config.column_types or {}
+    super(ColumnarTable, self).__init__(
+        columnar_config.rel_path, columnar_config.columns,
+        {col: column_types.get(col, "str") for col in columnar_config.columns})
+    self._OpenColumns()
+
+  def NumRows(self):
+    """Returns the number of rows. This method overrides the base class method.
+    """
+    return self._num_rows
+
+  def GetRows(self, start, stop=None):
+    """Returns the rows in positions [start, stop), as a list of dicts.
+
+    This method overrides the base class method, and only decodes the
+    requested rows.
+    """
+    if start < 0 or (stop is not None and stop < 0):
+      raise ValueError("Row positions must not be negative.")
+    stop = self._num_rows if stop is None else min(stop, self._num_rows)
+    if start >= stop:
+      return []
+    columns = [
+        self._DecodeColumn(col, self._arrays[col][start:stop].tolist(),
+                           self._pools)
+        for col in self._columns]
+    return [dict(zip(self._columns, values)) for values in zip(*columns)]
+
+  def GetColumnArrays(self):
+    """Returns the stored columns as read-only arrays, without copying them.
+
+    Returns:
+      Dict of 1-d numpy arrays keyed by column name, all with one element per
+      row. Dates are days since 1970-01-01, and str columns hold codes into the
+      list returned by GetStringPool().
+    """
+    return {col: arr[:self._num_rows] for col, arr in self._arrays.items()}
+
+  def GetStringPool(self, column):
+    """Returns the list of distinct strings of a str column, indexed by code.
+
+    Raises:
+      ValueError: If the column is not a str column.
+    """
+    if column not in self._pools:
+      raise ValueError("Not a str column: %r" % column)
+    return self._pools[column]
+
+  def GetSidecarPath(self, name):
+    """Returns the path of a sidecar file. Overrides the base class method."""
+    return "{}.{}".format(self.dir_path, name)
+
+  def _ColumnPath(self, column, extension):
+    return os.path.join(self.dir_path, column + extension)
+
+  def _OpenColumns(self):
+    """Maps the column files and loads the string pools."""
+    self._arrays = {}
+    self._pools = {}
+    self._pool_codes = {}
+    for col in self._columns:
+      dtype = _COLUMNAR_DTYPES[self._column_types[col]]
+      self._arrays[col] = _MapNpyColumn(self._ColumnPath(col, ".npy"), dtype)
+      if self._column_types[col] == "str":
+        pool = self._ReadPool(col)
+        self._pools[col] = pool
+        self._pool_codes[col] = {value: code for code, value in enumerate(pool)}
+    # Columns can be longer than others if a write was interrupted. Rows that
+    # were not written to every column are ignored, and overwritten by the next
+    # write.
+    self._num_rows = min(len(arr) for arr in self._arrays.values())
+
+  def _ReadPool(self, column):
+    """Returns the string pool of a str column as a list."""
+    pool_path = self._ColumnPath(column, ".pool")
+    if not os.path.isfile(pool_path):
+      return []
+    pool = []
+    with open(pool_path, "r") as f:
+      for line in f:
+        # Skip a torn final line. Codes are only written after the strings
+        # they refer to, so it cannot be referenced.
+        if not line.endswith("\n"):
+          break
+        value = json.loads(line)
+        if not isinstance(value, str):
+          # Python 2 decodes JSON strings to unicode.
+          value = value.encode("utf-8")
+        pool.append(value)
+    return pool
+
+  def _ReadRows(self):
+    """Generator that returns one row at a time.
+
+    This method overrides the base class method.
+
+    Returns:
+      The next row, as a dict keyed by the column names.
+    """
+    # Snapshot the table, so that rows appended while iterating are skipped.
+    num_rows = self._num_rows
+    for start in range(0, num_rows, _COLUMNAR_READ_CHUNK_SIZE):
+      for row in self.GetRows(
+          start, min(num_rows, start + _COLUMNAR_READ_CHUNK_SIZE)):
+        yield row
+
+  def _DecodeColumn(self, column, values, pools):
+    """Converts a list of stored values to serialized strings."""
+    col_type = self._column_types[column]
+    if col_type == "str":
+      pool = pools[column]
+      return [pool[code] for code in values]
+    if col_type == "date":
+      return [
+          (DATE_EPOCH + datetime.timedelta(days=v)).strftime(DATE_FORMAT)
+          for v in values]
+    if col_type == "float":
+      return [repr(v) for v in values]
+    # str() of an int or a bool is its serialized form.
+    return [str(v) for v in values]
+
+  def _EncodeColumn(self, column, values, new_strings):
+    """Converts a list of serialized strings to a numpy array.
+
+    Strings that are not in the pool yet are assigned new codes and appended to
+    new_strings.
+    """
+    col_type = self._column_types[column]
+    if col_type == "str":
+      codes = self._pool_codes[column]
+      encoded = []
+      for value in values:
+        code = codes.get(value)
+        if code is None:
+          code = len(codes)
+          codes[value] = code
+          new_strings.append(value)
+        encoded.append(code)
+    elif col_type == "date":
+      epoch = DATE_EPOCH.toordinal()
+      encoded = [
+          datetime.datetime.strptime(v, DATE_FORMAT).toordinal() - epoch
+          for v in values]
+    elif col_type == "float":
+      encoded = [float(v) for v in values]
+    elif col_type == "bool":
+      encoded = [v.lower() == "true" for v in values]
+    else:
+      encoded = [int(v) for v in values]
+    return np.array(encoded, dtype=_COLUMNAR_DTYPES[col_type])
+
+  def _WriteBuffer(self):
+    """Appends the row buffer to the column files.
+
+    This method overrides the base class method. New pool strings are made
+    durable before any codes that refer to them are written.
+
+    Raises:
+      Error: If the write failed.
+    """
+    if len(self._buffer) == 0:
+      return
+    self._ValidateBuffer()
+    try:
+      new_strings = {col: [] for col in self._pools}
+      encoded = {
+          col: self._EncodeColumn(
+              col, [row[col] for row in self._buffer], new_strings.get(col))
+          for col in self._columns}
+      if not os.path.isdir(self.dir_path):
+        os.makedirs(self.dir_path)
+      for col, strings in new_strings.items():
+        if strings:
+          self._AppendToPool(col, strings)
+      for col in self._columns:
+        _AppendNpyColumn(
+            self._ColumnPath(col, ".npy"), encoded[col], self._num_rows)
+    except (IOError, OSError, ValueError) as e:
+      raise Error("Failed to write rows to %s: %s" % (self.dir_path, e))
+    finally:
+      # Reload from disk, which also discards codes assigned in memory if the
+      # write failed.
+      self._OpenColumns()
+
+  def _AppendToPool(self, column, strings):
+    pool_path = self._ColumnPath(column, ".pool")
+    _TruncateTornLine(pool_path)
+    out = StringIO()
+    for value in strings:
+      out.write(json.dumps(value))
+      out.write("\n")
+    with open(pool_path, "a") as f:
+      f.write(out.getvalue())
+      f.flush()
+      os.fsync(f.fileno())
+
+
+def _ReadNpyHeader(f):
+  """Reads the header of an open .npy file.
+
+  Returns:
+    Tuple of the array's shape, its dtype, and the offset of the array data.
+  """
+  version = np.lib.format.read_magic(f)
+  if version == (1, 0):
+    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+  else:
+    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+  return shape, dtype, f.tell()
+
+
+def _MapNpyColumn(path, dtype):
+  """Memory-maps a 1-d .npy file read-only. Returns an empty array if missing.
+  """
+  if not os.path.isfile(path):
+    return np.zeros(0, dtype=dtype)
+  with open(path, "rb") as f:
+    shape, file_dtype, offset = _ReadNpyHeader(f)
+  if shape[0] == 0:
+    return np.zeros(0, dtype=file_dtype)
+  return np.memmap(path, dtype=file_dtype, mode="r", offset=offset, shape=shape)
+
+
+def _AppendNpyColumn(path, values, num_rows):
+  """Durably appends values to a 1-d .npy file.
+
+  The data is written in place after the first num_rows elements, dropping any
+  elements past them, and the header is then updated with the new length. If
+  the new header does not fit in the space of the old one, the file is
+  rewritten instead.
+
+  Args:
+    path: Path of the .npy file. It is created if it does not exist.
+    values: 1-d numpy array with the values to append.
+    num_rows: Number of elements of the existing file to keep.
+  """
+  if not os.path.isfile(path):
+    with open(path, "wb") as f:
+      np.save(f, values)
+      f.flush()
+      os.fsync(f.fileno())
+    return
+  with open(path, "rb+") as f:
+    _, dtype, offset = _ReadNpyHeader(f)
+    f.seek(offset + num_rows * dtype.itemsize)
+    f.write(values.astype(dtype).tobytes())
+    f.truncate()
+    f.flush()
+    os.fsync(f.fileno())
+    total_rows = num_rows + len(values)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {
+        "descr": np.lib.format.dtype_to_descr(dtype),
+        "fortran_order": False,
+        "shape": (total_rows,),
+    })
+    header = header.getvalue()
+    if len(header) == offset:
+      f.seek(0)
+      f.write(header)
+      f.flush()
+      os.fsync(f.fileno())
+      return
+  data = np.array(np.memmap(
+      path, dtype=dtype, mode="r", offset=offset, shape=(total_rows,)))
+  tmp_path = "{}.tmp".format(path)
+  with open(tmp_path, "wb") as f:
+    np.save(f, data)
+    f.flush()
+    os.fsync(f.fileno())
+  os.rename(tmp_path, path)
@@ -2,8 +2,10 @@
 
 import os
 import csv
+import datetime
 import json
 import mock
+import sqlite3
 import uuid
 
 import storage_lib
@@ -15,6 +17,105 @@ from absl.testing import absltest
 FLAGS = flags.FLAGS
 
 
+class StorageCatalogTest(absltest.TestCase):
+  """Tests StorageCatalog and StorageConfig."""
+
+  _config = {
+      "table1": {"rel_path": "table1.csv", "columns": ["a", "b"]},
+      "table2": {
+          "rel_path": "table2.csv", "columns": ["c", "d"],
+          "column_types": {"c": "date"}, "indexed_columns": ["d"],
+          "storage_type": "sqlite"},
+  }
+
+  def _WriteConfigFile(self, config):
+    config_file_path = os.path.join(
+        FLAGS.test_tmpdir, "config_{}.json".format(uuid.uuid1()))
+    with open(config_file_path, "w") as f:
+      json.dump(config, f)
+    self.addCleanup(os.remove, config_file_path)
+    return config_file_path
+
+  def testGetTableConfig(self):
+    catalog = storage_lib.StorageCatalog(self._config)
+    self.assertEqual(["table1", "table2"], catalog.GetTableNames())
+    config = catalog.GetTableConfig("table2")
+    self.assertEqual("table2.csv", config.rel_path)
+    self.assertEqual(("c", "d"), config.columns)
+    self.assertEqual({"c": "date", "d": "str"}, config.column_types)
+    self.assertEqual(("d",), config.indexed_columns)
+    self.assertEqual("sqlite", config.storage_type)
+    self.assertIsNone(catalog.GetTableConfig("table1").storage_type)
+    self.assertIsNone(catalog.GetTableConfig("table1").column_types)
+    with self.assertRaises(storage_lib.Error):
+      catalog.GetTableConfig("table3")
+
+  def testInvalidConfigs(self):
+    for table_config in (
+        {"columns": ["a"]},
+        {"rel_path": "a.csv", "columns": []},
+        {"rel_path": "a.csv", "columns": ["a", "a"]},
+        {"rel_path": "a.csv", "columns": ["a"], "column_types": {"b": "int"}},
+        {"rel_path": "a.csv", "columns": ["a"],
+         "column_types": {"a": "complex"}},
+        {"rel_path": "a.csv", "columns": ["a"], "indexed_columns": ["b"]},
+        {"rel_path": "a.csv", "columns": ["a"], "storage_type": "paper"},
+        {"rel_path": "a.csv", "columns": ["a"], "colums": ["a"]}):
+      with self.assertRaises(storage_lib.Error):
+        storage_lib.StorageCatalog({"good": {"rel_path": "b.csv",
+                                             "columns": ["b"]},
+                                    "bad": table_config})
+
+  def testConfigFileIsReadOnce(self):
+    config_file_path = self._WriteConfigFile(self._config)
+    catalog = storage_lib.GetStorageCatalog(config_file_path)
+    with mock.patch.object(
+        storage_lib.StorageCatalog, "fromconfigfile") as load_mock:
+      self.assertIs(catalog, storage_lib.GetStorageCatalog(config_file_path))
+      storage_lib.StorageConfig.fromconfigfile(config_file_path, "table1")
+    load_mock.assert_not_called()
+
+  def testReloadStorageCatalog(self):
+    config_file_path = self._WriteConfigFile(self._config)
+    storage_lib.GetStorageCatalog(config_file_path)
+    with open(config_file_path, "w") as f:
+      json.dump({"table3": self._config["table1"]}, f)
+
+    catalog = storage_lib.ReloadStorageCatalog(config_file_path)
+    self.assertEqual(["table3"], catalog.GetTableNames())
+    self.assertIs(catalog, storage_lib.GetStorageCatalog(config_file_path))
+
+
+class RowDecoderTest(absltest.TestCase):
+  """Tests RowDecoder."""
+
+  _columns = ["i", "f", "d", "b", "s"]
+  _column_types = {"i": "int", "f": "float", "d": "date", "b": "bool"}
+
+  def testDecodeBatch(self):
+    decoder = storage_lib.GetRowDecoder(self._columns, self._column_types)
+    rows = [
+        {"i": "3", "f": "1.5", "d": "2001-02-03", "b": "True", "s": "x"},
+        {"i": "-4", "f": "2", "d": "2001-02-03", "b": "false", "s": "y"},
+    ]
+    decoded = decoder.DecodeBatch(rows)
+    self.assertEqual([
+        (3, 1.5, datetime.date(2001, 2, 3), True, "x"),
+        (-4, 2.0, datetime.date(2001, 2, 3), False, "y"),
+    ], decoded)
+    # Repeated dates are parsed once.
+    self.assertIs(decoded[0][2], decoded[1][2])
+
+  def testDecodersAreCompiledOnce(self):
+    self.assertIs(
+        storage_lib.GetRowDecoder(self._columns, self._column_types),
+        storage_lib.GetRowDecoder(self._columns, dict(self._column_types)))
+
+  def testInvalidColumnType(self):
+    with self.assertRaises(storage_lib.Error):
+      storage_lib.RowDecoder(["a"], {"a": "complex"})
+
+
 class StorageTableTest(absltest.TestCase):
   """Tests StorageTable base class."""
 
@@ -93,6 +194,35 @@ class StorageTableTest(absltest.TestCase):
     iter_rows = [r for r in self._table]
     self.assertSameElements(self._fake_rows, iter_rows)
 
+  def testIteratorProtocol(self):
+    it = iter(self._table)
+    self.assertIs(it, iter(it))
+    self.assertEqual(self._fake_rows[0], next(it))
+
+  def testReadBatches(self):
+    batches = list(self._table.ReadBatches(2))
+    self.assertEqual([self._fake_rows[:2], self._fake_rows[2:]], batches)
+
+  def testRandomAccess(self):
+    self.assertEqual(3, self._table.NumRows())
+    self.assertEqual(self._fake_rows[1], self._table.GetRow(1))
+    self.assertEqual(self._fake_rows[1:], self._table.GetRows(1))
+    self.assertEqual(self._fake_rows[:2], self._table.GetRows(0, 2))
+    self.assertEqual(self._fake_rows[1:], self._table.Tail(2))
+    self.assertEqual(self._fake_rows, self._table.Tail(5))
+    with self.assertRaises(IndexError):
+      self._table.GetRow(3)
+
+  def testLookupRows(self):
+    self.assertEqual(
+        [self._fake_rows[1]], self._table.LookupRows("column1", "word"))
+    with self.assertRaises(ValueError):
+      self._table.LookupRows("not_a_column", "word")
+
+  def testReadBatchesWithInvalidSize(self):
+    with self.assertRaises(ValueError):
+      next(self._table.ReadBatches(0))
+
 
 class CsvTableTest(absltest.TestCase):
   """Tests CsvTable subclass."""
@@ -102,9 +232,11 @@ class CsvTableTest(absltest.TestCase):
   _columns = ["some", "test", "columns"]
 
   def setUp(self):
+    storage_lib.ClearTableCache()
+    self.addCleanup(storage_lib.ClearTableCache)
     self._csv_table = self._GetCsvTable()
 
-  def _GetCsvTable(self, csv_file_path=None):
+  def _GetCsvTable(self, csv_file_path=None, streaming=False):
     if csv_file_path is None:
       FLAGS.csv_base_path = FLAGS.test_tmpdir
       config_file_path = self._WriteStorageConfigFile(self._csv_file_name)
@@ -115,7 +247,7 @@ class CsvTableTest(absltest.TestCase):
 
     FLAGS.storage_type = "csv"
     FLAGS.storage_config_file = config_file_path
-    return storage_lib.GetStorageTable(self._table_name)
+    return storage_lib.GetStorageTable(self._table_name, streaming=streaming)
 
   def _WriteStorageConfigFile(self, rel_path):
     """Writes a storage config file pertinent to this test.
@@ -151,6 +283,248 @@ class CsvTableTest(absltest.TestCase):
       for idx,col in enumerate(self._columns):
         self.assertEqual(data2[idx], row2[col])
 
+  def testWriteAppendsToExistingFile(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    self._csv_table.WriteRow(*data1)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    self._csv_table.WriteRow(*data2)
+
+    with open(self._csv_table.file_path, "r") as f:
+      rows = list(csv.reader(f))
+    self.assertEqual([self._columns, list(data1), list(data2)], rows)
+
+  def testTornRowIsDropped(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    self._csv_table.WriteRow(*data1)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    # Simulate a crash in the middle of appending a row.
+    with open(self._csv_table.file_path, "a") as f:
+      f.write("x,y")
+
+    table = self._GetCsvTable()
+    self.assertEqual(
+        [dict(zip(self._columns, data1))], table.GetAllRows())
+    table.WriteRow(*data2)
+    with open(table.file_path, "r") as f:
+      rows = list(csv.reader(f))
+    self.assertEqual([self._columns, list(data1), list(data2)], rows)
+
+  def testTornRowIsOnlyDroppedOnWrite(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b\nc", "d")
+    self._csv_table.WriteRow(*data1)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    # The torn row ends with a newline inside a quoted field.
+    with open(self._csv_table.file_path, "a") as f:
+      f.write('x,"y\n')
+    size = os.path.getsize(self._csv_table.file_path)
+
+    for streaming in (False, True):
+      table = self._GetCsvTable(streaming=streaming)
+      self.assertEqual(
+          [dict(zip(self._columns, data1))], table.GetAllRows())
+    self.assertEqual(size, os.path.getsize(self._csv_table.file_path))
+    table.WriteRow(*data2)
+    with open(table.file_path, "r") as f:
+      rows = list(csv.reader(f))
+    self.assertEqual([self._columns, list(data1), list(data2)], rows)
+
+  def testLastRowWithoutNewlineIsKept(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    data3 = ("x", "y", "z")
+    self._csv_table.WriteRow(*data1)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    # A file edited by hand may lack the newline after its last row.
+    with open(self._csv_table.file_path, "a") as f:
+      f.write(",".join(data2))
+
+    expected = [dict(zip(self._columns, data1)),
+                dict(zip(self._columns, data2))]
+    for streaming in (False, True):
+      table = self._GetCsvTable(streaming=streaming)
+      self.assertEqual(expected, table.GetAllRows())
+    self.assertEqual(2, table.NumRows())
+    self.assertEqual(expected[1:], table.Tail(1))
+    table.WriteRow(*data3)
+    self.addCleanup(os.remove, table.file_path + ".idx")
+    with open(table.file_path, "r") as f:
+      rows = list(csv.reader(f))
+    self.assertEqual(
+        [self._columns, list(data1), list(data2), list(data3)], rows)
+    self.assertEqual(3, self._GetCsvTable(streaming=True).NumRows())
+
+  def testCompact(self):
+    data = ("1", "2", "3")
+    self._csv_table.WriteRow(*data)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    self._csv_table.Compact()
+
+    self.assertFalse(os.path.exists(self._csv_table.file_path + ".tmp"))
+    with open(self._csv_table.file_path, "r") as f:
+      rows = list(csv.reader(f))
+    self.assertEqual([self._columns, list(data)], rows)
+
+  def testTablesShareParsedRows(self):
+    data = ("1", "2", "3")
+    self._csv_table.WriteRow(*data)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+
+    with mock.patch.object(
+        storage_lib.CsvTable, "_ReadCsvFile") as read_mock:
+      table = self._GetCsvTable()
+      self._GetCsvTable()
+    read_mock.assert_not_called()
+    self.assertEqual([dict(zip(self._columns, data))], table.GetAllRows())
+
+  def testCacheIsInvalidatedByExternalWrite(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    self._csv_table.WriteRow(*data1)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    with open(self._csv_table.file_path, "a") as f:
+      csv.writer(f).writerow(data2)
+
+    table = self._GetCsvTable()
+    self.assertEqual(
+        [dict(zip(self._columns, data1)), dict(zip(self._columns, data2))],
+        table.GetAllRows())
+
+  def testGetSidecarPath(self):
+    self.assertEqual(
+        self._csv_table.file_path + ".fingerprints",
+        self._csv_table.GetSidecarPath("fingerprints"))
+
+  def testEvictCachedTable(self):
+    self._csv_table.WriteRow("1", "2", "3")
+    self.addCleanup(os.remove, self._csv_table.file_path)
+
+    storage_lib.EvictCachedTable(self._csv_table.file_path)
+    with mock.patch.object(
+        storage_lib.CsvTable, "_ReadCsvFile", return_value=[]) as read_mock:
+      self._GetCsvTable()
+    read_mock.assert_called_once_with()
+
+  def testStreamingReadsRowsOnDemand(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    table = self._GetCsvTable(streaming=True)
+    table.WriteRow(*data1)
+    self.addCleanup(os.remove, table.file_path)
+    table.WriteRow(*data2)
+
+    rows = table.ReadBatches(1)
+    self.assertEqual([dict(zip(self._columns, data1))], next(rows))
+    self.assertEqual([dict(zip(self._columns, data2))], next(rows))
+    self.assertIsNone(next(rows, None))
+
+  def testStreamingRandomAccess(self):
+    rows = [("1", "2", "3"), ("a", "b", "c"), ("x", "quoted\nnewline", "z")]
+    table = self._GetCsvTable(streaming=True)
+    table.WriteRow(*rows[0])
+    self.addCleanup(os.remove, table.file_path)
+    self.addCleanup(os.remove, table.file_path + ".idx")
+    table.BufferRowForWrite(*rows[1])
+    table.BufferRowForWrite(*rows[2])
+    table.WriteBufferedRows()
+
+    expected = [dict(zip(self._columns, row)) for row in rows]
+    table = self._GetCsvTable(streaming=True)
+    self.assertEqual(3, table.NumRows())
+    self.assertEqual(expected[1], table.GetRow(1))
+    self.assertEqual(expected[1:], table.GetRows(1, 10))
+    self.assertEqual(expected[2:], table.Tail(1))
+    self.assertEqual([], table.GetRows(3))
+
+  def testStreamingRandomAccessKeepsLineSeparatorCharacters(self):
+    rows = [("A\x1cB", "C\x0bD", "E\x0cF"), ("a", "b", "c")]
+    table = self._GetCsvTable(streaming=True)
+    table.BufferRowForWrite(*rows[0])
+    table.BufferRowForWrite(*rows[1])
+    table.WriteBufferedRows()
+    self.addCleanup(os.remove, table.file_path)
+    self.addCleanup(os.remove, table.file_path + ".idx")
+
+    self.assertEqual(
+        [dict(zip(self._columns, row)) for row in rows], table.GetRows(0, 2))
+
+  def testStreamingReadsDoNotWriteRowIndex(self):
+    self._csv_table.WriteRow("1", "2", "3")
+    self.addCleanup(os.remove, self._csv_table.file_path)
+
+    table = self._GetCsvTable(streaming=True)
+    self.assertEqual(1, table.NumRows())
+    self.assertEqual(
+        [dict(zip(self._columns, ("1", "2", "3")))], table.GetRows(0))
+    self.assertFalse(os.path.exists(table.file_path + ".idx"))
+
+  def testStreamingWriteIgnoresRowIndexErrors(self):
+    table = self._GetCsvTable(streaming=True)
+    # The row index can't be written where a directory is in the way.
+    os.mkdir(table.file_path + ".idx")
+    self.addCleanup(os.rmdir, table.file_path + ".idx")
+    table.WriteRow("1", "2", "3")
+    self.addCleanup(os.remove, table.file_path)
+    table.WriteRow("a", "b", "c")
+
+    self.assertEqual(2, table.NumRows())
+    self.assertEqual(
+        [dict(zip(self._columns, ("a", "b", "c")))], table.Tail(1))
+
+  def testStreamingRowIndexCatchesUpWithExternalWrites(self):
+    table = self._GetCsvTable(streaming=True)
+    table.WriteRow("1", "2", "3")
+    self.addCleanup(os.remove, table.file_path)
+    self.addCleanup(os.remove, table.file_path + ".idx")
+    with open(table.file_path, "a") as f:
+      csv.writer(f).writerow(("a", "b", "c"))
+
+    self.assertEqual(
+        [dict(zip(self._columns, ("a", "b", "c")))], table.Tail(1))
+
+  def testStreamingRowIndexIsRebuiltAfterEditInPlace(self):
+    table = self._GetCsvTable(streaming=True)
+    table.WriteRow("1", "2", "3")
+    self.addCleanup(os.remove, table.file_path)
+    self.addCleanup(os.remove, table.file_path + ".idx")
+    table.WriteRow("a", "b", "c")
+    # Rewrite the file without replacing it, so that its inode is kept.
+    with open(table.file_path, "r+") as f:
+      f.truncate(0)
+      csv.writer(f).writerows(
+          [self._columns, ("11", "22", "33"), ("a", "b", "c")])
+
+    table = self._GetCsvTable(streaming=True)
+    self.assertEqual(2, table.NumRows())
+    self.assertEqual(
+        [dict(zip(self._columns, ("a", "b", "c")))], table.Tail(1))
+
+  def testStreamingRowIndexIsRebuiltAfterCompaction(self):
+    table = self._GetCsvTable(streaming=True)
+    table.WriteRow("1", "2", "3")
+    self.addCleanup(os.remove, table.file_path)
+    self.addCleanup(os.remove, table.file_path + ".idx")
+    self.assertEqual(1, table.NumRows())
+    table.Compact()
+    table.WriteRow("a", "b", "c")
+
+    self.assertEqual(2, table.NumRows())
+    self.assertEqual(
+        [dict(zip(self._columns, ("a", "b", "c")))], table.Tail(1))
+
+  def testStreamingWriteInvalidatesCache(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    self._csv_table.WriteRow(*data1)
+    self.addCleanup(os.remove, self._csv_table.file_path)
+    self._GetCsvTable(streaming=True).WriteRow(*data2)
+
+    self.assertEqual(
+        [dict(zip(self._columns, data1)), dict(zip(self._columns, data2))],
+        self._GetCsvTable().GetAllRows())
+
   def testRead(self):
     table = self._GetCsvTable(
         os.path.join(FLAGS.test_srcdir,
@@ -167,5 +541,168 @@ class CsvTableTest(absltest.TestCase):
         self.assertEqual(exp, row2[self._columns[idx]])
 
 
+
+class SqliteTableTest(absltest.TestCase):
+  """Tests SqliteTable subclass."""
+
+  _table_name = "test_table"
+  _columns = ["some", "test", "columns"]
+
+  def setUp(self):
+    FLAGS.sqlite_base_path = FLAGS.test_tmpdir
+    FLAGS.storage_type = "sqlite"
+    self.addCleanup(setattr, FLAGS, "storage_type", "csv")
+    self._rel_path = "test_{}.csv".format(uuid.uuid1().hex)
+    self._config_file_path = os.path.join(
+        FLAGS.test_tmpdir, "config_{}.json".format(uuid.uuid1()))
+    config = {
+        self._table_name: {
+          "rel_path": self._rel_path, "columns": self._columns,
+          "indexed_columns": ["test"]}}
+    with open(self._config_file_path, "w") as f:
+      json.dump(config, f)
+    self.addCleanup(os.remove, self._config_file_path)
+    FLAGS.storage_config_file = self._config_file_path
+    self._table = storage_lib.GetStorageTable(self._table_name)
+
+  def testWriteAndRead(self):
+    data1 = ("1", "2", "3")
+    data2 = ("a", "b", "c")
+    self._table.BufferRowForWrite(*data1)
+    self._table.BufferRowForWrite(*data2)
+    self._table.WriteBufferedRows()
+
+    # Rows must be visible to a separate connection.
+    table = storage_lib.GetStorageTable(self._table_name)
+    self.assertIsInstance(table, storage_lib.SqliteTable)
+    self.assertEqual(
+        [dict(zip(self._columns, data1)), dict(zip(self._columns, data2))],
+        table.GetAllRows())
+
+  def testDatabaseUsesWal(self):
+    conn = sqlite3.connect(self._table.db_path)
+    self.addCleanup(conn.close)
+    self.assertEqual(
+        "wal", conn.execute("PRAGMA journal_mode").fetchone()[0].lower())
+
+  def testLookupRows(self):
+    self._table.WriteRow("1", "2", "3")
+    self._table.WriteRow("a", "b", "c")
+    self.assertEqual(
+        [dict(zip(self._columns, ("a", "b", "c")))],
+        self._table.LookupRows("test", "b"))
+
+  def testRandomAccess(self):
+    rows = [dict(zip(self._columns, (str(i), "x", "y"))) for i in range(4)]
+    for row in rows:
+      self._table.BufferRowForWrite(**row)
+    self._table.WriteBufferedRows()
+    with mock.patch.object(
+        storage_lib.SqliteTable, "_ReadRows") as read_mock:
+      self.assertEqual(4, self._table.NumRows())
+      self.assertEqual(rows[1:3], self._table.GetRows(1, 3))
+      self.assertEqual(rows[2:], self._table.GetRows(2))
+      self.assertEqual([], self._table.GetRows(3, 1))
+      self.assertEqual(rows[3], self._table.GetRow(3))
+      with self.assertRaises(IndexError):
+        self._table.GetRow(4)
+      with self.assertRaises(IndexError):
+        self._table.GetRow(-1)
+    read_mock.assert_not_called()
+
+
+
+class ColumnarTableTest(absltest.TestCase):
+  """Tests ColumnarTable subclass."""
+
+  _table_name = "test_table"
+  _columns = ["number", "date", "text", "amount"]
+  _column_types = {
+      "number": "int", "date": "date", "text": "str", "amount": "float"}
+
+  def setUp(self):
+    FLAGS.columnar_base_path = FLAGS.test_tmpdir
+    config_file_path = os.path.join(
+        FLAGS.test_tmpdir, "config_{}.json".format(uuid.uuid1()))
+    config = {
+        self._table_name: {
+          "rel_path": "test_{}.csv".format(uuid.uuid1().hex),
+          "columns": self._columns,
+          "column_types": self._column_types,
+          "storage_type": "columnar"}}
+    with open(config_file_path, "w") as f:
+      json.dump(config, f)
+    self.addCleanup(os.remove, config_file_path)
+    FLAGS.storage_config_file = config_file_path
+    self._table = storage_lib.GetStorageTable(self._table_name)
+
+  def testWriteAndRead(self):
+    rows = [
+        {"number": "12", "date": "2016-09-15", "text": "A", "amount": "-1.5"},
+        {"number": "7", "date": "1969-12-31", "text": "B", "amount": "2.25"},
+        {"number": "12", "date": "2016-09-16", "text": "A", "amount": "0.1"},
+    ]
+    for row in rows:
+      self._table.BufferRowForWrite(**row)
+    self._table.WriteBufferedRows()
+
+    table = storage_lib.GetStorageTable(self._table_name)
+    self.assertIsInstance(table, storage_lib.ColumnarTable)
+    self.assertEqual(rows, table.GetAllRows())
+    self.assertEqual(["A", "B"], table.GetStringPool("text"))
+
+  def testGetColumnArrays(self):
+    self._table.WriteRow("12", "1970-01-03", "A", "-1.5")
+    self._table.WriteRow("7", "1970-01-01", "B", "2.25")
+
+    arrays = storage_lib.GetStorageTable(self._table_name).GetColumnArrays()
+    self.assertIsInstance(arrays["number"], storage_lib.np.memmap)
+    self.assertEqual([12, 7], arrays["number"].tolist())
+    self.assertEqual([2, 0], arrays["date"].tolist())
+    self.assertEqual([0, 1], arrays["text"].tolist())
+    self.assertEqual([-1.5, 2.25], arrays["amount"].tolist())
+
+  def testManyWrites(self):
+    """Tests appends that change the length of the .npy headers."""
+    expected = []
+    for batch_size in (1, 12345, 1):
+      for idx in range(batch_size):
+        row = {"number": str(idx), "date": "2000-01-01",
+               "text": "text%d" % (idx % 3), "amount": "1.0"}
+        self._table.BufferRowForWrite(**row)
+        expected.append(row)
+      self._table.WriteBufferedRows()
+    self.assertEqual(len(expected), self._table.NumRows())
+    self.assertEqual(expected, self._table.GetAllRows())
+
+  def testGetRows(self):
+    self._table.WriteRow("12", "1970-01-03", "A", "-1.5")
+    self._table.WriteRow("7", "1970-01-01", "B", "2.25")
+    self.assertEqual(
+        [{"number": "7", "date": "1970-01-01", "text": "B", "amount": "2.25"}],
+        self._table.Tail(1))
+
+  def testInterruptedWriteIsIgnored(self):
+    self._table.WriteRow("1", "2000-01-01", "A", "1.0")
+    # Simulate a crash after only the first column was appended.
+    storage_lib._AppendNpyColumn(
+        self._table._ColumnPath("number", ".npy"),
+        storage_lib.np.array([2], dtype="<i8"), 1)
+
+    table = storage_lib.GetStorageTable(self._table_name)
+    self.assertEqual(1, table.NumRows())
+    table.WriteRow("3", "2000-01-02", "B", "2.0")
+    self.assertEqual(["1", "3"], [row["number"] for row in table])
+
+  def testBoolColumn(self):
+    config = storage_lib.StorageConfig({
+        "rel_path": "test_{}.csv".format(uuid.uuid1().hex),
+        "columns": ["flag"], "column_types": {"flag": "bool"}})
+    table = storage_lib.ColumnarTable(config)
+    table.WriteRow("True")
+    table.WriteRow("false")
+    self.assertEqual(["True", "False"], [row["flag"] for row in table])
+
+
 if __name__ == "__main__":
   absltest.main()
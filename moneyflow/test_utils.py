@@ -11,7 +11,8 @@ class FakeStorageTable(storage_lib.StorageTable):
   _fake_rows = deque()
 
   def __init__(self, table_name, columns, **kwargs):
-    super(FakeStorageTable, self).__init__(table_name, columns)
+    super(FakeStorageTable, self).__init__(
+        table_name, columns, kwargs.get("column_types"))
     if "fake_rows" in kwargs.keys():
       self._fake_rows = kwargs["fake_rows"]
     else:
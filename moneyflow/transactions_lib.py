@@ -1,12 +1,36 @@
 """Library of objects to access tranactions data."""
 
+import array
+import codecs
 import datetime
-import ofxparse
+import decimal
+import fingerprint_lib
+import hashlib
+import json
+import os
+import re
 import storage_lib
+import struct
 
 from collections import deque
 
-TRANSACTION_DATE_FORMAT = "%Y-%m-%d"
+TRANSACTION_DATE_FORMAT = storage_lib.DATE_FORMAT
+
+# Number of transactions deserialized at a time by ReadAll(as_batch=True), and
+# when sidecars catch up with the table.
+_READ_BATCH_SIZE = 4096
+
+# Names of the storage sidecars that hold the fingerprint index and the
+# per-account import watermarks.
+_FINGERPRINT_SIDECAR = "fingerprints"
+_WATERMARKS_SIDECAR = "watermarks"
+
+try:
+  array.array("q")
+  _INT64_TYPECODE = "q"
+except ValueError:
+  # Python 2 has no "q" typecode. "l" is 64 bits wide on 64-bit Unix.
+  _INT64_TYPECODE = "l"
 
 
 class Error(Exception):
@@ -16,10 +40,149 @@ class Error(Exception):
 class TransactionsTable(storage_lib.ObjectStorage):
   """Accesses a table of transaction information."""
 
-  def __init__(self):
+  INDEXES = (
+      storage_lib.Index("account_num"),
+      storage_lib.Index("date"),
+      storage_lib.Index("description"),
+  )
+
+  def __init__(self, streaming=False):
     super(TransactionsTable, self).__init__(
         "transactions", Transaction,
-        ["Account Number", "Date", "Description", "Amount"])
+        ["Account Number", "Date", "Description", "Amount"],
+        streaming=streaming)
+    self._fingerprint_index = None
+    self._watermarks = None
+
+  def Save(self):
+    """Saves new transactions, and updates the fingerprint index and watermarks.
+    """
+    index = self.GetFingerprintIndex()
+    watermarks = self.GetWatermarks()
+    new_txns = [txn for txn in self._objects if txn.is_new]
+    super(TransactionsTable, self).Save()
+    index.Add((txn.fingerprint() for txn in new_txns),
+              index.num_rows + len(new_txns))
+    watermarks.Update(new_txns, watermarks.num_rows + len(new_txns))
+
+  def GetFingerprintIndex(self):
+    """Returns the index of the fingerprints of all stored transactions.
+
+    The index is kept in a sidecar file next to the table, so that duplicates
+    can be detected without reading the whole table. It is brought up to date
+    with rows that were written without going through this class, and rebuilt
+    if the table shrank. Storage types that are not stored on disk get an
+    in-memory index, built from the table.
+
+    Use Transaction.fingerprint() to compute the values to look up.
+
+    Returns:
+      A fingerprint_lib.FingerprintIndex.
+    """
+    if self._fingerprint_index is None:
+      self._fingerprint_index = fingerprint_lib.FingerprintIndex(
+          self._storage.GetSidecarPath(_FINGERPRINT_SIDECAR))
+    index = self._fingerprint_index
+    self._CatchUp(index, lambda txns, num_rows: index.Add(
+        (txn.fingerprint() for txn in txns), num_rows))
+    return index
+
+  def GetWatermarks(self):
+    """Returns the import watermarks of all accounts.
+
+    Like the fingerprint index, the watermarks are kept in a sidecar file and
+    brought up to date with the table.
+
+    Returns:
+      An AccountWatermarks object.
+    """
+    if self._watermarks is None:
+      self._watermarks = AccountWatermarks(
+          self._storage.GetSidecarPath(_WATERMARKS_SIDECAR))
+    self._CatchUp(self._watermarks, self._watermarks.Update)
+    return self._watermarks
+
+  def _CatchUp(self, sidecar, add):
+    """Adds the stored transactions that a sidecar does not cover yet.
+
+    Args:
+      sidecar: Object with a num_rows attribute, the number of table rows it
+        covers, and a Clear() method. It is cleared if the table shrank.
+      add: Function that takes a list of transactions and the number of rows
+        covered once they are added, and adds them to the sidecar.
+    """
+    num_rows = self._storage.NumRows()
+    if sidecar.num_rows > num_rows:
+      sidecar.Clear()
+    while sidecar.num_rows < num_rows:
+      txns = self.GetObjects(
+          sidecar.num_rows, min(num_rows, sidecar.num_rows + _READ_BATCH_SIZE))
+      if not txns:
+        break
+      add(txns, sidecar.num_rows + len(txns))
+
+  def ReadAll(self, overwrite=False, as_batch=False):
+    """Reads all transactions from storage.
+
+    Args:
+      overwrite: If True, overwrites the data in this object with the data that
+        is read. Cannot be combined with as_batch.
+      as_batch: If True, returns a TransactionBatch instead of a deque. For the
+        columnar storage type, the batch is a view of the stored columns.
+
+    Returns:
+      Deque or TransactionBatch of the transactions that were read.
+
+    Raises:
+      ValueError: If both overwrite and as_batch are True.
+    """
+    if not as_batch:
+      return super(TransactionsTable, self).ReadAll(overwrite=overwrite)
+    if overwrite:
+      raise ValueError("A TransactionBatch cannot overwrite the table.")
+    if isinstance(self._storage, storage_lib.ColumnarTable):
+      arrays, descriptions = self.GetColumnArrays()
+      return TransactionBatch(
+          account_nums=arrays["account_number"],
+          dates=arrays["transaction_date"],
+          description_codes=arrays["transaction_description"],
+          descriptions=descriptions,
+          amounts=arrays["transaction_amount"])
+    batch = TransactionBatch()
+    for txns in self.ReadBatches(_READ_BATCH_SIZE):
+      batch.extend(txns)
+    return batch
+
+  def GetTransactionsByDescription(self):
+    """Returns the transactions of every distinct description.
+
+    This is the index on the description attribute. Callers that evaluate
+    something per description can do so once per distinct description instead
+    of once per transaction.
+
+    Returns:
+      Dict that maps each description to the list of its transactions, in the
+      order of self.objects. It must not be modified.
+    """
+    return self.GetIndex("description")
+
+  def GetColumnArrays(self):
+    """Returns the transactions as column arrays, without copying them.
+
+    Only available when the table uses the columnar storage type. See
+    storage_lib.ColumnarTable.GetColumnArrays for the layout of the arrays.
+
+    Returns:
+      Tuple of the dict of column arrays, and the list of distinct descriptions
+      that the transaction_description codes refer to.
+
+    Raises:
+      Error: If the table is not stored in columnar format.
+    """
+    if not isinstance(self._storage, storage_lib.ColumnarTable):
+      raise Error("Column arrays require the columnar storage type.")
+    return (self._storage.GetColumnArrays(),
+            self._storage.GetStringPool("transaction_description"))
 
   def GetSetOfAllTransactions(self):
     """Returns a set containing all transaction objects.
@@ -41,6 +204,130 @@ class TransactionsTable(storage_lib.ObjectStorage):
     return txn_set
 
 
+class AccountWatermarks(object):
+  """Latest imported transaction date of every account.
+
+  Banks re-send overlapping date ranges in every download. The watermark of an
+  account is the latest date of its stored transactions, together with the
+  fingerprints of the transactions on that date. Imported transactions dated
+  after the watermark are new without looking them up, and those on the
+  watermark date can be checked precisely against the fingerprints. Only
+  transactions dated before the watermark, which may have been posted late or
+  come from an older statement, need to be looked up in the fingerprint index.
+
+  When constructed with a path, the watermarks are persisted in a JSON file.
+  Otherwise they are kept in memory only.
+  """
+
+  def __init__(self, path=None):
+    self._path = path
+    self._num_rows = 0
+    # Maps account numbers to (date, set of fingerprints) tuples.
+    self._marks = {}
+    if path is not None and os.path.exists(path):
+      self._Load()
+
+  @property
+  def num_rows(self):
+    """Number of table rows covered by the watermarks."""
+    return self._num_rows
+
+  def GetWatermark(self, account_num):
+    """Returns the watermark date of an account, or None if it has none."""
+    mark = self._marks.get(account_num)
+    return mark[0] if mark else None
+
+  def IsStored(self, txn, fingerprints, fingerprint=None):
+    """Returns True if a transaction is stored already.
+
+    The watermarks must cover all stored transactions.
+
+    Args:
+      txn: Imported transaction.
+      fingerprints: Container of the fingerprints of all stored transactions,
+        such as a FingerprintIndex. It is only used for transactions dated
+        before the watermark of their account.
+      fingerprint: Fingerprint of txn, if it was already computed.
+    """
+    mark = self._marks.get(txn.account_num)
+    if mark is None or txn.date > mark[0]:
+      return False
+    if fingerprint is None:
+      fingerprint = txn.fingerprint()
+    if txn.date == mark[0]:
+      return fingerprint in mark[1]
+    return fingerprint in fingerprints
+
+  def Filter(self, txns, fingerprints):
+    """Generator that drops transactions for which IsStored is True."""
+    for txn in txns:
+      if not self.IsStored(txn, fingerprints):
+        yield txn
+
+  def Update(self, txns, num_rows):
+    """Raises the watermarks to the dates of newly stored transactions.
+
+    Args:
+      txns: Iterable of stored transactions.
+      num_rows: Number of table rows covered once they are added.
+
+    Raises:
+      Error: If the watermarks could not be written.
+    """
+    for txn in txns:
+      mark = self._marks.get(txn.account_num)
+      if mark is None or txn.date > mark[0]:
+        self._marks[txn.account_num] = (txn.date, set([txn.fingerprint()]))
+      elif txn.date == mark[0]:
+        mark[1].add(txn.fingerprint())
+    self._num_rows = num_rows
+    if self._path is not None:
+      self._Write()
+
+  def Clear(self):
+    """Removes all watermarks."""
+    self._num_rows = 0
+    self._marks = {}
+    if self._path is not None and os.path.exists(self._path):
+      os.remove(self._path)
+
+  def _Load(self):
+    """Loads the watermarks. They are rebuilt if the file is invalid."""
+    try:
+      with open(self._path, "r") as f:
+        data = json.load(f)
+      marks = {}
+      for account_num, mark in data["accounts"].items():
+        marks[int(account_num)] = (
+            datetime.datetime.strptime(
+                mark["date"], TRANSACTION_DATE_FORMAT).date(),
+            set(mark["fingerprints"]))
+      self._num_rows = data["num_rows"]
+      self._marks = marks
+    except (IOError, ValueError, KeyError, TypeError, AttributeError):
+      self._num_rows = 0
+      self._marks = {}
+
+  def _Write(self):
+    data = json.dumps({
+        "num_rows": self._num_rows,
+        "accounts": {
+            str(account_num): {
+                "date": date.strftime(TRANSACTION_DATE_FORMAT),
+                "fingerprints": sorted(fingerprints),
+            } for account_num, (date, fingerprints) in self._marks.items()},
+    })
+    tmp_path = "{}.tmp".format(self._path)
+    try:
+      with open(tmp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+      os.rename(tmp_path, self._path)
+    except (IOError, OSError) as e:
+      raise Error("Failed to write %s: %s" % (self._path, e))
+
+
 class Transaction(object):
   """Container for transaction data.
 
@@ -48,11 +335,7 @@ class Transaction(object):
   search for duplicate transactions.
   """
 
-  account_num = 0
-  date = None
-  description = ""
-  amount = 0.0
-  is_new = False
+  __slots__ = ("account_num", "date", "description", "amount", "is_new")
 
   def __init__(self, account_num, date, description, amount):
     if not isinstance(date, datetime.date):
@@ -69,6 +352,14 @@ class Transaction(object):
     self.amount = amount
     self.is_new = False
 
+  def __getstate__(self):
+    # Objects with __slots__ have no __dict__ for pickle protocols < 2 to use.
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __setstate__(self, state):
+    for name, value in zip(self.__slots__, state):
+      setattr(self, name, value)
+
   def todict(self):
     return {
         "account_number": str(self.account_num),
@@ -98,12 +389,23 @@ class Transaction(object):
 
   def __hash__(self):
     """Hash all fields."""
-    return hash(
-        "{}_{}_{}_{:.2f}".format(
-            self.account_num,
-            self.date.strftime(TRANSACTION_DATE_FORMAT),
-            self.description,
-            self.amount))
+    return hash((self.account_num, self.date, self.description, self.amount))
+
+  def fingerprint(self):
+    """Returns a 64-bit fingerprint of all fields, as an int.
+
+    Unlike hash(), the fingerprint is the same across processes and Python
+    versions, so it can be persisted.
+    """
+    description = self.description
+    if not isinstance(description, bytes):
+      description = description.encode("utf-8")
+    key = b"|".join([
+        str(self.account_num).encode("ascii"),
+        self.date.strftime(TRANSACTION_DATE_FORMAT).encode("ascii"),
+        description,
+        "{:.2f}".format(self.amount).encode("ascii")])
+    return struct.unpack("<Q", hashlib.sha1(key).digest()[:8])[0]
 
   def __repr__(self):
     return "account: %r, date: %r, description: %r, amount: %r" % (
@@ -115,6 +417,20 @@ class Transaction(object):
       cls, account_num_str, date_str, description_str, amount_str):
     return [account_num_str, date_str, description_str, amount_str]
 
+  @classmethod
+  def fromtrusted(cls, account_num, date, description, amount):
+    """Builds a transaction from values decoded from our own storage.
+
+    Unlike the constructor, the arguments are not validated.
+    """
+    txn = cls.__new__(cls)
+    txn.account_num = account_num
+    txn.date = date
+    txn.description = description
+    txn.amount = amount
+    txn.is_new = False
+    return txn
+
   @classmethod
   def fromdict(cls, row):
     return cls(
@@ -131,24 +447,310 @@ class Transaction(object):
     return self.__repr__()
 
 
-def ImportTransactions(ofx_file):
+class TransactionBatch(object):
+  """Compact sequence of transactions.
+
+  The fields of the transactions are stored in parallel typed arrays. Dates are
+  stored as days since storage_lib.DATE_EPOCH, and descriptions are
+  dictionary-encoded as codes into a list of distinct descriptions. Transaction
+  objects are only created when items are accessed, so changes to them are not
+  reflected in the batch.
+  """
+
+  def __init__(self, account_nums=None, dates=None, description_codes=None,
+               descriptions=None, amounts=None):
+    """Constructor. Creates an empty batch if no arguments are given.
+
+    The arguments can be any sequences of equal length, such as numpy arrays,
+    in which case they are used without being copied.
+
+    Args:
+      account_nums: Sequence of account numbers.
+      dates: Sequence of dates, as days since storage_lib.DATE_EPOCH.
+      description_codes: Sequence of indices into descriptions.
+      descriptions: List of distinct descriptions.
+      amounts: Sequence of amounts.
+    """
+    if account_nums is None:
+      account_nums = array.array(_INT64_TYPECODE)
+      dates = array.array("i")
+      description_codes = array.array("i")
+      descriptions = []
+      amounts = array.array("d")
+    self._account_nums = account_nums
+    self._dates = dates
+    self._description_codes = description_codes
+    self._descriptions = descriptions
+    self._amounts = amounts
+    self._codes_by_description = None
+
+  def append(self, txn):
+    """Appends a Transaction to the batch."""
+    if not isinstance(self._account_nums, array.array):
+      self._CopyToArrays()
+    if self._codes_by_description is None:
+      self._codes_by_description = {
+          desc: code for code, desc in enumerate(self._descriptions)}
+    code = self._codes_by_description.get(txn.description)
+    if code is None:
+      code = len(self._descriptions)
+      self._descriptions.append(txn.description)
+      self._codes_by_description[txn.description] = code
+    self._account_nums.append(txn.account_num)
+    self._dates.append(txn.date.toordinal() - _EPOCH_ORDINAL)
+    self._description_codes.append(code)
+    self._amounts.append(txn.amount)
+
+  def extend(self, txns):
+    """Appends an iterable of Transactions to the batch."""
+    for txn in txns:
+      self.append(txn)
+
+  def _CopyToArrays(self):
+    """Copies the fields of the batch to arrays that can be appended to."""
+    self._account_nums = array.array(
+        _INT64_TYPECODE, [int(n) for n in self._account_nums])
+    self._dates = array.array("i", [int(d) for d in self._dates])
+    self._description_codes = array.array(
+        "i", [int(c) for c in self._description_codes])
+    self._descriptions = list(self._descriptions)
+    self._amounts = array.array("d", [float(a) for a in self._amounts])
+
+  @property
+  def descriptions(self):
+    """List of distinct descriptions, indexed by description code."""
+    return self._descriptions
+
+  @property
+  def description_codes(self):
+    """Sequence with the description code of every transaction."""
+    return self._description_codes
+
+  def __len__(self):
+    return len(self._account_nums)
+
+  def __getitem__(self, idx):
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError("TransactionBatch index out of range.")
+    return Transaction.fromtrusted(
+        int(self._account_nums[idx]),
+        datetime.date.fromordinal(int(self._dates[idx]) + _EPOCH_ORDINAL),
+        self._descriptions[self._description_codes[idx]],
+        float(self._amounts[idx]))
+
+  def __iter__(self):
+    for idx in range(len(self)):
+      yield self[idx]
+
+
+# Ordinal of the date that TransactionBatch dates are counted from.
+_EPOCH_ORDINAL = storage_lib.DATE_EPOCH.toordinal()
+
+
+def ImportTransactions(ofx_file, watermarks=None, fingerprints=()):
   """Import transatction data from an OFX file.
 
+  Args:
+    ofx_file: Path of the OFX file.
+    watermarks: Optional AccountWatermarks. If given, transactions that are
+      stored already are dropped. See AccountWatermarks.IsStored.
+    fingerprints: Fingerprints of the stored transactions, used with
+      watermarks. Transactions dated before the watermarks are kept unless
+      their fingerprint is in it.
+
   Returns:
     A deque of transactions.
+
+  Raises:
+    Error: If the file is not a valid OFX file.
+  """
+  txns = StreamTransactions(ofx_file)
+  if watermarks is not None:
+    txns = watermarks.Filter(txns, fingerprints)
+  return deque(txns)
+
+
+def StreamTransactions(ofx_file):
+  """Generator that reads transactions from an OFX file, one at a time.
+
+  The file is read in chunks, and each transaction is yielded as soon as its
+  STMTTRN block has been read, so memory use does not grow with the size of
+  the file. Both SGML (OFX 1.x) and XML (OFX 2.x) files are supported. Dates
+  are converted to UTC, and descriptions are upper-cased.
+
+  Args:
+    ofx_file: Path of the OFX file.
+
+  Returns:
+    The next transaction in the file.
+
+  Raises:
+    Error: If the file is not a valid OFX file.
+  """
+  account_num = None
+  fields = None
+  for tag, value in _TokenizeOfx(_ReadOfxText(ofx_file)):
+    tag = tag.upper()
+    if tag == "STMTTRN":
+      if fields is not None:
+        raise Error("Unterminated STMTTRN block in %s." % ofx_file)
+      fields = {}
+    elif tag == "/STMTTRN":
+      if fields is None:
+        raise Error("Unexpected end of STMTTRN block in %s." % ofx_file)
+      yield _MakeOfxTransaction(account_num, fields)
+      fields = None
+    elif fields is not None:
+      # Like ofxparse, use the first occurrence of a tag in the transaction.
+      if not tag.startswith("/"):
+        fields.setdefault(tag, value)
+    elif tag == "ACCTID":
+      account_num = value
+
+
+# Number of bytes read from an OFX file at a time.
+_OFX_READ_CHUNK_SIZE = 1 << 16
+
+_OFX_XML_ENCODING_RE = re.compile(br"<\?xml[^>]*encoding=[\"']([\w.-]+)")
+_OFX_HEADER_RE = re.compile(br"^\s*(\w+):(\S*)\s*$", re.MULTILINE)
+_OFX_TZ_RE = re.compile(r"\[(?P<tz>[-+]?\d+\.?\d*)\:\w*\]$")
+_OFX_FRACTION_RE = re.compile(r"^[0-9]*\.([0-9]{0,5})")
+_OFX_ENTITIES = (
+    ("&lt;", "<"), ("&gt;", ">"), ("&quot;", "\""), ("&apos;", "'"),
+    ("&nbsp;", " "), ("&amp;", "&"))
+
+
+def _ReadOfxText(ofx_file):
+  """Generator that reads an OFX file in chunks of decoded text."""
+  try:
+    with open(ofx_file, "rb") as f:
+      chunk = f.read(_OFX_READ_CHUNK_SIZE)
+      decoder = codecs.getincrementaldecoder(_GetOfxEncoding(chunk))("replace")
+      while chunk:
+        yield decoder.decode(chunk)
+        chunk = f.read(_OFX_READ_CHUNK_SIZE)
+      yield decoder.decode(b"", final=True)
+  except (IOError, OSError) as e:
+    raise Error("Failed to read %s: %s" % (ofx_file, e))
+
+
+def _GetOfxEncoding(head):
+  """Returns the text encoding declared at the start of an OFX file."""
+  match = _OFX_XML_ENCODING_RE.search(head)
+  if match:
+    encoding = match.group(1).decode("ascii")
+  else:
+    header = dict(_OFX_HEADER_RE.findall(head.split(b"<", 1)[0]))
+    charset = header.get(b"CHARSET", b"")
+    if header.get(b"ENCODING", b"").upper() in (b"UTF-8", b"UNICODE"):
+      encoding = "utf-8"
+    elif charset.isdigit():
+      encoding = "cp" + charset.decode("ascii")
+    else:
+      encoding = "latin-1"
+  try:
+    codecs.lookup(encoding)
+  except LookupError:
+    encoding = "latin-1"
+  return encoding
+
+
+def _TokenizeOfx(chunks):
+  """Generator that splits OFX text into tags and the text that follows them.
+
+  Text before the first tag, such as the OFX 1.x header, is skipped, and so are
+  XML declarations and processing instructions.
+
+  Args:
+    chunks: Iterable of text chunks.
+
+  Returns:
+    The next (tag name, stripped text) tuple. End tags start with "/".
+  """
+  buf = ""
+  for chunk in chunks:
+    buf += chunk
+    pos = buf.find("<")
+    if pos < 0:
+      buf = ""
+      continue
+    while True:
+      end = buf.find(">", pos)
+      next_pos = buf.find("<", end + 1) if end >= 0 else -1
+      if next_pos < 0:
+        break
+      tag = buf[pos + 1:end]
+      if not tag.startswith(("?", "!")):
+        yield tag.strip(), _UnescapeOfx(buf[end + 1:next_pos].strip())
+      pos = next_pos
+    buf = buf[pos:]
+  end = buf.find(">")
+  if buf.startswith("<") and end >= 0:
+    tag = buf[1:end]
+    if not tag.startswith(("?", "!")):
+      yield tag.strip(), _UnescapeOfx(buf[end + 1:].strip())
+
+
+def _UnescapeOfx(text):
+  if "&" in text:
+    for entity, char in _OFX_ENTITIES:
+      text = text.replace(entity, char)
+  return text
+
+
+def _MakeOfxTransaction(account_num, fields):
+  """Builds a Transaction from the fields of a STMTTRN block."""
+  if account_num is None:
+    raise Error("Transaction found before the account number: %r" % fields)
+  if "DTPOSTED" not in fields or "TRNAMT" not in fields:
+    raise Error("Transaction is missing its date or amount: %r" % fields)
+  try:
+    account_num = int(account_num)
+  except ValueError:
+    raise Error("Invalid account number: %r" % account_num)
+  return Transaction(
+      account_num, _ParseOfxDate(fields["DTPOSTED"]),
+      fields.get("NAME", "").upper(), _ParseOfxAmount(fields["TRNAMT"]))
+
+
+def _ParseOfxDate(value):
+  """Parses an OFX date-time, like "20101106160000.00[-5:EST]", in UTC.
+
+  Like ofxparse, the time zone offset and fractional seconds are applied before
+  the date is taken.
   """
-  # Parse the OFX file.
-  with open(ofx_file, "r") as f:
-    ofx = ofxparse.OfxParser.parse(f)
-  account_number = ofx.account.number
-
-  # Convert the parsed file to Transaction objects
-  transactions = deque()
-  for ofx_txn in ofx.account.statement.transactions:
-    transactions.append(
-        Transaction(int(account_number),
-                    ofx_txn.date.date(),
-                    ofx_txn.payee.upper(),
-                    float(ofx_txn.amount)))
-
-  return transactions
+  match = _OFX_TZ_RE.search(value)
+  offset = datetime.timedelta(hours=float(match.group("tz")) if match else 0)
+  match = _OFX_FRACTION_RE.search(value)
+  fraction = datetime.timedelta(
+      seconds=float("0." + match.group(1)) if match else 0)
+  try:
+    try:
+      local_date = datetime.datetime.strptime(value[:14], "%Y%m%d%H%M%S")
+    except ValueError:
+      local_date = datetime.datetime.strptime(value[:8], "%Y%m%d")
+  except ValueError:
+    raise Error("Invalid transaction date: %r" % value)
+  return (local_date - offset + fraction).date()
+
+
+def _ParseOfxAmount(value):
+  """Parses an OFX amount, which may use a comma as the decimal separator."""
+  if value in ("null", "-null"):
+    # Some banks use null transactions to report changes to interest rates.
+    return 0.0
+  if re.search(r".*\..*,", value):
+    # 10.000,50
+    value = value.replace(".", "")
+  if re.search(r".*,.*\.", value):
+    # 10,000.50
+    value = value.replace(",", "")
+  if "." not in value and "," in value:
+    # 10000,50
+    value = value.replace(",", ".")
+  try:
+    return float(decimal.Decimal(value))
+  except decimal.InvalidOperation:
+    raise Error("Invalid transaction amount: %r" % value)
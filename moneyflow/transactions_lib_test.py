@@ -4,7 +4,10 @@ import transactions_lib
 
 import os
 import datetime
+import json
 import mock
+import pickle
+import uuid
 import test_utils
 
 from absl import flags
@@ -64,6 +67,137 @@ class TransactionsTableTest(absltest.TestCase):
     self.assertTrue(txn2 in txn_set)
 
 
+  def testSaveUpdatesFingerprintIndex(self):
+    txn = transactions_lib.Transaction(
+        312098, datetime.date(2007, 3, 13), "fingerprinted", -41.23)
+    self._transactions.Add(txn)
+    self._transactions.Save()
+
+    index = self._transactions.GetFingerprintIndex()
+    self.assertEqual(1, index.num_rows)
+    self.assertIn(txn.fingerprint(), index)
+    other = transactions_lib.Transaction(
+        312098, datetime.date(2007, 3, 13), "fingerprinted", -41.24)
+    self.assertNotIn(other.fingerprint(), index)
+
+  def testFingerprintIndexCatchesUpWithStorage(self):
+    index = self._transactions.GetFingerprintIndex()
+    txn = transactions_lib.Transaction(
+        7, datetime.date(2012, 5, 1), "written elsewhere", 3.0)
+    self._fake_storage.WriteRow(**txn.todict())
+
+    index = self._transactions.GetFingerprintIndex()
+    self.assertEqual(1, index.num_rows)
+    self.assertIn(txn.fingerprint(), index)
+
+  def testSaveUpdatesWatermarks(self):
+    self._transactions.Add(transactions_lib.Transaction(
+        5, datetime.date(2012, 5, 1), "older", 1.0))
+    self._transactions.Add(transactions_lib.Transaction(
+        5, datetime.date(2012, 5, 3), "latest", 2.0))
+    self._transactions.Save()
+
+    watermarks = self._transactions.GetWatermarks()
+    self.assertEqual(2, watermarks.num_rows)
+    self.assertEqual(datetime.date(2012, 5, 3), watermarks.GetWatermark(5))
+    self.assertIsNone(watermarks.GetWatermark(6))
+
+  def testReadBatches(self):
+    txns = [
+        transactions_lib.Transaction(
+            1, datetime.date(2010, 1, day), "batched", float(day))
+        for day in range(1, 4)]
+    for txn in txns:
+      self._transactions.Add(txn)
+    self._transactions.Save()
+
+    batches = list(self._transactions.ReadBatches(2))
+    self.assertEqual([txns[:2], txns[2:]], batches)
+
+  def testReadAllWithColumnTypes(self):
+    fake_storage = test_utils.FakeStorageTable(
+        "transactions",
+        ["account_number", "transaction_date", "transaction_description",
+          "transaction_amount"],
+        column_types={
+            "account_number": "int", "transaction_date": "date",
+            "transaction_amount": "float"})
+    with mock.patch.object(
+        transactions_lib.storage_lib, "GetStorageTable",
+        return_value=fake_storage):
+      transactions = transactions_lib.TransactionsTable()
+    txn = transactions_lib.Transaction(
+        5, datetime.date(2012, 2, 29), "typed", -7.25)
+    transactions.Add(txn)
+    transactions.Save()
+
+    with mock.patch.object(
+        transactions_lib.Transaction, "fromdict") as fromdict_mock:
+      txns = transactions.ReadAll()
+    fromdict_mock.assert_not_called()
+    self.assertEqual([txn], list(txns))
+    self.assertFalse(txns[0].is_new)
+
+  def testReadAllAsBatch(self):
+    txns = [
+        transactions_lib.Transaction(
+            1, datetime.date(2010, 1, day), "batched", float(day))
+        for day in range(1, 4)]
+    for txn in txns:
+      self._transactions.Add(txn)
+    self._transactions.Save()
+
+    batch = self._transactions.ReadAll(as_batch=True)
+    self.assertIsInstance(batch, transactions_lib.TransactionBatch)
+    self.assertEqual(txns, list(batch))
+    with self.assertRaises(ValueError):
+      self._transactions.ReadAll(overwrite=True, as_batch=True)
+
+  def testGetTransactionsByDescription(self):
+    txns = [
+        transactions_lib.Transaction(
+            1, datetime.date(2010, 1, day), description, float(day))
+        for day, description in enumerate(["a", "b", "a", "b"], 1)]
+    for txn in txns[:3]:
+      self._transactions.Add(txn)
+    self.assertEqual(
+        {"a": [txns[0], txns[2]], "b": [txns[1]]},
+        self._transactions.GetTransactionsByDescription())
+    # Added transactions are included.
+    self._transactions.Add(txns[3])
+    self.assertEqual(
+        {"a": [txns[0], txns[2]], "b": [txns[1], txns[3]]},
+        self._transactions.GetTransactionsByDescription())
+    # Overwriting the transactions rebuilds the index from the new objects.
+    self._transactions.Save()
+    read_txns = self._transactions.ReadAll(overwrite=True)
+    by_description = self._transactions.GetTransactionsByDescription()
+    self.assertEqual([read_txns[1], read_txns[3]], by_description["b"])
+    self.assertIs(read_txns[1], by_description["b"][0])
+
+  def testObjectsBy(self):
+    txns = [
+        transactions_lib.Transaction(1, datetime.date(2010, 1, 1), "a", 1.0),
+        transactions_lib.Transaction(2, datetime.date(2010, 1, 1), "b", 2.0),
+        transactions_lib.Transaction(1, datetime.date(2010, 1, 2), "c", 3.0),
+    ]
+    for txn in txns:
+      self._transactions.Add(txn)
+    self.assertEqual(
+        [txns[0], txns[2]], self._transactions.ObjectsBy("account_num", 1))
+    self.assertEqual(
+        txns[:2],
+        self._transactions.ObjectsBy("date", datetime.date(2010, 1, 1)))
+    self.assertEqual([], self._transactions.ObjectsBy("account_num", 3))
+    with self.assertRaises(ValueError):
+      self._transactions.ObjectsBy("amount", 1.0)
+    with self.assertRaises(ValueError):
+      self._transactions.ObjectBy("account_num", 1)
+
+  def testGetColumnArraysRequiresColumnarStorage(self):
+    with self.assertRaises(transactions_lib.Error):
+      self._transactions.GetColumnArrays()
+
   def testPrint(self):
     test_account_num = 3243
     test_date = datetime.date(2009, 7, 21)
@@ -90,6 +224,140 @@ class TransactionsTableTest(absltest.TestCase):
     self.assertTrue(txn2 in s)
 
 
+class AccountWatermarksTest(absltest.TestCase):
+
+  def setUp(self):
+    self._latest = transactions_lib.Transaction(
+        1, datetime.date(2016, 3, 10), "latest", -1.0)
+    self._txns = [
+        transactions_lib.Transaction(
+            1, datetime.date(2016, 3, 1), "old", -2.0),
+        self._latest,
+        transactions_lib.Transaction(
+            2, datetime.date(2016, 2, 1), "other account", -3.0),
+    ]
+
+  def testIsStored(self):
+    watermarks = transactions_lib.AccountWatermarks()
+    watermarks.Update(self._txns, 3)
+    self.assertEqual(3, watermarks.num_rows)
+    self.assertEqual(datetime.date(2016, 3, 10), watermarks.GetWatermark(1))
+    fingerprints = set(txn.fingerprint() for txn in self._txns)
+    # On the watermark date, checked precisely without the fingerprints.
+    self.assertTrue(watermarks.IsStored(self._latest, ()))
+    self.assertFalse(watermarks.IsStored(transactions_lib.Transaction(
+        1, datetime.date(2016, 3, 10), "same day", -5.0), fingerprints))
+    # After the watermark, or in an account without one.
+    self.assertFalse(watermarks.IsStored(transactions_lib.Transaction(
+        1, datetime.date(2016, 3, 11), "later", -6.0), fingerprints))
+    self.assertFalse(watermarks.IsStored(transactions_lib.Transaction(
+        3, datetime.date(2000, 1, 1), "new account", -7.0), fingerprints))
+    # Before the watermark, looked up in the fingerprints.
+    self.assertTrue(watermarks.IsStored(self._txns[0], fingerprints))
+    self.assertFalse(watermarks.IsStored(self._txns[0], ()))
+
+  def testOlderTransactionsAreKept(self):
+    watermarks = transactions_lib.AccountWatermarks()
+    watermarks.Update(self._txns, 3)
+    fingerprints = set(txn.fingerprint() for txn in self._txns)
+    late = transactions_lib.Transaction(
+        1, datetime.date(2016, 3, 9), "posted late", -8.0)
+    backfilled = transactions_lib.Transaction(
+        1, datetime.date(2015, 1, 1), "older statement", -9.0)
+    self.assertEqual(
+        [late, backfilled],
+        list(watermarks.Filter(
+            [self._txns[0], late, self._latest, backfilled], fingerprints)))
+
+  def testPersisted(self):
+    path = os.path.join(
+        FLAGS.test_tmpdir, "watermarks_{}".format(uuid.uuid1().hex))
+    transactions_lib.AccountWatermarks(path).Update(self._txns, 3)
+
+    watermarks = transactions_lib.AccountWatermarks(path)
+    self.assertEqual(3, watermarks.num_rows)
+    self.assertEqual(datetime.date(2016, 2, 1), watermarks.GetWatermark(2))
+    self.assertTrue(watermarks.IsStored(self._latest, ()))
+
+    watermarks.Clear()
+    self.assertFalse(os.path.exists(path))
+    self.assertIsNone(
+        transactions_lib.AccountWatermarks(path).GetWatermark(1))
+
+  def testInvalidFileIsIgnored(self):
+    path = os.path.join(
+        FLAGS.test_tmpdir, "watermarks_{}".format(uuid.uuid1().hex))
+    with open(path, "w") as f:
+      f.write("{not json")
+    watermarks = transactions_lib.AccountWatermarks(path)
+    self.assertEqual(0, watermarks.num_rows)
+
+
+class TransactionTest(absltest.TestCase):
+
+  def testSlots(self):
+    txn = transactions_lib.Transaction(
+        1, datetime.date(2001, 1, 1), "slotted", 1.0)
+    self.assertFalse(hasattr(txn, "__dict__"))
+    with self.assertRaises(AttributeError):
+      txn.category = "not a field"
+
+  def testFingerprint(self):
+    txn = transactions_lib.Transaction(
+        1234, datetime.date(1999, 9, 19), "FINGERPRINT", -12.5)
+    # The fingerprint is persisted, so it must never change.
+    self.assertEqual(13600330926012124221, txn.fingerprint())
+    same = transactions_lib.Transaction(
+        1234, datetime.date(1999, 9, 19), u"FINGERPRINT", -12.5)
+    self.assertEqual(txn.fingerprint(), same.fingerprint())
+    other = transactions_lib.Transaction(
+        1234, datetime.date(1999, 9, 20), "FINGERPRINT", -12.5)
+    self.assertNotEqual(txn.fingerprint(), other.fingerprint())
+
+  def testPickle(self):
+    txn = transactions_lib.Transaction(
+        1, datetime.date(2001, 1, 1), "pickled", 1.0)
+    txn.is_new = True
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+      copy = pickle.loads(pickle.dumps(txn, protocol))
+      self.assertEqual(txn, copy)
+      self.assertTrue(copy.is_new)
+
+
+class TransactionBatchTest(absltest.TestCase):
+
+  def setUp(self):
+    self._txns = [
+        transactions_lib.Transaction(
+            4111111111111111, datetime.date(2015, 6, 1), "COFFEE", -3.5),
+        transactions_lib.Transaction(
+            7, datetime.date(1960, 1, 2), "PAYCHECK", 1000.0),
+        transactions_lib.Transaction(
+            7, datetime.date(2015, 6, 3), "COFFEE", -4.25),
+    ]
+
+  def testAppendAndAccess(self):
+    batch = transactions_lib.TransactionBatch()
+    batch.extend(self._txns)
+    self.assertEqual(3, len(batch))
+    self.assertEqual(self._txns, list(batch))
+    self.assertEqual(self._txns[-1], batch[-1])
+    self.assertEqual(["COFFEE", "PAYCHECK"], batch.descriptions)
+    self.assertEqual([0, 1, 0], list(batch.description_codes))
+    with self.assertRaises(IndexError):
+      batch[3]
+
+  def testAppendToBatchOfSequences(self):
+    batch = transactions_lib.TransactionBatch(
+        account_nums=[7], dates=[1], description_codes=[0],
+        descriptions=["PAYCHECK"], amounts=[10.0])
+    batch.append(self._txns[0])
+    self.assertEqual(
+        [transactions_lib.Transaction(
+            7, datetime.date(1970, 1, 2), "PAYCHECK", 10.0), self._txns[0]],
+        list(batch))
+
+
 class ImportTransactionsTest(absltest.TestCase):
 
   def testImport(self):
@@ -103,6 +371,118 @@ class ImportTransactionsTest(absltest.TestCase):
     self.assertEqual("NEW YORK TIMES DIGITAL", t.description)
     self.assertEqual(-15.0, t.amount)
 
+  def _WriteOfxFile(self, contents):
+    file_path = os.path.join(
+        FLAGS.test_tmpdir, "import_{}.ofx".format(uuid.uuid1().hex))
+    with open(file_path, "wb") as f:
+      f.write(contents)
+    return file_path
+
+  def testImportWithWatermarks(self):
+    file_path = os.path.join(
+        FLAGS.test_srcdir, "moneyflow/moneyflow/testdata/test_import.ofx")
+    watermarks = transactions_lib.AccountWatermarks()
+    watermarks.Update(transactions_lib.ImportTransactions(file_path), 1)
+    self.assertEqual(
+        0, len(transactions_lib.ImportTransactions(file_path, watermarks)))
+
+  def testStreamInSmallChunks(self):
+    file_path = os.path.join(
+        FLAGS.test_srcdir, "moneyflow/moneyflow/testdata/test_import.ofx")
+    with mock.patch.object(transactions_lib, "_OFX_READ_CHUNK_SIZE", 7):
+      transactions = list(transactions_lib.StreamTransactions(file_path))
+    self.assertEqual(
+        list(transactions_lib.ImportTransactions(file_path)), transactions)
+
+  def testStreamSgml(self):
+    file_path = self._WriteOfxFile(
+        b"OFXHEADER:100\nDATA:OFXSGML\nENCODING:USASCII\nCHARSET:1252\n\n"
+        b"<OFX><BANKACCTFROM><ACCTID>111\n</BANKACCTFROM>\n"
+        b"<STMTTRN><DTPOSTED>20160101230000[-5:EST]\n<TRNAMT>1.000,50\n"
+        b"<NAME>Caf\xe9 &amp; bar\n<BANKACCTTO><ACCTID>999\n</BANKACCTTO>\n"
+        b"</STMTTRN>\n"
+        b"<BANKACCTFROM><ACCTID>222\n</BANKACCTFROM>\n"
+        b"<STMTTRN><DTPOSTED>20160102\n<TRNAMT>-2\n</STMTTRN>\n</OFX>\n")
+    transactions = list(transactions_lib.StreamTransactions(file_path))
+    self.assertEqual([
+        transactions_lib.Transaction(
+            111, datetime.date(2016, 1, 2), u"CAF\xc9 & BAR", 1000.5),
+        transactions_lib.Transaction(
+            222, datetime.date(2016, 1, 2), "", -2.0),
+    ], transactions)
+
+  def testStreamXml(self):
+    file_path = self._WriteOfxFile(
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<?OFX OFXHEADER="200" VERSION="200"?>\n'
+        b"<OFX><CCACCTFROM><ACCTID>333</ACCTID></CCACCTFROM>"
+        b"<STMTTRN><DTPOSTED>20160301</DTPOSTED><TRNAMT>-3.25</TRNAMT>"
+        b"<NAME>Caf\xc3\xa9</NAME></STMTTRN></OFX>")
+    transactions = list(transactions_lib.StreamTransactions(file_path))
+    self.assertEqual([
+        transactions_lib.Transaction(
+            333, datetime.date(2016, 3, 1), u"CAF\xc9", -3.25),
+    ], transactions)
+
+  def testStreamInvalidTransaction(self):
+    file_path = self._WriteOfxFile(
+        b"<OFX><ACCTID>1\n<STMTTRN><DTPOSTED>20160101\n</STMTTRN>\n</OFX>")
+    with self.assertRaises(transactions_lib.Error):
+      list(transactions_lib.StreamTransactions(file_path))
+
+
+
+class ColumnarTransactionsTableTest(absltest.TestCase):
+  """Tests TransactionsTable backed by the columnar storage type."""
+
+  def setUp(self):
+    FLAGS.columnar_base_path = FLAGS.test_tmpdir
+    config_file_path = os.path.join(
+        FLAGS.test_tmpdir, "config_{}.json".format(uuid.uuid1()))
+    config = {
+        "transactions": {
+            "rel_path": "transactions_{}.csv".format(uuid.uuid1().hex),
+            "columns": [
+                "account_number", "transaction_date",
+                "transaction_description", "transaction_amount"],
+            "column_types": {
+                "account_number": "int", "transaction_date": "date",
+                "transaction_amount": "float"},
+            "storage_type": "columnar"}}
+    with open(config_file_path, "w") as f:
+      json.dump(config, f)
+    self.addCleanup(os.remove, config_file_path)
+    FLAGS.storage_config_file = config_file_path
+    self._txns = [
+        transactions_lib.Transaction(
+            12, datetime.date(2016, 9, 15), "NEW YORK TIMES", -15.0),
+        transactions_lib.Transaction(
+            12, datetime.date(2016, 9, 16), "NEW YORK TIMES", -1.5),
+    ]
+    transactions = transactions_lib.TransactionsTable()
+    for txn in self._txns:
+      transactions.Add(txn)
+    transactions.Save()
+
+  def testGetColumnArrays(self):
+    arrays, descriptions = (
+        transactions_lib.TransactionsTable().GetColumnArrays())
+    self.assertEqual([12, 12], arrays["account_number"].tolist())
+    self.assertEqual([0, 0], arrays["transaction_description"].tolist())
+    self.assertEqual(["NEW YORK TIMES"], descriptions)
+
+  def testReadAllAsBatch(self):
+    batch = transactions_lib.TransactionsTable().ReadAll(as_batch=True)
+    self.assertEqual(self._txns, list(batch))
+
+  def testFingerprintIndexIsPersisted(self):
+    transactions = transactions_lib.TransactionsTable()
+    path = transactions._storage.GetSidecarPath("fingerprints")
+    self.assertTrue(os.path.exists(path + ".fpmeta"))
+    index = transactions.GetFingerprintIndex()
+    self.assertEqual(2, index.num_rows)
+    for txn in self._txns:
+      self.assertIn(txn.fingerprint(), index)
 
 
 if __name__ == "__main__":
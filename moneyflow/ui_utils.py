@@ -41,7 +41,7 @@ def GetIntegerFromUser(msg, lower, upper):
   return idx
 
 
-def CategorizeTransactions(transactions):
+def CategorizeTransactions(transactions, workers=1):
   """Check that all transactions have categories.
 
   If there are uncategorized transactions, the user is offered the
@@ -49,6 +49,7 @@ def CategorizeTransactions(transactions):
 
   Args:
     transactions: An iterable of Transaction objects to categorize.
+    workers: Maximum number of processes that look up categories.
   """
   if len(transactions) == 0:
     "No transactions to categorize."
@@ -57,9 +58,30 @@ def CategorizeTransactions(transactions):
   cat_table = categories_lib.CategoriesTable()
   cat_table.ReadAll(overwrite=True)
 
-  AddCategoriesToTransactions(cat_table, transactions)
+  # The workers are shared by the whole categorization loop. The loop runs no
+  # threads, so they are only started once a lookup needs them, rather than
+  # idling while the user is prompted.
+  started = cat_table.StartWorkers(workers, lazy=True)
+  try:
+    AddCategoriesToTransactions(cat_table, transactions)
+  finally:
+    if started:
+      cat_table.StopWorkers()
+  PrintCategoryLookupStats(cat_table)
   print("Saving newly added categories.")
   cat_table.Save()
+  cat_table.SaveCategoryAssignments()
+
+
+def PrintCategoryLookupStats(cat_table):
+  """Prints how often category lookups were answered by the lookup memo."""
+  stats = cat_table.GetLookupStats()
+  lookups = stats.hits + stats.misses
+  if lookups:
+    print("Category lookups: {} memo hits, {} misses ({:.1%} hit rate), {} "
+          "descriptions memoized.".format(
+              stats.hits, stats.misses, float(stats.hits) / lookups,
+              stats.size))
 
 
 def AddCategoriesToTransactions(cat_table, transactions):
@@ -83,13 +105,15 @@ def AddCategoriesToTransactions(cat_table, transactions):
   # function. in case the user enters a new regex category. The new regex's
   # matching should be checked against these transactions.
   transactions_table = None
+  # Categories added in the loop below are added to the lookup incrementally.
+  cat_table.InitializeCategoryLookup()
   while True:
     # For every transaction, check if a category exists.
-    cat_table.InitializeCategoryLookup()
     categories = deque()
     uncat_txns = deque()
-    for txn in transactions:
-      cat = cat_table.GetCategoryForTransaction(txn)
+    for txn, cat in zip(
+        transactions,
+        cat_table.GetCategoriesForTransactions(transactions)):
       if cat is None:
         uncat_txns.append(txn)
         categories.append(cat)
@@ -150,15 +174,14 @@ def _PrintRegexCategoryInfo(re_cat, transactions_table, categories_table):
       that will be used to verify the regex category with the user. Matching
       transactions with the new regex category will be printed.
     categories_table: A fully populated categories_lib.CategoriesTable with
-      existing categories. Conflicts between the regex categories and these
-      categories will be printed.
+      existing categories, whose category lookup is initialized. Conflicts
+      between the regex categories and these categories will be printed.
 
   Raises:
     ValueError: if category.is_regex is False.
   """
   if not re_cat.is_regex:
     raise ValueError("category.is_regex must be True.")
-  categories_table.InitializeCategoryLookup()
 
   # List of transactions that match the regex.
   matching_transactions = deque()
@@ -167,12 +190,16 @@ def _PrintRegexCategoryInfo(re_cat, transactions_table, categories_table):
   # matching transaction.
   matching_transaction_cats = deque()
 
+  # The regex and the existing categories are evaluated once per distinct
+  # description, not once per transaction.
   regex = categories_lib.CompiledRegex(re_cat.transaction_description)
-  for transaction in transactions_table.objects:
-    if categories_lib.MatchRegexObj(regex, transaction.description):
-      matching_transactions.append(transaction)
-      matching_transaction_cats.append(
-          categories_table.GetCategoryForTransaction(transaction))
+  for description, txns in (
+      transactions_table.GetTransactionsByDescription().items()):
+    if not categories_lib.MatchRegexObj(regex, description):
+      continue
+    cat = categories_table.GetCategoryForTransaction(txns[0])
+    matching_transactions.extend(txns)
+    matching_transaction_cats.extend([cat] * len(txns))
 
   if matching_transactions:
     print("Transactions that match the regex category (%s) and their existing "